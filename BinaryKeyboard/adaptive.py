@@ -0,0 +1,136 @@
+"""
+Adaptive order-1 rank coding for the receiver's adaptive mode.
+
+Both ends keep the same ContextModel. It is reset when adaptive mode
+starts and learns only the bytes sent in the mode, so other modes pay
+nothing for it and every adaptive stream is decoded the same way however
+the link got there. PROTO_CLEAR_BUFFER inside the mode resets it too.
+
+In adaptive mode each byte is sent as its rank in a short move-to-front
+list of the bytes that followed the previous byte (CONTEXT_RANKS of them).
+Rank == list length is an escape; it is followed by the byte's rank in a
+global move-to-front list of all 256 values, and global rank 256 ends the
+mode. Ranks go out as Elias gamma codes of rank + 1: rank 0 costs 1 bit,
+ranks 1-2 cost 3, ranks 3-6 cost 5 and so on.
+"""
+
+from huffman import SYM_END
+
+CONTEXT_RANKS = 8  # successors remembered per previous byte
+END_RANK = 256     # global rank that ends the mode
+
+# Initial global order: space and common English letters first
+COMMON = b" etaoinsrhldcumfpgwybvkxjqz"
+INITIAL_MTF = COMMON + bytes(v for v in range(256) if v not in COMMON)
+
+
+class ContextModel:
+    """Order-1 move-to-front lists plus a global move-to-front list."""
+
+    def __init__(self):
+        self.mtf = bytearray(256)
+        self.ctx = bytearray(256 * CONTEXT_RANKS)
+        self.ctx_len = bytearray(256)
+        self.prev = 0
+        self.clear()
+
+    def clear(self):
+        """Back to the initial state both ends start from."""
+        self.mtf[:] = INITIAL_MTF
+        ctx_len = self.ctx_len
+        for i in range(256):
+            ctx_len[i] = 0
+        self.prev = 0x20
+
+    def context_rank(self, value):
+        """Rank of value after self.prev, or -1 if it is not in the list."""
+        ctx = self.ctx
+        base = self.prev * CONTEXT_RANKS
+        for j in range(self.ctx_len[self.prev]):
+            if ctx[base + j] == value:
+                return j
+        return -1
+
+    def global_rank(self, value):
+        mtf = self.mtf
+        i = 0
+        while mtf[i] != value:
+            i += 1
+        return i
+
+    def learn(self, value):
+        """Move value to the front of both lists and make it the context."""
+        mtf = self.mtf
+        i = self.global_rank(value)
+        while i:
+            mtf[i] = mtf[i - 1]
+            i -= 1
+        mtf[0] = value
+
+        ctx = self.ctx
+        prev = self.prev
+        base = prev * CONTEXT_RANKS
+        j = self.context_rank(value)
+        if j < 0:
+            # New successor: push the oldest one off the end if full
+            n = self.ctx_len[prev]
+            if n < CONTEXT_RANKS:
+                self.ctx_len[prev] = n + 1
+            else:
+                n -= 1
+            j = n
+        while j:
+            ctx[base + j] = ctx[base + j - 1]
+            j -= 1
+        ctx[base] = value
+        self.prev = value
+
+
+class AdaptiveDecoder(ContextModel):
+    """ContextModel that also decodes ranks one received bit at a time.
+
+    bit() has the same contract as huffman.PrefixDecoder.bit(): it returns
+    a protocol byte, SYM_END, or -1 while a code is incomplete. The model
+    itself only changes through learn() and clear().
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.reset()
+
+    def reset(self):
+        """Drop any partly received code (the model is kept)."""
+        self.escaped = False
+        self.zeros = 0
+        self.value = 0
+        self.left = -1  # payload bits still to read, -1 while counting zeros
+
+    def bit(self, b):
+        if self.left < 0:
+            if not b:
+                self.zeros += 1
+                return -1
+            self.value = 1
+            self.left = self.zeros
+        else:
+            self.value = (self.value << 1) | b
+            self.left -= 1
+        if self.left:
+            return -1
+
+        rank = self.value - 1
+        self.zeros = 0
+        self.left = -1
+        if self.escaped:
+            self.escaped = False
+            if rank >= END_RANK:
+                return SYM_END
+            return self.mtf[rank]
+        n = self.ctx_len[self.prev]
+        if rank < n:
+            return self.ctx[self.prev * CONTEXT_RANKS + rank]
+        if rank > n:
+            # Not something the sender could have produced: give up
+            return SYM_END
+        self.escaped = True
+        return -1
@@ -1,376 +1,255 @@
-import board
 import time
-import usb_hid
-from digitalio import DigitalInOut, Pull
-from adafruit_debouncer import Debouncer
-from adafruit_hid.keyboard import Keyboard
-from adafruit_hid.keycode import Keycode
+code_start_ns = time.monotonic_ns()  # see "Ready" below
+
+import board
+import gc
 
 import supervisor
 supervisor.runtime.autoreload = False
 # disables autoreload to prevent issues with USB HID
 
+# For LOG_LEVEL below; tracelog.py is small
+from tracelog import LEVEL_OFF, LEVEL_ERROR, LEVEL_INFO, LEVEL_TRACE
+
+# Only these, the settings and the key scan come before the imports below, so
+# keypad.Keys is queueing pulses while the rest loads. Copy the other
+# modules as .mpy (python -m tools.boot --build) so they load without
+# being compiled on the board.
 
-# -------------------------
-# Setup keyboard
-# -------------------------
-kpd = Keyboard(usb_hid.devices)
 
 # -------------------------
-# Timing / pins
+# Pins
 # -------------------------
-CLEAR_TIMEOUT = 2.0  # seconds
-# Start symbol is now: key0 then key1, about 40ms apart
-# We detect it as: key0 followed by key1 within 50ms
-START_SYMBOL_TIMEOUT = 0.050  # 50ms window for start symbol sequence
-NUM_KEYS = 2
+# Timing and protocol tables live in receiver.py
 PINS = (board.GP2, board.GP3)
 
-# Each key maps to a binary digit
-KEYMAP = ("0", "1")
+# Parallel lanes (Teensy LANES): 0 for the two-key protocol, or 1/2/4/8
+# data keys plus a strobe, with PINS listing the strobe first and then
+# data lanes 0..N-1, e.g. LANES = 4 with
+# PINS = (board.GP2, board.GP3, board.GP4, board.GP5, board.GP6).
+# Lane strokes are collected over CHORD_WINDOW_MS (below), which is also
+# the skew the lanes can have against the strobe.
+LANES = 0
+
+# "keypad":    keypad.Keys scans in the background and queues timestamped
+#              edges, so a busy main loop cannot lose or mis-time a press
+# "debouncer": poll adafruit_debouncer.Debouncer objects from the main loop
+INPUT_BACKEND = "keypad"
+KEYPAD_SCAN_INTERVAL = 0.001  # seconds between background scans
+KEYPAD_DEBOUNCE_SCANS = 10    # stable scans before an edge counts (~10ms)
+KEYPAD_MAX_EVENTS = 128       # queued edges, ~2.5s of pulses at 40ms bits
+
+# LEVEL_OFF / LEVEL_ERROR / LEVEL_INFO / LEVEL_TRACE
+# Records are buffered and printed only while the keys are idle,
+# so even LEVEL_TRACE does not slow down decoding.
+LOG_LEVEL = LEVEL_INFO
+
+# Accept PROTO_HUFFMAN_MODE (0xFF) using the code table in huffman_table.py
+HUFFMAN_MODE = True
+# Accept PROTO_ADAPTIVE_MODE (0xFE). Costs ~2.5KB of RAM and a
+# move-to-front update per byte received in that mode
+ADAPTIVE_MODE = True
+
+# Macro dictionary for opcodes 0xB3-0xEF (see macros.py); None to disable
+MACRO_FILE = "/macros.txt"
+
+# Accept chord-started ternary frames (Teensy TERNARY_FRAMES): both keys
+# within this many ms count as one chord. 0 disables them, which also saves
+# the wait for a second key on the first press of every frame.
+CHORD_WINDOW_MS = 8
+
+# Learn the bit period and fill in missed pulses (receiver.py DESYNC_GAP_X4).
+# Needs evenly spaced pulses and the Teensy's FRAME_GAP, which lets a frame
+# lost to a missed start or length pulse be skipped to the next frame;
+# without it such a frame can leave the stream out of step for seconds.
+RESYNC = True
+
+# SECDED codewords for every byte of a binary frame (Teensy FEC_FRAMES, see
+# fec.py). Must match the sender: 13 pulses a byte instead of 8. Flipped
+# bits are corrected; missed and extra pulses only with RESYNC, which fills
+# in the former and finds the latter, and bursts it cannot mend are dropped.
+FEC = False
+
+# Scan, decode and type as separate asyncio tasks (pipeline.py), so macros
+# and long PROTO_COPY outputs never hold up the key scan. Needs the asyncio
+# library; False runs everything in one loop (Receiver.run()).
+PIPELINE = True
+
+# Counters and timing histograms (telemetry.py). Send "m" on the serial
+# console for line-protocol records (with the startup figures, see
+# "Ready"), "b" for a binary record, "z" to reset.
+TELEMETRY = True
+
+# Record the last 2048 key edges (edgetrace.py, ~10KB of RAM) so a
+# mis-typed transmission can be replayed with tools.replay. Send "t" on the
+# serial console to print the trace, "f" to save it to EDGE_TRACE_FILE,
+# which needs CIRCUITPY writable from code (storage.remount("/", False) in
+# boot.py, which makes it read-only over USB). Needs TELEMETRY, which
+# reads the console.
+EDGE_TRACE = True
+EDGE_TRACE_FILE = "/edges.bin"
 
 # -------------------------
-# Initialize keys
+# Start the key scan
 # -------------------------
-keys = []
-for pin in PINS:
-    dio = DigitalInOut(pin)
-    dio.pull = Pull.UP
-    keys.append(Debouncer(dio))
+# From here keypad.Keys timestamps and queues edges in the background, so
+# pulses sent before the receiver is ready are decoded late, not lost
+# (up to KEYPAD_MAX_EVENTS). The debouncer backend sees nothing until the
+# main loop runs.
+scanner = None
+if INPUT_BACKEND == "keypad":
+    import keypad
+    scanner = keypad.Keys(PINS, value_when_pressed=False, pull=True,
+                          interval=KEYPAD_SCAN_INTERVAL,
+                          debounce_threshold=KEYPAD_DEBOUNCE_SCANS,
+                          max_events=KEYPAD_MAX_EVENTS)
 
-last_key_time = time.monotonic()
+import usb_hid
+from adafruit_ticks import ticks_ms
+from adafruit_hid import find_device
+from adafruit_hid.keyboard import Keyboard
+
+from receiver import Receiver, DebouncedPins, KeypadPins, ReportHID, GCMonitor
+from tracelog import TraceLog
 
 # -------------------------
-# State machine
+# Setup keyboard
 # -------------------------
-STATE_WAIT_START_0 = 0  # Waiting for key0 (first part of start symbol)
-STATE_WAIT_START_1 = 1  # Got key0, waiting for key1 to complete start symbol
-STATE_RECEIVING = 2     # Receiving data bits
+# ReportHID sends whole reports straight to the keyboard device
+kbd_device = find_device(usb_hid.devices, usage_page=0x1, usage=0x6)
+kpd = Keyboard(kbd_device)
 
-state = STATE_WAIT_START_0
-state_enter_time = 0.0
-bit_buffer = ""
+# -------------------------
+# Initialize keys
+# -------------------------
+trace = None
+if EDGE_TRACE and TELEMETRY:
+    from edgetrace import (EdgeTrace, FLAG_DEBOUNCER, FLAG_HUFFMAN, FLAG_ADAPTIVE,
+                           FLAG_MACROS, FLAG_FEC, FLAG_RESYNC, FLAG_PIPELINE)
+    flags = 0
+    for on, flag in ((INPUT_BACKEND != "keypad", FLAG_DEBOUNCER), (HUFFMAN_MODE, FLAG_HUFFMAN),
+                     (ADAPTIVE_MODE, FLAG_ADAPTIVE), (MACRO_FILE, FLAG_MACROS), (FEC, FLAG_FEC),
+                     (RESYNC, FLAG_RESYNC), (PIPELINE, FLAG_PIPELINE)):
+        if on:
+            flags |= flag
+    # Both backends debounce over ~10ms (Debouncer's default interval)
+    trace = EdgeTrace(flags=flags, keys=len(PINS), lanes=LANES,
+                      chord_window_ms=CHORD_WINDOW_MS,
+                      debounce_ms=int(KEYPAD_SCAN_INTERVAL * KEYPAD_DEBOUNCE_SCANS * 1000))
+
+if scanner is not None:
+    pins = KeypadPins(scanner, keypad.Event(), trace)
+else:
+    from digitalio import DigitalInOut, Pull
+    from adafruit_debouncer import Debouncer
+    keys = []
+    dios = []
+    for pin in PINS:
+        dio = DigitalInOut(pin)
+        dio.pull = Pull.UP
+        dios.append(dio)
+        keys.append(Debouncer(dio))
+    pins = DebouncedPins(keys, trace, dios)
+
+log = TraceLog(ticks_ms, LOG_LEVEL)
+
+telemetry = None
+if TELEMETRY:
+    import sys
+    import binascii
+    import microcontroller
+    import usb_cdc
+    from telemetry import Telemetry
+
+    def console_command():
+        if supervisor.runtime.serial_bytes_available:
+            return sys.stdin.read(1)
+        return ""
+
+    commands = None
+    if trace is not None:
+        def save_trace():
+            try:
+                trace.save(EDGE_TRACE_FILE)
+                log.text(LEVEL_ERROR, "Edge trace saved to {}".format(EDGE_TRACE_FILE))
+            except OSError as e:
+                log.text(LEVEL_ERROR, "Edge trace not saved: {}".format(e))
+
+        commands = {"t": trace.dump, "f": save_trace}
+
+    console = usb_cdc.console
+    telemetry = Telemetry(ticks_ms, unit=binascii.hexlify(microcontroller.cpu.uid).decode(),
+                          command=console_command,
+                          write_bytes=console.write if console is not None else None,
+                          commands=commands)
+
+gc_monitor = GCMonitor(gc, time.monotonic_ns, log=log)
+hid = ReportHID(kpd, telemetry, device=kbd_device)
+if PIPELINE:
+    from pipeline import Pipeline, QueuedHID
+    hid = QueuedHID(hid)
+receiver = Receiver(ticks_ms, pins, hid,
+                    log=log, gc_monitor=gc_monitor,
+                    chord_window_ms=CHORD_WINDOW_MS,
+                    lanes=LANES, fec=FEC, resync=RESYNC, telemetry=telemetry)
 
 # -------------------------
-# Protocol mappings
+# Deferred setup
 # -------------------------
+# Only needed once a mode switch or macro byte arrives: built when the
+# keys are first idle (see Receiver.defer())
+if HUFFMAN_MODE:
+    def load_huffman():
+        from huffman import PrefixDecoder, build_tree
+        import huffman_table
+        receiver.prefix = PrefixDecoder(build_tree(huffman_table.LENGTH_COUNTS,
+                                                   huffman_table.SYMBOLS))
+
+    receiver.defer(load_huffman)
+
+if ADAPTIVE_MODE:
+    def load_adaptive():
+        from adaptive import AdaptiveDecoder
+        receiver.adaptive = AdaptiveDecoder()
+
+    receiver.defer(load_adaptive)
+
+if MACRO_FILE:
+    def load_macro_file():
+        from macros import load_macros
+        try:
+            receiver.macros = load_macros(MACRO_FILE)
+        except OSError:
+            log.text(LEVEL_ERROR, "No macro file {}".format(MACRO_FILE))
+        except ValueError as e:
+            log.text(LEVEL_ERROR, "Macros disabled: {}".format(e))
+        gc_monitor.collect()  # drop the parser's temporaries
+
+    receiver.defer(load_macro_file)
 
-# Modifier PRESS (0x80-0x87)
-MOD_PRESS_MAP = {
-    0x80: Keycode.LEFT_CONTROL,
-    0x81: Keycode.LEFT_SHIFT,
-    0x82: Keycode.LEFT_ALT,
-    0x83: Keycode.LEFT_GUI,
-    0x84: Keycode.RIGHT_CONTROL,
-    0x85: Keycode.RIGHT_SHIFT,
-    0x86: Keycode.RIGHT_ALT,
-    0x87: Keycode.RIGHT_GUI,
-}
-
-# Modifier RELEASE (0x88-0x8F)
-MOD_RELEASE_MAP = {
-    0x88: Keycode.LEFT_CONTROL,
-    0x89: Keycode.LEFT_SHIFT,
-    0x8A: Keycode.LEFT_ALT,
-    0x8B: Keycode.LEFT_GUI,
-    0x8C: Keycode.RIGHT_CONTROL,
-    0x8D: Keycode.RIGHT_SHIFT,
-    0x8E: Keycode.RIGHT_ALT,
-    0x8F: Keycode.RIGHT_GUI,
-}
-
-# Navigation keys (0x90-0x9D)
-NAV_MAP = {
-    0x90: Keycode.RIGHT_ARROW,
-    0x91: Keycode.LEFT_ARROW,
-    0x92: Keycode.DOWN_ARROW,
-    0x93: Keycode.UP_ARROW,
-    0x94: Keycode.BACKSPACE,
-    0x95: Keycode.ENTER,
-    0x96: Keycode.TAB,
-    0x97: Keycode.ESCAPE,
-    0x98: Keycode.DELETE,
-    0x99: Keycode.INSERT,
-    0x9A: Keycode.HOME,
-    0x9B: Keycode.END,
-    0x9C: Keycode.PAGE_UP,
-    0x9D: Keycode.PAGE_DOWN,
-}
-
-PROTO_CLEAR_BUFFER = 0x9E
-
-# Function keys (0xA0-0xAB)
-FUNC_MAP = {
-    0xA0: Keycode.F1,
-    0xA1: Keycode.F2,
-    0xA2: Keycode.F3,
-    0xA3: Keycode.F4,
-    0xA4: Keycode.F5,
-    0xA5: Keycode.F6,
-    0xA6: Keycode.F7,
-    0xA7: Keycode.F8,
-    0xA8: Keycode.F9,
-    0xA9: Keycode.F10,
-    0xAA: Keycode.F11,
-    0xAB: Keycode.F12,
-}
-
-# Other special keys
-PROTO_CAPS_LOCK = 0xB0
-PROTO_FN_PRESS = 0xB1
-PROTO_FN_RELEASE = 0xB2
-
-def ascii_to_keypress(ch):
-    """Convert ASCII char to (keycode, needs_shift)."""
-    c = ord(ch)
-    
-    # Lowercase a-z
-    if ord('a') <= c <= ord('z'):
-        return (Keycode.A + (c - ord('a')), False)
-    
-    # Uppercase A-Z
-    if ord('A') <= c <= ord('Z'):
-        return (Keycode.A + (c - ord('A')), True)
-    
-    # Numbers 0-9
-    if c == ord('0'):
-        return (Keycode.ZERO, False)
-    if ord('1') <= c <= ord('9'):
-        return (Keycode.ONE + (c - ord('1')), False)
-    
-    # Shift+number symbols
-    shift_num = {
-        '!': Keycode.ONE, '@': Keycode.TWO, '#': Keycode.THREE,
-        '$': Keycode.FOUR, '%': Keycode.FIVE, '^': Keycode.SIX,
-        '&': Keycode.SEVEN, '*': Keycode.EIGHT, '(': Keycode.NINE,
-        ')': Keycode.ZERO,
-    }
-    if ch in shift_num:
-        return (shift_num[ch], True)
-    
-    # Other punctuation
-    other = {
-        ' ': (Keycode.SPACE, False),
-        '-': (Keycode.MINUS, False),
-        '_': (Keycode.MINUS, True),
-        '=': (Keycode.EQUALS, False),
-        '+': (Keycode.EQUALS, True),
-        '[': (Keycode.LEFT_BRACKET, False),
-        '{': (Keycode.LEFT_BRACKET, True),
-        ']': (Keycode.RIGHT_BRACKET, False),
-        '}': (Keycode.RIGHT_BRACKET, True),
-        '\\': (Keycode.BACKSLASH, False),
-        '|': (Keycode.BACKSLASH, True),
-        ';': (Keycode.SEMICOLON, False),
-        ':': (Keycode.SEMICOLON, True),
-        "'": (Keycode.QUOTE, False),
-        '"': (Keycode.QUOTE, True),
-        '`': (Keycode.GRAVE_ACCENT, False),
-        '~': (Keycode.GRAVE_ACCENT, True),
-        ',': (Keycode.COMMA, False),
-        '<': (Keycode.COMMA, True),
-        '.': (Keycode.PERIOD, False),
-        '>': (Keycode.PERIOD, True),
-        '/': (Keycode.FORWARD_SLASH, False),
-        '?': (Keycode.FORWARD_SLASH, True),
-    }
-    if ch in other:
-        return other[ch]
-    
-    return (None, False)
-
-def emergency_clear():
-    """Emergency clear - release all keys and reset state."""
-    global state, bit_buffer
-    print("!!! EMERGENCY CLEAR !!!")
-    kpd.release_all()
-    state = STATE_WAIT_START_0
-    bit_buffer = ""
-
-# Track Fn key state
-fn_pressed = False
-
-def process_byte(value):
-    """Process a complete received byte"""
-    global fn_pressed
-    
-    print("BYTE: 0x{:02X}".format(value))
-    
-    # Check for Fn key press/release
-    if value == PROTO_FN_PRESS:
-        fn_pressed = True
-        print("  FN PRESS")
-        return
-    elif value == PROTO_FN_RELEASE:
-        fn_pressed = False
-        print("  FN RELEASE")
-        return
-    
-    # Emergency clear command
-    if value == PROTO_CLEAR_BUFFER:
-        emergency_clear()
-        return
-    
-    # Modifier PRESS
-    if value in MOD_PRESS_MAP:
-        kc = MOD_PRESS_MAP[value]
-        print("  MOD PRESS")
-        kpd.press(kc)
-        return
-    
-    # Modifier RELEASE
-    if value in MOD_RELEASE_MAP:
-        kc = MOD_RELEASE_MAP[value]
-        print("  MOD RELEASE")
-        kpd.release(kc)
-        return
-    
-    # Navigation keys
-    if value in NAV_MAP:
-        kc = NAV_MAP[value]
-        print("  NAV")
-        kpd.press(kc)
-        kpd.release(kc)
-        return
-    
-    # Function keys
-    if value in FUNC_MAP:
-        kc = FUNC_MAP[value]
-        print("  FUNC")
-        
-        # If Fn is pressed, send the Fn+function key combination
-        if fn_pressed:
-            print("  (with Fn)")
-            # On most keyboards, Fn+Function key sends a different HID code
-            # You may need to adjust these mappings based on your specific keyboard
-            # Define Fn+Function key combinations
-            # Format: Keycode.Fn: (modifier, key)
-            fn_mapping = {
-                Keycode.F1: (Keycode.LEFT_CONTROL, Keycode.F1),  # Fn+F1 = Ctrl+F1
-                Keycode.F2: (Keycode.LEFT_CONTROL, Keycode.F2),  # Fn+F2 = Ctrl+F2
-                Keycode.F3: (Keycode.LEFT_CONTROL, Keycode.F3),  # Fn+F3 = Ctrl+F3
-                Keycode.F4: (Keycode.LEFT_CONTROL, Keycode.F4),  # Fn+F4 = Ctrl+F4
-                Keycode.F5: (Keycode.LEFT_CONTROL, Keycode.F5),  # Fn+F5 = Ctrl+F5
-                Keycode.F6: (Keycode.LEFT_CONTROL, Keycode.F6),  # Fn+F6 = Ctrl+F6
-                Keycode.F7: (Keycode.LEFT_CONTROL, Keycode.F7),  # Fn+F7 = Ctrl+F7
-                Keycode.F8: (Keycode.LEFT_CONTROL, Keycode.F8),  # Fn+F8 = Ctrl+F8
-                Keycode.F9: (Keycode.LEFT_CONTROL, Keycode.F9),  # Fn+F9 = Ctrl+F9
-                Keycode.F10: (Keycode.LEFT_CONTROL, Keycode.F10), # Fn+F10 = Ctrl+F10
-                Keycode.F11: (Keycode.LEFT_CONTROL, Keycode.F11), # Fn+F11 = Ctrl+F11
-                Keycode.F12: (Keycode.LEFT_CONTROL, Keycode.F12)  # Fn+F12 = Ctrl+F12
-            }
-            
-            if kc in fn_mapping:
-                mod, key = fn_mapping[kc]
-                kpd.press(mod, key)
-                kpd.release_all()
-            else:
-                # Default behavior if no specific mapping
-                kpd.press(Keycode.LEFT_ALT, kc)
-                kpd.release_all()
-        else:
-            # Normal function key press
-            kpd.press(kc)
-            kpd.release(kc)
-        return
-    
-    # Caps Lock
-    if value == PROTO_CAPS_LOCK:
-        print("  CAPS LOCK")
-        kpd.press(Keycode.CAPS_LOCK)
-        kpd.release(Keycode.CAPS_LOCK)
-        return
-    
-    # Control characters (Ctrl+A=0x01 ... Ctrl+Z=0x1A)
-    if 0x01 <= value <= 0x1A:
-        letter_kc = Keycode.A + (value - 1)
-        print("  CTRL+{}".format(chr(ord('a') + value - 1)))
-        kpd.press(Keycode.LEFT_CONTROL)
-        kpd.press(letter_kc)
-        kpd.release(letter_kc)
-        kpd.release(Keycode.LEFT_CONTROL)
-        return
-    
-    # Printable ASCII (0x20-0x7E)
-    if 0x20 <= value <= 0x7E:
-        ch = chr(value)
-        keycode, needs_shift = ascii_to_keypress(ch)
-        if keycode is not None:
-            print("  ASCII '{}'".format(ch))
-            if needs_shift:
-                kpd.press(Keycode.LEFT_SHIFT)
-            kpd.press(keycode)
-            kpd.release(keycode)
-            if needs_shift:
-                kpd.release(Keycode.LEFT_SHIFT)
-            return
-    
-    print("  UNKNOWN")
-
-debug_press_count = 0
-
-print("Receiver started!")
+# -------------------------
+# Ready
+# -------------------------
+# Time from reset (and from the start of code.py) to here, and the heap
+# left, also on the console "m" record for tools.boot to check
+ready_ns = time.monotonic_ns()
+gc_monitor.collect()
+ready_ms = ready_ns // 1000000
+code_ms = (ready_ns - code_start_ns) // 1000000
+free = gc.mem_free()
+# Otherwise a reload: the clock also counts the runs before this one
+cold = supervisor.runtime.run_reason == supervisor.RunReason.STARTUP
+if telemetry is not None:
+    telemetry.boot(ready_ms, code_ms, free, cold)
+
+log.text(LEVEL_ERROR, "Receiver started! {}{}ms in code.py, {} bytes free".format(
+    "{}ms after reset, ".format(ready_ms) if cold else "", code_ms, free))
 
 # -------------------------
 # Main loop
 # -------------------------
-while True:
-    current_time = time.monotonic()
-
-    # Handle timeouts based on state
-    if state == STATE_WAIT_START_1:
-        # Waiting for key1 to complete start symbol
-        if current_time - state_enter_time > START_SYMBOL_TIMEOUT:
-            print("START SYMBOL TIMEOUT - back to waiting")
-            state = STATE_WAIT_START_0
-    
-    elif state == STATE_RECEIVING:
-        # Receiving bits - timeout means desync
-        if current_time - last_key_time > CLEAR_TIMEOUT:
-            if bit_buffer:
-                print("TIMEOUT: clearing buffer '{}'".format(bit_buffer))
-            bit_buffer = ""
-            state = STATE_WAIT_START_0
-
-    # Scan physical keys
-    for i in range(NUM_KEYS):
-        keys[i].update()
-        
-        if keys[i].fell:
-            debug_press_count += 1
-            last_key_time = current_time
-            
-            print("PRESS key={} state={} (#{})".format(i, state, debug_press_count))
-            
-            if state == STATE_WAIT_START_0:
-                # Waiting for first part of start symbol (key0)
-                if i == 0:
-                    state = STATE_WAIT_START_1
-                    state_enter_time = current_time
-                    print("  -> waiting for key1")
-                else:
-                    print("  -> ignored, need key0 first")
-            
-            elif state == STATE_WAIT_START_1:
-                # Waiting for second part of start symbol (key1)
-                if i == 1:
-                    # START SYMBOL COMPLETE!
-                    state = STATE_RECEIVING
-                    bit_buffer = ""
-                    print(">>> START SYMBOL DETECTED <<<")
-                elif i == 0:
-                    # Another key0 - restart
-                    state_enter_time = current_time
-                    print("  -> restart, another key0")
-            
-            elif state == STATE_RECEIVING:
-                # Receiving data bits
-                bit_buffer += KEYMAP[i]
-                print("  -> bit={} buffer='{}' len={}".format(KEYMAP[i], bit_buffer, len(bit_buffer)))
-                
-                # Check if we have a complete byte
-                if len(bit_buffer) == 8:
-                    value = int(bit_buffer, 2)
-                    bit_buffer = ""
-                    state = STATE_WAIT_START_0
-                    process_byte(value)
\ No newline at end of file
+if PIPELINE:
+    import asyncio
+    asyncio.run(Pipeline(receiver).run())
+else:
+    receiver.run()
@@ -0,0 +1,174 @@
+"""
+Edge trace: the last TRACE_EDGES key edges the receiver saw, for replaying
+a mis-typed transmission on a computer (tools.replay).
+
+The pin sources (DebouncedPins, KeypadPins) record every edge into a
+preallocated ring as its ticks_ms and one byte: key number in bits 0-3,
+EDGE_PRESSED if the key went down, EDGE_RAW if it is the undebounced pin
+(DebouncedPins only; the other records are the debounced key, or the
+keypad event). When the ring is full the oldest edge is overwritten and
+counted as dropped. Nothing is formatted until a dump is asked for.
+
+Binary trace, oldest edge first, all little-endian:
+
+  header  magic "BKE", version, flags (FLAG_*), keys, lanes, chord window
+          ms, debounce ms, edges (u32), dropped (u32)
+  edges   tick (u32), edge byte
+  crc     CRC-32 (binascii.crc32) of everything before it (u32)
+
+dump() prints the same bytes as base64 lines between "EDGES BEGIN" and
+"EDGES END" for capture from a serial terminal; save() writes the file.
+"""
+
+import binascii
+import struct
+from array import array
+
+try:
+    from micropython import const
+except ImportError:
+    def const(x):
+        return x
+
+TRACE_EDGES = 2048  # edges kept in the ring, 5 bytes each
+
+EDGE_KEY_MASK = const(0x0F)
+EDGE_PRESSED = const(0x10)
+EDGE_RAW = const(0x20)
+
+# Header flags: the receiver setup to replay with
+FLAG_DEBOUNCER = const(0x01)  # DebouncedPins (else keypad events)
+FLAG_HUFFMAN = const(0x02)
+FLAG_ADAPTIVE = const(0x04)
+FLAG_MACROS = const(0x08)
+FLAG_FEC = const(0x10)
+FLAG_RESYNC = const(0x20)
+FLAG_PIPELINE = const(0x40)  # pipeline.Pipeline with a QueuedHID
+
+TRACE_MAGIC = b"BKE"
+TRACE_VERSION = 1
+HEADER_FORMAT = "<3sBBBBBBxLL"
+RECORD_FORMAT = "<LB"
+RECORD_SIZE = 5
+CHUNK_EDGES = 48  # per dump line / file write
+
+
+class EdgeTrace:
+    """Ring of (tick, edge byte) records plus the receiver setup."""
+
+    def __init__(self, size=TRACE_EDGES, flags=0, keys=2, lanes=0, chord_window_ms=0,
+                 debounce_ms=0):
+        self.size = size
+        self.flags = flags
+        self.keys = keys
+        self.lanes = lanes
+        self.chord_window_ms = chord_window_ms
+        self.debounce_ms = debounce_ms
+        self.tick = array("L", [0] * size)
+        self.edge = bytearray(size)
+        self.head = 0   # next slot to write
+        self.count = 0
+        self.dropped = 0
+        self.chunk = bytearray(CHUNK_EDGES * RECORD_SIZE)
+
+    def record(self, tick, key, pressed, raw=False):
+        """Store one edge. Never allocates."""
+        head = self.head
+        edge = key
+        if pressed:
+            edge |= EDGE_PRESSED
+        if raw:
+            edge |= EDGE_RAW
+        self.tick[head] = tick
+        self.edge[head] = edge
+        head += 1
+        if head == self.size:
+            head = 0
+        self.head = head
+        if self.count == self.size:
+            self.dropped += 1
+        else:
+            self.count += 1
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        self.dropped = 0
+
+    def chunks(self):
+        """The binary trace, a piece at a time (the last piece is the CRC).
+        Edges recorded meanwhile are left out."""
+        count = self.count
+        header = struct.pack(HEADER_FORMAT, TRACE_MAGIC, TRACE_VERSION, self.flags, self.keys,
+                             self.lanes, self.chord_window_ms, self.debounce_ms, count,
+                             self.dropped)
+        crc = binascii.crc32(header)
+        yield header
+        i = (self.head - count) % self.size
+        left = count
+        chunk = self.chunk
+        while left:
+            n = CHUNK_EDGES if left > CHUNK_EDGES else left
+            for k in range(n):
+                struct.pack_into(RECORD_FORMAT, chunk, k * RECORD_SIZE, self.tick[i], self.edge[i])
+                i += 1
+                if i == self.size:
+                    i = 0
+            piece = memoryview(chunk)[:n * RECORD_SIZE]
+            crc = binascii.crc32(piece, crc)
+            yield piece
+            left -= n
+        yield struct.pack("<L", crc & 0xFFFFFFFF)
+
+    def save(self, path):
+        """Write the binary trace to path. Raises OSError if the
+        filesystem is read-only (see code.py EDGE_TRACE_FILE)."""
+        with open(path, "wb") as f:
+            for piece in self.chunks():
+                f.write(piece)
+
+    def dump(self, write=print):
+        """Print the binary trace as base64 lines for a serial capture."""
+        write("EDGES BEGIN {}".format(self.count))
+        for piece in self.chunks():
+            write(binascii.b2a_base64(piece).decode().strip())
+        write("EDGES END")
+
+
+def from_text(lines):
+    """The binary trace from dump() output (other lines are skipped).
+    For host tools."""
+    data = bytearray()
+    inside = False
+    for line in lines:
+        line = line.strip()
+        if line.startswith("EDGES BEGIN"):
+            data = bytearray()
+            inside = True
+        elif line == "EDGES END":
+            return bytes(data)
+        elif inside and line:
+            data += binascii.a2b_base64(line)
+    raise ValueError("no complete EDGES BEGIN / EDGES END block")
+
+
+def parse(data):
+    """(setup dict, [(tick, edge byte), ...]) from a binary trace.
+
+    Raises ValueError for data that is not one. For host tools.
+    """
+    size = struct.calcsize(HEADER_FORMAT)
+    if len(data) < size + 4:
+        raise ValueError("short trace")
+    if struct.unpack_from("<L", data, len(data) - 4)[0] != binascii.crc32(data[:-4]) & 0xFFFFFFFF:
+        raise ValueError("bad CRC")
+    (magic, version, flags, keys, lanes, chord_window_ms, debounce_ms, count,
+     dropped) = struct.unpack_from(HEADER_FORMAT, data, 0)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise ValueError("not a version {} edge trace".format(TRACE_VERSION))
+    if len(data) != size + count * RECORD_SIZE + 4:
+        raise ValueError("trace length does not match its header")
+    edges = [struct.unpack_from(RECORD_FORMAT, data, size + n * RECORD_SIZE) for n in range(count)]
+    setup = {"flags": flags, "keys": keys, "lanes": lanes, "chord_window_ms": chord_window_ms,
+             "debounce_ms": debounce_ms, "dropped": dropped}
+    return setup, edges
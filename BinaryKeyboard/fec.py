@@ -0,0 +1,91 @@
+"""
+Extended Hamming (13,8) SECDED code for the receiver's FEC framing.
+
+With FEC on, every byte of a binary frame (and a burst's length field) is
+sent as a 13-bit codeword instead of 8 plain bits: Hamming(12,8) with its
+parity bits at positions 1, 2, 4 and 8 and the data bits at 3, 5, 6, 7,
+9, 10, 11 and 12 (data MSB first), plus an overall parity bit at position
+0. Codeword bit n is position n, and the word goes out MSB (position 12)
+first.
+
+Any single flipped bit is corrected and two flipped bits are detected.
+A missing or extra pulse throws every later word of a burst out of step
+unless the receiver finds it (Receiver.fill_missed(), repair_slip()), and
+out-of-step words often "correct" to a wrong byte, so a burst also ends
+with a codeword holding the CRC-8 of its bytes. The receiver holds a
+burst's bytes until that checks out and drops the whole frame otherwise.
+"""
+
+FEC_WORD_BITS = 13
+FEC_CORRECTED = 0x100  # or'ed into secded_decode()'s result after a fix
+
+CRC_POLY = 0x07  # CRC-8/ATM, x^8 + x^2 + x + 1
+
+# Codeword positions of data bits 7..0
+DATA_POSITIONS = (3, 5, 6, 7, 9, 10, 11, 12)
+
+
+def secded_encode(value):
+    """13-bit codeword for a byte."""
+    word = 0
+    i = 0
+    while i < 8:
+        if (value >> (7 - i)) & 1:
+            word |= 1 << DATA_POSITIONS[i]
+        i += 1
+    syndrome = 0
+    pos = 1
+    while pos < FEC_WORD_BITS:
+        if (word >> pos) & 1:
+            syndrome ^= pos
+        pos += 1
+    # Parity bits make the syndrome of the whole word zero
+    word |= (syndrome & 1) << 1 | (syndrome & 2) << 1 | (syndrome & 4) << 2 | (syndrome & 8) << 5
+    parity = 0
+    w = word
+    while w:
+        parity ^= w & 1
+        w >>= 1
+    return word | parity
+
+
+def secded_decode(word):
+    """Byte for a received codeword, or'ed with FEC_CORRECTED if a bit was
+    fixed, or -1 if it cannot be corrected. Never allocates."""
+    syndrome = 0
+    parity = word & 1
+    pos = 1
+    while pos < FEC_WORD_BITS:
+        if (word >> pos) & 1:
+            syndrome ^= pos
+            parity ^= 1
+        pos += 1
+    fixed = 0
+    if parity:
+        # Odd number of flips: assume one, at position syndrome
+        if syndrome >= FEC_WORD_BITS:
+            return -1
+        word ^= 1 << syndrome
+        fixed = FEC_CORRECTED
+    elif syndrome:
+        # Even number of flips, at least two
+        return -1
+    value = 0
+    i = 0
+    while i < 8:
+        value = (value << 1) | ((word >> DATA_POSITIONS[i]) & 1)
+        i += 1
+    return value | fixed
+
+
+def crc8_update(crc, value):
+    """CRC-8 of the bytes so far (start from 0) extended by value."""
+    crc ^= value
+    i = 0
+    while i < 8:
+        if crc & 0x80:
+            crc = ((crc << 1) ^ CRC_POLY) & 0xFF
+        else:
+            crc = (crc << 1) & 0xFF
+        i += 1
+    return crc
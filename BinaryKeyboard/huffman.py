@@ -0,0 +1,88 @@
+"""
+Static canonical Huffman code for the receiver's prefix-code mode.
+
+After PROTO_HUFFMAN_MODE the data bits are no longer whole bytes but a
+stream of prefix codes, one per protocol byte, read from the code table in
+huffman_table.py (generated by ``python -m tools.huffman``). Bytes missing
+from the table go out as SYM_RAW plus 8 literal bits. SYM_END ends the
+mode; the rest of that frame byte is padding.
+
+The table only stores how many codes there are of each length and the
+symbols in canonical order; build_tree() turns that into a flat array the
+decoder walks one bit at a time.
+"""
+
+from array import array
+
+SYM_END = 256  # back to byte mode, rest of the current byte is padding
+SYM_RAW = 257  # next 8 bits are a literal protocol byte
+
+
+def build_tree(length_counts, symbols):
+    """Array-backed decoding tree for a canonical code.
+
+    length_counts[n] is the number of codes n bits long and symbols lists
+    the symbols in canonical order (by length, then value). Node k's
+    children are tree[2k] (bit 0) and tree[2k + 1] (bit 1): a positive
+    entry is another node, a negative one is the leaf ~symbol. Node 0 is
+    the root.
+    """
+    size = 2 * max(1, len(symbols) - 1)
+    tree = array("h", [0] * size)
+    nodes = 1
+    code = 0
+    k = 0
+    for length in range(1, len(length_counts)):
+        for _ in range(length_counts[length]):
+            node = 0
+            for shift in range(length - 1, 0, -1):
+                slot = 2 * node + ((code >> shift) & 1)
+                if tree[slot] == 0:
+                    if 2 * nodes >= size:
+                        raise ValueError("code table is oversubscribed")
+                    tree[slot] = nodes
+                    nodes += 1
+                elif tree[slot] < 0:
+                    raise ValueError("code table is not prefix free")
+                node = tree[slot]
+            tree[2 * node + (code & 1)] = ~symbols[k]
+            k += 1
+            code += 1
+        code <<= 1
+    if k != len(symbols):
+        raise ValueError("code table lengths do not match its symbols")
+    return tree
+
+
+class PrefixDecoder:
+    """Walks a build_tree() tree one received bit at a time."""
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.node = 0
+        self.raw = 0
+        self.raw_bits = 0  # literal bits still to read after SYM_RAW
+
+    def reset(self):
+        self.node = 0
+        self.raw = 0
+        self.raw_bits = 0
+
+    def bit(self, b):
+        """Feed one bit; returns a protocol byte, SYM_END, or -1 if the
+        current code is not complete yet."""
+        if self.raw_bits:
+            self.raw = (self.raw << 1) | b
+            self.raw_bits -= 1
+            return -1 if self.raw_bits else self.raw
+        node = self.tree[2 * self.node + b]
+        if node >= 0:
+            self.node = node
+            return -1
+        self.node = 0
+        sym = ~node
+        if sym == SYM_RAW:
+            self.raw = 0
+            self.raw_bits = 8
+            return -1
+        return sym
@@ -0,0 +1,29 @@
+"""
+Canonical Huffman code for the receiver's prefix-code mode.
+
+Generated by `python -m tools.huffman` from:
+    README.md
+    PROTOCOL_DESIGN.md
+    BinaryKeyboard/code.py
+    BinaryKeyboard/receiver.py
+    BinaryKeyboard/tracelog.py
+    tools/sim.py
+    tools/bench.py
+4.99 bits per character on that corpus. Do not edit by hand.
+"""
+
+# Number of codes of each length, index = length in bits
+LENGTH_COUNTS = (0, 0, 1, 0, 1, 11, 8, 15, 16, 11, 13, 7, 3, 4, 2, 2, 4)
+
+# Symbols in canonical order (256 = end of mode, 257 = raw byte)
+SYMBOLS = (
+    32, 101, 45, 97, 100, 105, 108, 110, 111, 114, 115, 116,
+    149, 46, 95, 99, 102, 109, 112, 117, 121, 34, 40, 41,
+    44, 48, 58, 61, 65, 69, 83, 84, 98, 103, 104, 107,
+    35, 49, 67, 68, 70, 73, 75, 76, 78, 79, 80, 82,
+    118, 119, 120, 124, 42, 47, 50, 56, 66, 71, 72, 77,
+    85, 86, 96, 39, 43, 51, 52, 53, 57, 87, 89, 91,
+    93, 123, 125, 257, 54, 55, 60, 62, 106, 113, 122, 59,
+    88, 90, 33, 37, 38, 92, 81, 126, 63, 64, 36, 74,
+    94, 256,
+)
@@ -0,0 +1,128 @@
+"""
+Macro dictionary: opcodes 0xB3-0xEF that type a whole key sequence.
+
+The dictionary is a text file on CIRCUITPY (macros.txt), one macro per line:
+
+    B3 git status{ENTER}
+    B4 {CTRL}c{/CTRL}
+
+The opcode in hex, one space, then the text to type. {NAME} inserts a
+special key (see NAMES; {/CTRL} etc. release a modifier), {0x95} inserts
+any protocol byte, {{ is a literal brace. Blank lines and lines starting
+with # are ignored.
+
+load_macros() parses the file once at boot into one bytearray of protocol
+bytes plus an offset per opcode, so the receiver plays a macro without
+touching the file or allocating.
+"""
+
+from array import array
+
+from receiver import (ACTION, ACT_KEY, ACT_MOD_PRESS, ACT_MOD_RELEASE, ACT_FUNC,
+                      MACRO_FIRST, MACRO_LAST, PROTO_CAPS_LOCK)
+
+# Special keys by name, as protocol bytes
+NAMES = {
+    "RIGHT": 0x90, "LEFT": 0x91, "DOWN": 0x92, "UP": 0x93,
+    "BACKSPACE": 0x94, "ENTER": 0x95, "TAB": 0x96, "ESC": 0x97,
+    "DELETE": 0x98, "INSERT": 0x99, "HOME": 0x9A, "END": 0x9B,
+    "PGUP": 0x9C, "PGDN": 0x9D, "CAPS": PROTO_CAPS_LOCK,
+    "CTRL": 0x80, "SHIFT": 0x81, "ALT": 0x82, "GUI": 0x83,
+    "RCTRL": 0x84, "RSHIFT": 0x85, "RALT": 0x86, "RGUI": 0x87,
+    "/CTRL": 0x88, "/SHIFT": 0x89, "/ALT": 0x8A, "/GUI": 0x8B,
+    "/RCTRL": 0x8C, "/RSHIFT": 0x8D, "/RALT": 0x8E, "/RGUI": 0x8F,
+}
+for _n in range(12):
+    NAMES["F{}".format(_n + 1)] = 0xA0 + _n
+
+# Byte actions a macro may contain
+MACRO_ACTIONS = (ACT_KEY, ACT_MOD_PRESS, ACT_MOD_RELEASE, ACT_FUNC)
+
+
+class Macros:
+    """Expansions for every macro opcode in one offset-indexed blob.
+
+    Opcode v expands to blob[offsets[k]:offsets[k + 1]] with
+    k = v - MACRO_FIRST; an empty range means no macro.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def expansion(self, value):
+        k = value - MACRO_FIRST
+        return bytes(self.blob[self.offsets[k]:self.offsets[k + 1]])
+
+
+def parse_body(body, lineno):
+    """Protocol bytes for the text of one macro."""
+    out = bytearray()
+    i = 0
+    while i < len(body):
+        ch = body[i]
+        if ch == "{" and body[i + 1:i + 2] == "{":
+            value = ord("{")
+            i += 2
+        elif ch == "{":
+            end = body.find("}", i)
+            if end < 0:
+                raise ValueError("macros line {}: missing }}".format(lineno))
+            name = body[i + 1:end].upper()
+            if name.startswith("0X"):
+                value = int(name, 16)
+            elif name in NAMES:
+                value = NAMES[name]
+            else:
+                raise ValueError("macros line {}: unknown key {{{}}}".format(lineno, name))
+            i = end + 1
+        else:
+            value = ord(ch)
+            i += 1
+        if value > 0xFF or ACTION[value] not in MACRO_ACTIONS:
+            raise ValueError("macros line {}: 0x{:X} cannot be typed by a macro".format(lineno, value))
+        out.append(value)
+    return out
+
+
+def parse_macros(lines):
+    """Build a Macros from the lines of a dictionary file."""
+    bodies = {}
+    lineno = 0
+    for line in lines:
+        lineno += 1
+        line = line.rstrip("\r\n")
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        sp = line.find(" ")
+        if sp < 0:
+            raise ValueError("macros line {}: expected '<opcode> <text>'".format(lineno))
+        try:
+            value = int(line[:sp], 16)
+        except ValueError:
+            raise ValueError("macros line {}: bad opcode {}".format(lineno, line[:sp]))
+        if not MACRO_FIRST <= value <= MACRO_LAST:
+            raise ValueError("macros line {}: opcode 0x{:02X} outside 0x{:02X}-0x{:02X}".format(
+                lineno, value, MACRO_FIRST, MACRO_LAST))
+        if value in bodies:
+            raise ValueError("macros line {}: opcode 0x{:02X} defined twice".format(lineno, value))
+        bodies[value] = parse_body(line[sp + 1:], lineno)
+
+    count = MACRO_LAST - MACRO_FIRST + 1
+    offsets = array("H", [0] * (count + 1))
+    blob = bytearray(sum(len(b) for b in bodies.values()))
+    pos = 0
+    for k in range(count):
+        offsets[k] = pos
+        body = bodies.get(MACRO_FIRST + k)
+        if body:
+            blob[pos:pos + len(body)] = body
+            pos += len(body)
+    offsets[count] = pos
+    return Macros(blob, offsets)
+
+
+def load_macros(path):
+    """Parse the dictionary file at path."""
+    with open(path) as f:
+        return parse_macros(f)
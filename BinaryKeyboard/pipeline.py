@@ -0,0 +1,228 @@
+"""
+asyncio pipeline: edge capture, frame decoding and HID output as separate
+tasks.
+
+Receiver.poll() does everything in one pass, so a macro or a PROTO_COPY
+types its whole output before the keys are scanned again. Here the
+Receiver writes to a QueuedHID instead of the keyboard, and three tasks
+share the work:
+
+  capture -> scans the pins into an EdgeQueue of timestamped presses
+  decode  -> feeds queued presses to the Receiver, then its timeouts,
+             repeats and idle work (Receiver.service())
+  emit    -> sends one HID report: a queued operation, or half of a
+             tap (key down, then key up on the next step)
+
+Each task does one step and yields, so the pins are scanned between any
+two HID reports, and emit waits while the pin source reports an edge
+settling (DebouncedPins.settling), so that it is polled through its
+debounce interval. Both queues are preallocated rings with backpressure
+counters. The decoder leaves presses in the EdgeQueue (with their own
+timestamps) while the HID queue has less than HID_RESERVE free, and only
+an output longer than that is written inline.
+
+Pipeline.step() runs one step of each, which is what the simulator in
+tools/ drives; run() is the asyncio version for the device.
+"""
+
+import asyncio
+from array import array
+
+from receiver import COPY_MIN
+from tracelog import NO_MEMORY_REPORT
+
+EDGE_QUEUE_SIZE = 64   # presses
+HID_QUEUE_SIZE = 512   # operations
+# Room the decoder wants before taking another press: the longest output
+# one received byte makes, short of a long macro (a PROTO_COPY)
+HID_RESERVE = COPY_MIN + 255
+
+# HID operations
+OP_TAP = 0
+OP_HOLD = 1
+OP_UNHOLD = 2
+OP_RELEASE_ALL = 3
+
+
+# -------------------------
+# Queues
+# -------------------------
+class EdgeQueue:
+    """Ring of presses from the capture task to the decoder.
+
+    pop() works like a pin source's next_press(): the key index, or -1,
+    with the press's ticks in .timestamp.
+    """
+
+    def __init__(self, size=EDGE_QUEUE_SIZE):
+        self.keys = bytearray(size)
+        self.times = array("L", [0] * size)
+        self.size = size
+        self.head = 0  # next slot to read
+        self.count = 0
+        self.timestamp = 0
+        self.overflows = 0   # presses lost to a full queue
+        self.high_water = 0
+
+    def push(self, key, timestamp):
+        if self.count == self.size:
+            self.overflows += 1
+            return
+        pos = (self.head + self.count) % self.size
+        self.keys[pos] = key
+        self.times[pos] = timestamp
+        self.count += 1
+        if self.count > self.high_water:
+            self.high_water = self.count
+
+    def pop(self):
+        if not self.count:
+            return -1
+        pos = self.head
+        self.timestamp = self.times[pos]
+        self.head = (pos + 1) % self.size
+        self.count -= 1
+        return self.keys[pos]
+
+
+class QueuedHID:
+    """HID sink that queues operations for the emit task.
+
+    Same interface as receiver.ReportHID, which it wraps as sink. emit()
+    sends one report, so a tap takes two calls. When the queue is full
+    the oldest operation is sent inline to make room, so
+    output can be late but is never lost or reordered. Each operation
+    keeps the edge_time it was queued with and hands it to the sink, so a
+    ReportHID with telemetry times the whole way from the press.
+    """
+
+    def __init__(self, sink, size=HID_QUEUE_SIZE):
+        self.sink = sink
+        self.ops = bytearray(3 * size)  # op, mods, keycode
+        self.times = array("L", [0] * size)
+        self.edge_time = 0
+        self.size = size
+        self.head = 0  # next operation to send
+        self.count = 0
+        self.down = False  # the head tap's key-down report is out
+        self.blocked = 0  # operations sent inline because the queue was full
+        self.high_water = 0
+
+    def room(self):
+        return self.size - self.count
+
+    def push(self, op, mods, keycode):
+        if self.count == self.size:
+            self.blocked += 1
+            while self.count == self.size:
+                self.emit()
+        slot = (self.head + self.count) % self.size
+        self.times[slot] = self.edge_time
+        pos = 3 * slot
+        ops = self.ops
+        ops[pos] = op
+        ops[pos + 1] = mods
+        ops[pos + 2] = keycode
+        self.count += 1
+        if self.count > self.high_water:
+            self.high_water = self.count
+
+    def tap(self, mods, keycode):
+        self.push(OP_TAP, mods, keycode)
+
+    def hold(self, mods):
+        self.push(OP_HOLD, mods, 0)
+
+    def unhold(self, mods):
+        self.push(OP_UNHOLD, mods, 0)
+
+    def release_all(self):
+        self.push(OP_RELEASE_ALL, 0, 0)
+
+    def emit(self):
+        """Send the next report of the oldest queued operation. False if
+        there is none."""
+        if not self.count:
+            return False
+        ops = self.ops
+        pos = 3 * self.head
+        op = ops[pos]
+        sink = self.sink
+        sink.edge_time = self.times[self.head]
+        if op == OP_TAP:
+            if not self.down:
+                sink.key_down(ops[pos + 1], ops[pos + 2])
+                self.down = True
+                return True
+            sink.key_up()
+            self.down = False
+        elif op == OP_HOLD:
+            sink.hold(ops[pos + 1])
+        elif op == OP_UNHOLD:
+            sink.unhold(ops[pos + 1])
+        else:
+            sink.release_all()
+        self.head = (self.head + 1) % self.size
+        self.count -= 1
+        return True
+
+
+# -------------------------
+# Tasks
+# -------------------------
+class Pipeline:
+    """The three tasks around a Receiver built with hid=QueuedHID(...)."""
+
+    def __init__(self, receiver, edges=None):
+        self.receiver = receiver
+        self.hid = receiver.hid
+        self.edges = edges if edges is not None else EdgeQueue()
+        self.deferred = 0  # decode steps that left presses queued for HID room
+
+    def capture(self):
+        rx = self.receiver
+        pins = rx.pins
+        pins.update(rx.clock())
+        edges = self.edges
+        i = pins.next_press()
+        while i >= 0:
+            edges.push(i, pins.timestamp)
+            i = pins.next_press()
+
+    def decode(self):
+        rx = self.receiver
+        edges = self.edges
+        hid = self.hid
+        while edges.count:
+            if hid.room() < HID_RESERVE:
+                self.deferred += 1
+                return
+            i = edges.pop()
+            rx.on_press(i, edges.timestamp)
+        # Timeouts only once every queued press is in, as in poll()
+        rx.service(rx.clock())
+
+    def emit(self):
+        # A report while an edge settles can starve its debouncer of polls
+        if not self.receiver.pins.settling:
+            try:
+                self.hid.emit()
+            except MemoryError:
+                # The report stays queued and goes out on the next step
+                if not self.receiver.out_of_memory(NO_MEMORY_REPORT):
+                    raise
+
+    def step(self):
+        """One step of each task, in the order asyncio runs them."""
+        self.capture()
+        self.decode()
+        self.emit()
+
+    async def loop(self, step):
+        while True:
+            step()
+            await asyncio.sleep(0)
+
+    async def run(self):
+        await asyncio.gather(self.loop(self.capture), self.loop(self.decode),
+                             self.loop(self.emit))
@@ -0,0 +1,1669 @@
+"""
+Binary keyboard receiver core.
+
+Decodes start-symbol framed bytes from the two key switches and turns them
+into keystrokes. Nothing in here touches board pins or USB directly: the
+clock, the pin source and the HID sink are passed in, so the same state
+machine runs on the RP2040 (see code.py) and on a host machine under the
+pulse-train simulator in tools/.
+
+Backends:
+  clock() -> int millisecond ticks wrapping at TICKS_PERIOD,
+             e.g. adafruit_ticks.ticks_ms
+  pins    -> object with .update(now), .next_press() -> key index or -1 and
+             .timestamp (ticks of the last press returned), e.g.
+             DebouncedPins or KeypadPins
+  hid     -> object with .tap(mods, kc), .hold(mods), .unhold(mods) and
+             .release_all(), e.g. ReportHID wrapping an adafruit_hid Keyboard
+  prefix  -> optional huffman.PrefixDecoder; enables PROTO_HUFFMAN_MODE
+  adaptive -> optional adaptive.AdaptiveDecoder; enables PROTO_ADAPTIVE_MODE
+  macros  -> optional macros.Macros loaded from the dictionary file
+             (prefix and macros may also be set later by a step given to
+             defer())
+  telemetry -> optional telemetry.Telemetry; counts frames, timeouts and
+             errors and files press intervals and frame times. The press
+             behind the current output is left in hid.edge_time, so a sink
+             built with the same Telemetry (ReportHID) can time edge-to-
+             report latency
+
+With fec=True every byte of a binary frame, and a burst's length field, is
+a 13-bit SECDED codeword, and a burst ends with a CRC-8 codeword (see
+fec.py): single bit errors are corrected, and bytes or bursts that fail
+are dropped and counted instead of typed. With resync a missed pulse is
+filled in and an extra one found by its codewords (repair_slip()).
+
+Every key byte typed from the link (not from macros) is also kept in a
+HISTORY_SIZE ring so PROTO_COPY can replay it and PROTO_REPEAT repeat it.
+Repeats and holds are typed one key per poll() pass, not in one go, so
+long runs never stop the key scan. Macros and copies are typed in one go;
+pipeline.py queues all output instead and sends it from its own task.
+"""
+
+from adafruit_hid.keycode import Keycode
+from array import array
+
+from tracelog import (TraceLog, LEVEL_OFF, LEVEL_INFO, EV_PRESS, EV_START,
+                      EV_START_TIMEOUT, EV_BYTE, EV_DESYNC, EV_CLEAR, EV_UNKNOWN,
+                      EV_BURST, EV_MODE, EV_COPY, EV_FEC_FIX, EV_FEC_DROP,
+                      EV_MISSED, EV_NO_MEMORY, NO_MEMORY_REPORT)
+from huffman import SYM_END
+from fec import FEC_WORD_BITS, FEC_CORRECTED, crc8_update, secded_decode, secded_encode
+from telemetry import (CNT_PRESSES, CNT_BYTES, CNT_FRAMES, CNT_START_TIMEOUTS,
+                       CNT_DESYNCS, CNT_UNKNOWN, CNT_CLEARS, HIST_INTERVAL,
+                       HIST_FRAME, HIST_LATENCY)
+
+# -------------------------
+# Timing
+# -------------------------
+# All receiver timing is in integer millisecond ticks. Float
+# time.monotonic() loses sub-millisecond (then millisecond) precision
+# after days of uptime; ticks wrap instead and ticks_diff() handles it.
+CLEAR_TIMEOUT_MS = 2000
+# Start symbol is now: key0 then key1, about 40ms apart
+# We detect it as: key0 followed by key1 within 50ms
+# (key1 then key0 is the burst start symbol, same window)
+START_SYMBOL_TIMEOUT_MS = 50  # 50ms window for start symbol sequence
+
+# Learned timing (Receiver resync=True): EWMAs of the press-to-press time
+# inside binary frames (the bit period) and between back-to-back frames,
+# kept in 1/16 ms. A press DESYNC_GAP_X4 quarter periods or more after the
+# last one in a binary frame means the pulse between was missed (it leaves
+# two periods): a 0 takes its place so the frame stays in step. Quiet for
+# LOST_GAP_X4 loses the frame, instead of after CLEAR_TIMEOUT_MS; ternary
+# and lane frames are lost at DESYNC_GAP_X4. A start symbol waits up to
+# LOST_GAP_X4 for its second key, so a missed second pulse is filled too.
+# Gaps are compared in quarter periods, see Receiver.quarters().
+PERIOD_EWMA_SHIFT = 3     # a new interval weighs 1/8
+DESYNC_GAP_X4 = 7
+LOST_GAP_X4 = 10          # two missed pulses, or the last one and a frame gap
+# If the sender leaves an idle period before every frame (Teensy FRAME_GAP),
+# presses after a lost frame are skipped until such a gap: the first press
+# after the loss needs RESYNC_GAP_X4, as its own gap may be the missed pulse
+RESYNC_GAP_X4 = 10
+FRAME_GAP_MAX_X4 = 16     # longer pauses between frames are not learned
+# A frame's first press that comes about one period later than the learned
+# gap between back-to-back frames is the second part of its start symbol,
+# the first having been missed: key1 completes a single-byte start, key0 a
+# burst start. The Teensy starts a frame after an idle spell at least two
+# periods later than a back-to-back one, so such a frame is not mistaken
+# for one.
+START_LATE_MIN_X4 = 2
+START_LATE_MAX_X4 = 6
+
+# Same wraparound as adafruit_ticks
+TICKS_PERIOD = 1 << 29
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+
+def ticks_diff(ticks1, ticks2):
+    """Signed ticks1 - ticks2, correct across wraparound (as adafruit_ticks)."""
+    diff = (ticks1 - ticks2) & TICKS_MAX
+    return ((diff + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+# Each key maps to a binary digit
+KEYMAP = (0, 1)
+
+# Burst frame: key1 then key0, a BURST_LEN_BITS field holding (count - 1),
+# then count bytes back to back with no start symbols in between
+BURST_LEN_BITS = 5
+BURST_MAX = 1 << BURST_LEN_BITS
+
+# Ternary frame: both keys together (a chord), a TERNARY_LEN_TRITS field
+# holding (count - 1), then count bytes of TRITS_PER_BYTE base-3 digits,
+# most significant first. Digit 0 is key0, 1 is key1, 2 is a chord.
+CHORD = 2
+TERNARY_LEN_TRITS = 3
+TERNARY_MAX = 3 ** TERNARY_LEN_TRITS
+TRITS_PER_BYTE = 6
+# Both keys pressed within this many ms of each other are one chord
+CHORD_WINDOW_MS = 8
+
+# Lanes: with lanes=N the pins are a strobe (key 0) plus N data keys, and
+# every stroke carries N bits. Keys falling within the chord window of the
+# first one are one stroke. Strobe plus data keys: key k + 1 down is bit k
+# of the next N bits, sent MSB first. All data keys without the strobe:
+# frame start, the next bit begins a byte. Frames run until the next start.
+LANE_COUNTS = (1, 2, 4, 8)
+
+# -------------------------
+# State machine
+# -------------------------
+STATE_WAIT_START_0 = 0  # Waiting for the first key of a start symbol
+STATE_WAIT_START_1 = 1  # Got one start key, waiting for the other
+STATE_RECEIVING = 2     # Receiving data bits
+STATE_BURST_LENGTH = 3  # Receiving the burst length field
+STATE_TERNARY_LENGTH = 4  # Receiving the ternary frame length field
+STATE_TERNARY = 5       # Receiving data trits
+STATE_LANES = 6         # Receiving lane strokes
+
+# Input modes: how data bits turn into protocol bytes
+MODE_BYTE = 0      # 8 bits per byte
+MODE_PAD = 1       # mode just ended, skip to the end of the current byte
+MODE_HUFFMAN = 2   # prefix codes from huffman_table.py
+MODE_ADAPTIVE = 3  # order-1 rank codes, see adaptive.py
+MODE_HEX = 4       # 4-bit hex digits, see PROTO_HEX_MODE
+
+# -------------------------
+# Protocol mappings
+# -------------------------
+
+# Modifier PRESS (0x80-0x87)
+MOD_PRESS_MAP = {
+    0x80: Keycode.LEFT_CONTROL,
+    0x81: Keycode.LEFT_SHIFT,
+    0x82: Keycode.LEFT_ALT,
+    0x83: Keycode.LEFT_GUI,
+    0x84: Keycode.RIGHT_CONTROL,
+    0x85: Keycode.RIGHT_SHIFT,
+    0x86: Keycode.RIGHT_ALT,
+    0x87: Keycode.RIGHT_GUI,
+}
+
+# Modifier RELEASE (0x88-0x8F)
+MOD_RELEASE_MAP = {
+    0x88: Keycode.LEFT_CONTROL,
+    0x89: Keycode.LEFT_SHIFT,
+    0x8A: Keycode.LEFT_ALT,
+    0x8B: Keycode.LEFT_GUI,
+    0x8C: Keycode.RIGHT_CONTROL,
+    0x8D: Keycode.RIGHT_SHIFT,
+    0x8E: Keycode.RIGHT_ALT,
+    0x8F: Keycode.RIGHT_GUI,
+}
+
+# Navigation keys (0x90-0x9D)
+NAV_MAP = {
+    0x90: Keycode.RIGHT_ARROW,
+    0x91: Keycode.LEFT_ARROW,
+    0x92: Keycode.DOWN_ARROW,
+    0x93: Keycode.UP_ARROW,
+    0x94: Keycode.BACKSPACE,
+    0x95: Keycode.ENTER,
+    0x96: Keycode.TAB,
+    0x97: Keycode.ESCAPE,
+    0x98: Keycode.DELETE,
+    0x99: Keycode.INSERT,
+    0x9A: Keycode.HOME,
+    0x9B: Keycode.END,
+    0x9C: Keycode.PAGE_UP,
+    0x9D: Keycode.PAGE_DOWN,
+}
+
+PROTO_CLEAR_BUFFER = 0x9E
+
+# Function keys (0xA0-0xAB)
+FUNC_MAP = {
+    0xA0: Keycode.F1,
+    0xA1: Keycode.F2,
+    0xA2: Keycode.F3,
+    0xA3: Keycode.F4,
+    0xA4: Keycode.F5,
+    0xA5: Keycode.F6,
+    0xA6: Keycode.F7,
+    0xA7: Keycode.F8,
+    0xA8: Keycode.F9,
+    0xA9: Keycode.F10,
+    0xAA: Keycode.F11,
+    0xAB: Keycode.F12,
+}
+
+# Other special keys
+PROTO_CAPS_LOCK = 0xB0
+PROTO_FN_PRESS = 0xB1
+PROTO_FN_RELEASE = 0xB2
+
+# Macro opcodes (0xB3-0xEF), expanded from the dictionary in macros.txt
+MACRO_FIRST = 0xB3
+MACRO_LAST = 0xEF
+
+# Mode switches are allocated down from 0xFF (0xF0-0xFF)
+PROTO_HUFFMAN_MODE = 0xFF
+PROTO_ADAPTIVE_MODE = 0xFE
+# PROTO_HEX_MODE, n - 1: the next n characters are hex digits, 4 bits each
+# (0-9a-f, or 0-9A-F after PROTO_HEX_UPPER_MODE), starting right after the
+# count byte. Byte mode resumes at the byte boundary after the last one.
+PROTO_HEX_MODE = 0xF9
+PROTO_HEX_UPPER_MODE = 0xF8
+HEX_DIGITS = b"0123456789abcdef"
+HEX_DIGITS_UPPER = b"0123456789ABCDEF"
+
+# Back-reference: PROTO_COPY, distance - 1, length - COPY_MIN. Re-types
+# length key bytes starting distance bytes back in the typed history.
+# Shorter copies would cost as many frames as the keys themselves.
+PROTO_COPY = 0xFD
+COPY_MIN = 4
+HISTORY_SIZE = 256  # power of two
+
+# PROTO_REPEAT, n - 1: type the last typed byte n more times, at USB speed
+PROTO_REPEAT = 0xFC
+# PROTO_HOLD, nav key, count: auto-repeat a NAV_MAP key every
+# HOLD_INTERVAL_MS, count times or (count 0) until PROTO_HOLD_STOP, any
+# other byte, or HOLD_MAX_MS. Held keys are not added to the history.
+PROTO_HOLD = 0xFB
+PROTO_HOLD_STOP = 0xFA
+HOLD_INTERVAL_MS = 33  # ~30 keys/s, a typical OS auto-repeat rate
+HOLD_MAX_MS = 10000
+
+
+# Fn + function key combinations (only used while Fn is held)
+# On most keyboards, Fn+Function key sends a different HID code
+# You may need to adjust these mappings based on your specific keyboard
+# Format: Keycode.Fn: (modifier, key)
+FN_MAPPING = {
+    Keycode.F1: (Keycode.LEFT_CONTROL, Keycode.F1),  # Fn+F1 = Ctrl+F1
+    Keycode.F2: (Keycode.LEFT_CONTROL, Keycode.F2),  # Fn+F2 = Ctrl+F2
+    Keycode.F3: (Keycode.LEFT_CONTROL, Keycode.F3),  # Fn+F3 = Ctrl+F3
+    Keycode.F4: (Keycode.LEFT_CONTROL, Keycode.F4),  # Fn+F4 = Ctrl+F4
+    Keycode.F5: (Keycode.LEFT_CONTROL, Keycode.F5),  # Fn+F5 = Ctrl+F5
+    Keycode.F6: (Keycode.LEFT_CONTROL, Keycode.F6),  # Fn+F6 = Ctrl+F6
+    Keycode.F7: (Keycode.LEFT_CONTROL, Keycode.F7),  # Fn+F7 = Ctrl+F7
+    Keycode.F8: (Keycode.LEFT_CONTROL, Keycode.F8),  # Fn+F8 = Ctrl+F8
+    Keycode.F9: (Keycode.LEFT_CONTROL, Keycode.F9),  # Fn+F9 = Ctrl+F9
+    Keycode.F10: (Keycode.LEFT_CONTROL, Keycode.F10), # Fn+F10 = Ctrl+F10
+    Keycode.F11: (Keycode.LEFT_CONTROL, Keycode.F11), # Fn+F11 = Ctrl+F11
+    Keycode.F12: (Keycode.LEFT_CONTROL, Keycode.F12)  # Fn+F12 = Ctrl+F12
+}
+# Used for any F-key missing from FN_MAPPING
+FN_DEFAULT_MODIFIER = Keycode.LEFT_ALT
+
+# Shift+number symbols
+SHIFT_NUM = {
+    '!': Keycode.ONE, '@': Keycode.TWO, '#': Keycode.THREE,
+    '$': Keycode.FOUR, '%': Keycode.FIVE, '^': Keycode.SIX,
+    '&': Keycode.SEVEN, '*': Keycode.EIGHT, '(': Keycode.NINE,
+    ')': Keycode.ZERO,
+}
+
+# Other punctuation
+PUNCTUATION = {
+    ' ': (Keycode.SPACE, False),
+    '-': (Keycode.MINUS, False),
+    '_': (Keycode.MINUS, True),
+    '=': (Keycode.EQUALS, False),
+    '+': (Keycode.EQUALS, True),
+    '[': (Keycode.LEFT_BRACKET, False),
+    '{': (Keycode.LEFT_BRACKET, True),
+    ']': (Keycode.RIGHT_BRACKET, False),
+    '}': (Keycode.RIGHT_BRACKET, True),
+    '\\': (Keycode.BACKSLASH, False),
+    '|': (Keycode.BACKSLASH, True),
+    ';': (Keycode.SEMICOLON, False),
+    ':': (Keycode.SEMICOLON, True),
+    "'": (Keycode.QUOTE, False),
+    '"': (Keycode.QUOTE, True),
+    '`': (Keycode.GRAVE_ACCENT, False),
+    '~': (Keycode.GRAVE_ACCENT, True),
+    ',': (Keycode.COMMA, False),
+    '<': (Keycode.COMMA, True),
+    '.': (Keycode.PERIOD, False),
+    '>': (Keycode.PERIOD, True),
+    '/': (Keycode.FORWARD_SLASH, False),
+    '?': (Keycode.FORWARD_SLASH, True),
+}
+
+
+def ascii_to_keypress(ch):
+    """Convert ASCII char to (keycode, needs_shift)."""
+    c = ord(ch)
+
+    # Lowercase a-z
+    if ord('a') <= c <= ord('z'):
+        return (Keycode.A + (c - ord('a')), False)
+
+    # Uppercase A-Z
+    if ord('A') <= c <= ord('Z'):
+        return (Keycode.A + (c - ord('A')), True)
+
+    # Numbers 0-9
+    if c == ord('0'):
+        return (Keycode.ZERO, False)
+    if ord('1') <= c <= ord('9'):
+        return (Keycode.ONE + (c - ord('1')), False)
+
+    if ch in SHIFT_NUM:
+        return (SHIFT_NUM[ch], True)
+
+    if ch in PUNCTUATION:
+        return PUNCTUATION[ch]
+
+    return (None, False)
+
+
+# -------------------------
+# Dispatch table
+# -------------------------
+# One entry per protocol byte: ACTION[v] says what to do, KEYCODE[v] and
+# MODIFIER[v] say which keys. MODIFIER holds HID report modifier bits
+# (0 = none), not keycodes. For ACT_FUNC, MODIFIER[v] and FN_KEYCODE[v]
+# hold the combination sent while Fn is held.
+ACT_UNKNOWN = 0
+ACT_KEY = 1          # tap KEYCODE with MODIFIER bits held
+ACT_MOD_PRESS = 2
+ACT_MOD_RELEASE = 3
+ACT_FUNC = 4
+ACT_FN_PRESS = 5
+ACT_FN_RELEASE = 6
+ACT_CLEAR = 7
+ACT_HUFFMAN_MODE = 8
+ACT_ADAPTIVE_MODE = 9
+ACT_MACRO = 10
+ACT_COPY = 11
+ACT_REPEAT = 12
+ACT_HOLD = 13
+ACT_HOLD_STOP = 14
+ACT_HEX_MODE = 15
+
+
+def build_dispatch_table():
+    """Build the ACTION, KEYCODE, MODIFIER and FN_KEYCODE byte tables."""
+    action = bytearray(256)
+    keycode = bytearray(256)
+    modifier = bytearray(256)
+    fn_keycode = bytearray(256)
+
+    def put(value, act, kc=0, mod=0):
+        action[value] = act
+        keycode[value] = kc
+        modifier[value] = Keycode.modifier_bit(mod) if mod else 0
+
+    # Control characters (Ctrl+A=0x01 ... Ctrl+Z=0x1A)
+    for value in range(0x01, 0x1B):
+        put(value, ACT_KEY, Keycode.A + (value - 1), Keycode.LEFT_CONTROL)
+
+    # Printable ASCII (0x20-0x7E)
+    for value in range(0x20, 0x7F):
+        kc, needs_shift = ascii_to_keypress(chr(value))
+        if kc is not None:
+            put(value, ACT_KEY, kc, Keycode.LEFT_SHIFT if needs_shift else 0)
+
+    for value, kc in MOD_PRESS_MAP.items():
+        put(value, ACT_MOD_PRESS, kc, kc)
+    for value, kc in MOD_RELEASE_MAP.items():
+        put(value, ACT_MOD_RELEASE, kc, kc)
+    for value, kc in NAV_MAP.items():
+        put(value, ACT_KEY, kc)
+    for value, kc in FUNC_MAP.items():
+        mod, fn_kc = FN_MAPPING.get(kc, (FN_DEFAULT_MODIFIER, kc))
+        put(value, ACT_FUNC, kc, mod)
+        fn_keycode[value] = fn_kc
+
+    put(PROTO_CLEAR_BUFFER, ACT_CLEAR)
+    put(PROTO_CAPS_LOCK, ACT_KEY, Keycode.CAPS_LOCK)
+    put(PROTO_FN_PRESS, ACT_FN_PRESS)
+    put(PROTO_FN_RELEASE, ACT_FN_RELEASE)
+    put(PROTO_HUFFMAN_MODE, ACT_HUFFMAN_MODE)
+    put(PROTO_ADAPTIVE_MODE, ACT_ADAPTIVE_MODE)
+    put(PROTO_COPY, ACT_COPY)
+    put(PROTO_REPEAT, ACT_REPEAT)
+    put(PROTO_HOLD, ACT_HOLD)
+    put(PROTO_HOLD_STOP, ACT_HOLD_STOP)
+    put(PROTO_HEX_MODE, ACT_HEX_MODE)
+    put(PROTO_HEX_UPPER_MODE, ACT_HEX_MODE)
+    for value in range(MACRO_FIRST, MACRO_LAST + 1):
+        put(value, ACT_MACRO)
+    return action, keycode, modifier, fn_keycode
+
+
+ACTION, KEYCODE, MODIFIER, FN_KEYCODE = build_dispatch_table()
+
+
+# -------------------------
+# Pin sources
+# -------------------------
+class DebouncedPins:
+    """Polled pin source over a list of Debouncer-like objects.
+
+    Presses are stamped with the time of the update() that saw them, so any
+    delay in getting back to the scan shows up as timing error.
+
+    With an edgetrace.EdgeTrace, every debounced press and release is
+    recorded, and so is every change of the undebounced pins in raw (the
+    DigitalInOuts behind the debouncers), as seen once per update().
+
+    With raw, settling is True while any raw pin differs from its debounced
+    level: an edge is waiting out the debounce interval, and a debouncer
+    only sees it through if it is polled again within that interval.
+    """
+
+    def __init__(self, debouncers, trace=None, raw=None):
+        self.keys = debouncers
+        self.count = len(debouncers)
+        self.pending = 0  # bit i set: key i fell in the last update()
+        self.timestamp = 0
+        self.trace = trace
+        self.raw = raw
+        self.raw_down = 0  # bit i set: raw pin i read pressed last update()
+        self.settling = False
+
+    def update(self, now):
+        pending = 0
+        settling = False
+        trace = self.trace
+        raw = self.raw
+        for i in range(self.count):
+            key = self.keys[i]
+            key.update()
+            if raw is not None:
+                down = 0 if raw[i].value else 1
+                if down == key.value:  # value is the pulled-up level
+                    settling = True
+                if trace is not None and down != (self.raw_down >> i) & 1:
+                    self.raw_down ^= 1 << i
+                    trace.record(now, i, down, True)
+            if key.fell:
+                pending |= 1 << i
+                if trace is not None:
+                    trace.record(now, i, True)
+            elif trace is not None and key.rose:
+                trace.record(now, i, False)
+        self.pending = pending
+        self.settling = settling
+        self.timestamp = now
+
+    def next_press(self):
+        pending = self.pending
+        if not pending:
+            return -1
+        i = 0
+        while not pending & (1 << i):
+            i += 1
+        self.pending = pending & ~(1 << i)
+        return i
+
+
+class KeypadPins:
+    """Pin source over a keypad.Keys event queue.
+
+    keypad scans and debounces the pins in the background and stamps every
+    event with the ticks_ms of the scan that saw it. Presses that arrive
+    while the main loop is busy wait in the queue with their real time.
+    event is a preallocated keypad.Event that get_into() fills in place.
+    With an edgetrace.EdgeTrace, every event is recorded, releases too.
+    """
+
+    def __init__(self, keys, event, trace=None):
+        self.events = keys.events
+        self.event = event
+        self.count = keys.key_count
+        self.timestamp = 0
+        self.overflows = 0  # times the queue filled up and lost events
+        self.trace = trace
+        self.settling = False  # keypad debounces in the background
+
+    def update(self, now):
+        if self.events.overflowed:
+            self.overflows += 1
+            self.events.overflowed = False
+
+    def next_press(self):
+        event = self.event
+        trace = self.trace
+        while self.events.get_into(event):
+            if trace is not None:
+                trace.record(event.timestamp, event.key_number, event.pressed)
+            if event.pressed:
+                self.timestamp = event.timestamp
+                return event.key_number
+        return -1
+
+
+# -------------------------
+# HID sinks
+# -------------------------
+class ReportHID:
+    """HID sink that sends whole keyboard reports.
+
+    Writes the modifier byte and keycode straight into the Keyboard's own
+    report buffer so a keystroke costs one "down" and one "up" report,
+    instead of one report per Keyboard.press()/release() call. Modifiers
+    latched with hold() stay set across taps.
+
+    device is the keyboard's HID device (adafruit_hid.find_device()),
+    which sends the buffer as it is. Without one, Keyboard.press() with no
+    keys does the same, one report per call.
+
+    With a Telemetry, the time from edge_time (set by the Receiver) to each
+    key-down or modifier report goes into its latency histogram.
+    """
+
+    def __init__(self, keyboard, telemetry=None, device=None):
+        self.keyboard = keyboard
+        self.report = keyboard.report
+        if device is not None:
+            self.send_report = device.send_report
+        else:
+            self.send_report = self.press_none
+        self.held = 0
+        self.telemetry = telemetry
+        self.edge_time = 0
+
+    def press_none(self, report):
+        # report is the Keyboard's own buffer, sent unchanged
+        self.keyboard.press()
+
+    def sent(self):
+        tm = self.telemetry
+        tm.observe(HIST_LATENCY, ticks_diff(tm.ticks(), self.edge_time))
+
+    def tap(self, mods, keycode):
+        self.key_down(mods, keycode)
+        self.key_up()
+
+    def key_down(self, mods, keycode):
+        """First report of a tap(), for callers that send the two apart."""
+        report = self.report
+        report[0] = self.held | mods
+        report[2] = keycode
+        self.send_report(report)
+        if self.telemetry is not None:
+            self.sent()
+
+    def key_up(self):
+        report = self.report
+        report[0] = self.held
+        report[2] = 0
+        self.send_report(report)
+
+    def hold(self, mods):
+        self.held |= mods
+        self.report[0] = self.held
+        self.send_report(self.report)
+        if self.telemetry is not None:
+            self.sent()
+
+    def unhold(self, mods):
+        self.held &= ~mods
+        self.report[0] = self.held
+        self.send_report(self.report)
+        if self.telemetry is not None:
+            self.sent()
+
+    def release_all(self):
+        self.held = 0
+        self.keyboard.release_all()
+
+
+# -------------------------
+# GC monitoring
+# -------------------------
+GC_STATS_INTERVAL_MS = 60000  # between idle stats lines
+LOG_FLUSH_IDLE_MS = 100       # without a key press before trace is flushed
+LOG_FLUSH_BATCH = 4       # trace records printed per idle loop pass
+GC_LOW_WATER = 16 * 1024  # collect early below this many free bytes
+GC_THRESHOLD = 32 * 1024  # automatic collection after this much allocation
+
+
+class GCMonitor:
+    """Times garbage collection and moves it between frames.
+
+    idle() collects when the receiver is waiting for a start symbol and the
+    heap runs low, and records how long each pause took. Automatic
+    collection stays on as a backstop, set by gc.threshold() (where the
+    port has it) to run after GC_THRESHOLD bytes rather than only once the
+    heap is full; its pauses show in loop(), which tracks the longest gap
+    between two main loop passes and so bounds how late any edge can be
+    seen, GC or not. out_of_memory() collects after a MemoryError.
+    """
+
+    def __init__(self, gc_module, ns_clock, log=None, stall_budget_ms=10):
+        self.gc = gc_module
+        self.ns_clock = ns_clock
+        self.log = log
+        # Longest acceptable stall: one Debouncer interval
+        self.stall_budget_ms = stall_budget_ms
+        # mem_free/mem_alloc only exist on CircuitPython/MicroPython
+        self.mem_free = getattr(gc_module, "mem_free", None)
+        self.mem_alloc = getattr(gc_module, "mem_alloc", None)
+        threshold = getattr(gc_module, "threshold", None)
+        if threshold is not None:
+            threshold(GC_THRESHOLD)
+
+        self.pauses = 0
+        self.out_of_memory_count = 0
+        self.max_pause_us = 0
+        self.total_pause_us = 0
+        self.max_loop_ms = 0
+        self.loops = 0
+        self.allocated = 0  # bytes allocated between collections
+        self.base_alloc = self.mem_alloc() if self.mem_alloc is not None else 0
+        self.last_loop = None
+        self.last_stats = None
+
+    def loop(self, now):
+        if self.last_loop is not None:
+            gap = ticks_diff(now, self.last_loop)
+            if gap > self.max_loop_ms:
+                self.max_loop_ms = gap
+        self.last_loop = now
+        self.loops += 1
+
+    def collect(self):
+        if self.mem_alloc is not None:
+            self.allocated += self.mem_alloc() - self.base_alloc
+        start = self.ns_clock()
+        self.gc.collect()
+        pause_us = (self.ns_clock() - start) // 1000
+        self.pauses += 1
+        self.total_pause_us += pause_us
+        if pause_us > self.max_pause_us:
+            self.max_pause_us = pause_us
+        if self.mem_alloc is not None:
+            self.base_alloc = self.mem_alloc()
+        # Counted in max_pause_us, not as a main loop gap
+        self.last_loop = None
+
+    def out_of_memory(self):
+        """A MemoryError was caught: collect right away, mid-frame or not."""
+        self.out_of_memory_count += 1
+        self.collect()
+
+    def idle(self, now):
+        """Called between frames: collect if the heap is getting low."""
+        if self.mem_free is not None and self.mem_free() < GC_LOW_WATER:
+            self.collect()
+        if self.last_stats is None:
+            self.last_stats = now
+        elif ticks_diff(now, self.last_stats) >= GC_STATS_INTERVAL_MS:
+            self.last_stats = now
+            if self.log is not None:
+                self.log.text(LEVEL_INFO, self.summary())
+
+    def worst_stall_ms(self):
+        """Longest time the loop was not scanning keys."""
+        return max(self.max_loop_ms, (self.max_pause_us + 999) // 1000)
+
+    def summary(self):
+        return "GC: pauses={} max={}us total={}us max_loop={}ms alloc/loop={:.2f}B oom={} {}".format(
+            self.pauses, self.max_pause_us, self.total_pause_us, self.max_loop_ms,
+            self.allocated / self.loops if self.loops else 0.0, self.out_of_memory_count,
+            "ok" if self.worst_stall_ms() <= self.stall_budget_ms else "OVER BUDGET")
+
+
+# -------------------------
+# Receiver
+# -------------------------
+class Receiver:
+    """Start-symbol framed binary receiver.
+
+    Call poll() as often as possible; run() does that forever. Bits are
+    shifted into an integer register, and nothing on the per-edge or
+    per-byte path allocates: events go to a TraceLog ring buffer, which is
+    only formatted and printed once the keys have been quiet for
+    LOG_FLUSH_IDLE_MS.
+    """
+
+    def __init__(self, clock, pins, hid, log=None, gc_monitor=None, prefix=None,
+                 adaptive=None, macros=None, chord_window_ms=0, lanes=0, fec=False,
+                 resync=False, telemetry=None):
+        self.clock = clock
+        self.pins = pins
+        self.hid = hid
+        self.log = log if log is not None else TraceLog(None, LEVEL_OFF, size=1)
+        self.gc_monitor = gc_monitor
+        self.prefix = prefix
+        self.adaptive = adaptive
+        self.macros = macros
+        self.telemetry = telemetry
+        self.mode = MODE_BYTE
+        self.coder = None  # decoder for the current coded mode
+        # Typed history for PROTO_COPY
+        self.history = bytearray(HISTORY_SIZE)
+        self.hist_pos = 0  # next slot to write
+        self.hist_len = 0
+        self.arg_op = 0    # action whose argument bytes are being collected
+        self.arg_need = 0  # argument bytes still owed to it
+        self.arg0 = 0
+        # Hex mode: digits still to come, the one being received, alphabet
+        self.hex_left = 0
+        self.hex_value = 0
+        self.hex_nbits = 0
+        self.hex_digits = HEX_DIGITS
+        # Key being repeated by poll(), see PROTO_REPEAT and PROTO_HOLD
+        self.rep_key = 0
+        self.rep_left = 0
+        self.rep_interval = 0  # ms between keys, 0 = every pass
+        self.rep_next = 0
+        self.hold_interval_ms = HOLD_INTERVAL_MS
+
+        self.state = STATE_WAIT_START_0
+        self.state_enter_time = 0
+        self.last_key_time = clock()
+        # Learned timing (see DESYNC_GAP_X4), 0 = not learned yet
+        self.resync = resync
+        self.period_x16 = 0
+        self.frame_gap_x16 = 0
+        self.start_late = False  # this start press is one period late
+        self.lost_from = 0       # last press before the last lost frame
+        self.hunting = False  # skipping the rest of a lost frame
+        self.hunt_from = 0    # last press before the loss
+        self.missed = False   # a 0 stands in for a missed pulse in this byte
+        self.filled = False   # ... somewhere in this frame
+        # Set once the keys have been quiet for LOG_FLUSH_IDLE_MS, so an
+        # idle stretch longer than half the tick period cannot look recent
+        self.quiet = False
+        self.shift = 0  # received bits, MSB first
+        self.nbits = 0
+        self.start_key = 0  # key that opened the start symbol
+        self.frame_start = 0  # its press time
+        self.remaining = 0  # bytes still to come in this frame after the current one
+        self.burst_more = 0  # ... or that many more, after a guessed length bit
+        # Chords: 0 turns ternary frames off. Where a chord may come next,
+        # a press waits up to chord_window_ms for the other key.
+        self.chord_window_ms = chord_window_ms
+        self.pending_key = -1
+        self.pending_time = 0
+        # Lanes: 0 for the two-key protocol
+        if lanes and lanes not in LANE_COUNTS:
+            raise ValueError("lanes must be one of {}".format(LANE_COUNTS))
+        self.lanes = lanes
+        self.lane_start = ((1 << lanes) - 1) << 1  # start stroke key mask
+        self.pending_mask = 0  # keys down in the stroke being collected
+        # FEC framing (binary frames only, see fec.py)
+        if fec and lanes:
+            raise ValueError("fec needs two-key frames, not lanes")
+        self.fec = fec
+        self.fec_corrected = 0  # codewords with a bit fixed
+        self.fec_dropped = 0    # single bytes and bursts dropped
+        # Burst being held until its check word: bytes, how many are in,
+        # how many are due (0 = single-byte frame), running CRC, bad word seen
+        self.fec_buf = bytearray(BURST_MAX)
+        self.fec_held = 0
+        self.fec_len = 0
+        self.fec_crc = 0
+        self.fec_bad = False
+        # The codewords those bytes came in, see repair_slip()
+        self.fec_raw = array("H", [0] * BURST_MAX)
+        # Cleared by any drop: until a frame arrives intact, stray pulses of
+        # the lost frame may follow, so single bytes must be exact codewords
+        self.fec_in_step = True
+        self.fec_fill = 0  # codeword bit that stands in for a missed pulse
+        # Track Fn key state
+        self.fn_pressed = False
+        self.debug_press_count = 0
+        # Setup left until after startup, see defer()
+        self.deferred = []
+
+    def defer(self, step):
+        """Run step() once the keys are idle instead of now.
+
+        For setup the first frame does not need, so the receiver is ready
+        sooner after power-up: code.py builds the Huffman tree and the
+        adaptive model and loads the macros this way. A mode switch or
+        macro byte arriving first runs every deferred step on the spot.
+        """
+        self.deferred.append(step)
+
+    def finish_setup(self):
+        """Run every deferred step now."""
+        while self.deferred:
+            self.deferred.pop(0)()
+
+    def emergency_clear(self):
+        """Emergency clear - release all keys.
+
+        Framing is left alone: this runs at a byte boundary, and in a burst
+        the bytes after the clear still belong to the frame. The typed
+        history is emptied, as on the sender.
+        """
+        self.log.error(EV_CLEAR)
+        if self.telemetry is not None:
+            self.telemetry.count(CNT_CLEARS)
+        self.rep_left = 0
+        self.hid.release_all()
+        self.hist_len = 0
+
+    def process_byte(self, value):
+        """Process a complete received byte. Out of memory, the byte is
+        dropped after a collection rather than ending the session."""
+        try:
+            self.act_on_byte(value)
+        except MemoryError:
+            if not self.out_of_memory(value):
+                raise
+
+    def out_of_memory(self, value):
+        """Log a MemoryError while handling value (a byte, or
+        NO_MEMORY_REPORT) and collect. False without a GCMonitor."""
+        if self.gc_monitor is None:
+            return False
+        self.log.error(EV_NO_MEMORY, value)
+        self.gc_monitor.out_of_memory()
+        return True
+
+    def act_on_byte(self, value):
+        """process_byte() itself."""
+        if self.mode == MODE_ADAPTIVE:
+            # The sender's model sees the same bytes in the same order
+            if value == PROTO_CLEAR_BUFFER:
+                self.adaptive.clear()
+            else:
+                self.adaptive.learn(value)
+        if self.rep_left:
+            if self.rep_interval:
+                # A hold ends at the next byte
+                self.rep_left = 0
+            else:
+                # Repeats come before anything received after them
+                self.finish_repeat()
+        if self.arg_need:
+            self.take_arg(value)
+            return
+        hid = self.hid
+        act = ACTION[value]
+        kc = KEYCODE[value]
+        mod = MODIFIER[value]
+        if self.deferred and (act == ACT_HUFFMAN_MODE or act == ACT_ADAPTIVE_MODE or act == ACT_MACRO):
+            self.finish_setup()
+
+        if act == ACT_KEY:
+            hid.tap(mod, kc)
+        elif act == ACT_MOD_PRESS:
+            hid.hold(mod)
+        elif act == ACT_MOD_RELEASE:
+            hid.unhold(mod)
+        elif act == ACT_FUNC:
+            if self.fn_pressed:
+                hid.tap(mod, FN_KEYCODE[value])
+            else:
+                hid.tap(0, kc)
+        elif act == ACT_FN_PRESS:
+            self.fn_pressed = True
+        elif act == ACT_FN_RELEASE:
+            self.fn_pressed = False
+        elif act == ACT_CLEAR:
+            self.emergency_clear()
+            return
+        elif act == ACT_HUFFMAN_MODE and self.prefix is not None:
+            self.set_mode(MODE_HUFFMAN)
+        elif act == ACT_ADAPTIVE_MODE and self.adaptive is not None:
+            self.set_mode(MODE_ADAPTIVE)
+        elif act == ACT_MACRO and self.play_macro(value):
+            pass
+        elif act == ACT_COPY or act == ACT_HOLD:
+            self.arg_op = act
+            self.arg_need = 2
+        elif act == ACT_REPEAT:
+            self.arg_op = act
+            self.arg_need = 1
+        elif act == ACT_HEX_MODE:
+            self.arg_op = act
+            self.arg_need = 1
+            self.hex_digits = HEX_DIGITS_UPPER if value == PROTO_HEX_UPPER_MODE else HEX_DIGITS
+        elif act == ACT_HOLD_STOP:
+            pass
+        else:
+            self.unknown(value)
+            return
+        if act <= ACT_FUNC:
+            self.remember(value)
+        self.log.info(EV_BYTE, value)
+        if self.telemetry is not None:
+            self.telemetry.count(CNT_BYTES)
+
+    def unknown(self, value):
+        """A byte (or ternary value, or opcode argument) with no action."""
+        self.log.error(EV_UNKNOWN, value)
+        if self.telemetry is not None:
+            self.telemetry.count(CNT_UNKNOWN)
+
+    def type_byte(self, v):
+        """Type a key, modifier or function key byte with no side effects."""
+        act = ACTION[v]
+        hid = self.hid
+        if act == ACT_KEY:
+            hid.tap(MODIFIER[v], KEYCODE[v])
+        elif act == ACT_MOD_PRESS:
+            hid.hold(MODIFIER[v])
+        elif act == ACT_MOD_RELEASE:
+            hid.unhold(MODIFIER[v])
+        elif self.fn_pressed:
+            hid.tap(MODIFIER[v], FN_KEYCODE[v])
+        else:
+            hid.tap(0, KEYCODE[v])
+
+    def remember(self, v):
+        pos = self.hist_pos
+        self.history[pos] = v
+        self.hist_pos = (pos + 1) & (HISTORY_SIZE - 1)
+        if self.hist_len < HISTORY_SIZE:
+            self.hist_len += 1
+
+    def take_arg(self, value):
+        """Collect an opcode's argument bytes and act once all are in."""
+        if self.arg_need == 2:
+            self.arg0 = value
+            self.arg_need = 1
+            return
+        self.arg_need = 0
+        op = self.arg_op
+        if op == ACT_COPY:
+            self.copy(self.arg0 + 1, value + COPY_MIN)
+        elif op == ACT_REPEAT:
+            if not self.hist_len:
+                self.unknown(PROTO_REPEAT)
+                return
+            self.start_repeat(self.history[(self.hist_pos - 1) & (HISTORY_SIZE - 1)],
+                              value + 1, 0)
+        elif op == ACT_HOLD:
+            key = self.arg0
+            if key not in NAV_MAP:
+                self.unknown(PROTO_HOLD)
+                return
+            interval = self.hold_interval_ms
+            self.start_repeat(key, value or HOLD_MAX_MS // interval, interval)
+        elif op == ACT_HEX_MODE:
+            self.hex_left = value + 1
+            self.hex_value = 0
+            self.hex_nbits = 0
+            self.set_mode(MODE_HEX)
+
+    def start_repeat(self, key, count, interval):
+        self.rep_key = key
+        self.rep_left = count
+        self.rep_interval = interval
+        self.rep_next = self.clock()
+
+    def repeat_step(self, now):
+        """Type one repeated key if it is due."""
+        if ticks_diff(now, self.rep_next) < 0:
+            return
+        if self.telemetry is not None:
+            # Latency of a scheduled key counts from when it falls due
+            self.hid.edge_time = now
+        self.type_byte(self.rep_key)
+        if not self.rep_interval:
+            self.remember(self.rep_key)
+        self.rep_left -= 1
+        self.rep_next = (now + self.rep_interval) & TICKS_MAX
+
+    def finish_repeat(self):
+        """Type whatever is left of a PROTO_REPEAT right now."""
+        while self.rep_left and not self.rep_interval:
+            self.repeat_step(self.rep_next)
+
+    def copy(self, distance, length):
+        """Re-type length bytes starting distance back in the history."""
+        if distance > self.hist_len:
+            self.log.error(EV_COPY, 0)
+            return
+        history = self.history
+        src = (self.hist_pos - distance) & (HISTORY_SIZE - 1)
+        n = length
+        while n:
+            # The copy may overlap what it is writing, as in LZ77
+            v = history[src]
+            self.type_byte(v)
+            self.remember(v)
+            src = (src + 1) & (HISTORY_SIZE - 1)
+            n -= 1
+        self.log.info(EV_COPY, length)
+
+    def play_macro(self, value):
+        """Type the key sequence stored for macro opcode value.
+
+        Returns False if no macro is defined for it. The loader only lets
+        key, modifier and function key bytes into a macro.
+        """
+        macros = self.macros
+        if macros is None:
+            return False
+        k = value - MACRO_FIRST
+        i = macros.offsets[k]
+        end = macros.offsets[k + 1]
+        if i == end:
+            return False
+        blob = macros.blob
+        while i < end:
+            self.type_byte(blob[i])
+            i += 1
+        return True
+
+    def set_mode(self, mode):
+        if mode == MODE_HUFFMAN:
+            self.coder = self.prefix
+        elif mode == MODE_ADAPTIVE:
+            self.coder = self.adaptive
+            # Every adaptive stream starts from the initial model
+            self.adaptive.clear()
+        else:
+            self.coder = None
+        if self.coder is not None:
+            self.coder.reset()
+        self.mode = mode
+        self.log.info(EV_MODE, mode)
+
+    def mode_bit(self, bit):
+        """Feed one data bit to the active coded-mode decoder."""
+        if self.mode == MODE_HEX:
+            self.hex_bit(bit)
+            return
+        sym = self.coder.bit(bit)
+        if sym < 0:
+            return
+        if sym == SYM_END:
+            self.set_mode(MODE_PAD)
+        else:
+            self.process_byte(sym)
+
+    def hex_bit(self, bit):
+        self.hex_value = (self.hex_value << 1) | bit
+        self.hex_nbits += 1
+        if self.hex_nbits < 4:
+            return
+        value = self.hex_digits[self.hex_value]
+        self.hex_value = 0
+        self.hex_nbits = 0
+        self.hex_left -= 1
+        if not self.hex_left:
+            # Rest of this byte is padding
+            self.set_mode(MODE_PAD)
+        self.process_byte(value)
+
+    def expire(self, now):
+        """Apply the start-symbol and desync timeouts as of tick now."""
+        if self.pending_key >= 0 and ticks_diff(now, self.pending_time) > self.chord_window_ms:
+            # The other key never came: it was a single press
+            self.resolve_pending()
+        if self.pending_mask and ticks_diff(now, self.pending_time) > self.chord_window_ms:
+            self.lane_stroke()
+
+        if self.state == STATE_WAIT_START_1:
+            # Waiting for key1 to complete start symbol. With a learned bit
+            # period, until a press could still be the first bit after a
+            # missed second start pulse (see on_press())
+            waited = ticks_diff(now, self.state_enter_time)
+            if waited > START_SYMBOL_TIMEOUT_MS and not (
+                    self.period_x16 and self.quarters(waited) < LOST_GAP_X4):
+                self.log.info(EV_START_TIMEOUT)
+                if self.telemetry is not None:
+                    self.telemetry.count(CNT_START_TIMEOUTS)
+                self.state = STATE_WAIT_START_0
+
+        elif self.state >= STATE_RECEIVING:
+            # Receiving bits - timeout means desync, fall back to
+            # waiting for a fresh start symbol
+            quiet = ticks_diff(now, self.last_key_time)
+            if quiet > CLEAR_TIMEOUT_MS:
+                self.lose_frame()
+            elif self.period_x16 and (self.state != STATE_LANES or self.nbits):
+                # Missed pulses (a lane frame only ends mid-byte)
+                gap = LOST_GAP_X4 if self.state <= STATE_BURST_LENGTH else DESYNC_GAP_X4
+                if self.quarters(quiet) >= gap:
+                    self.lose_frame()
+                    self.hunt(self.last_key_time)
+
+        elif self.mode != MODE_BYTE or self.arg_need:
+            # Sender went quiet without ending the mode or the copy
+            if ticks_diff(now, self.last_key_time) > CLEAR_TIMEOUT_MS:
+                if self.mode != MODE_BYTE:
+                    self.set_mode(MODE_BYTE)
+                self.arg_need = 0
+
+    def lose_frame(self):
+        """Drop a partial frame and wait for a fresh start symbol."""
+        if self.nbits:
+            self.log.error(EV_DESYNC, self.nbits)
+        if self.telemetry is not None and (self.nbits or self.state != STATE_LANES):
+            # A lane frame between bytes just ended
+            self.telemetry.count(CNT_DESYNCS)
+        if self.fec and self.state <= STATE_BURST_LENGTH:
+            # Held burst bytes go with it
+            self.fec_dropped += 1
+            self.fec_in_step = False
+        self.shift = 0
+        self.nbits = 0
+        self.missed = False
+        self.fec_fill = 0
+        self.burst_more = 0
+        self.state = STATE_WAIT_START_0
+        self.lost_from = self.last_key_time
+        if self.mode != MODE_BYTE:
+            # The code stream is lost, do not guess where it resumes
+            self.set_mode(MODE_BYTE)
+        self.arg_need = 0
+
+    def hunt(self, last):
+        """Skip the rest of a frame lost after the press at tick last,
+        unless the sender is known to send frames back to back."""
+        self.hunting = (not self.frame_gap_x16
+                        or self.quarters(self.frame_gap_x16 // 16) >= DESYNC_GAP_X4)
+        self.hunt_from = last
+
+    def fill_missed(self, from_time):
+        """A press two periods after the last one in a binary frame: put a
+        0 in place of the missed pulse. FEC corrects it; otherwise the byte
+        it falls in is dropped, but the rest of the frame stays in step.
+        Returns False if the press is to be skipped as part of a lost frame."""
+        self.log.error(EV_MISSED, self.nbits)
+        if self.fec:
+            if self.nbits > FEC_WORD_BITS:
+                # Waiting for the bit after a bad codeword (repair_slip()),
+                # but the frame has ended: it was not an extra pulse
+                self.lose_frame()
+                return True
+            # The codeword tells if the guess was right, see fec_word()
+            self.fec_fill = 1 << (FEC_WORD_BITS - 1 - self.nbits)
+            self.on_symbol(0, self.last_key_time)
+            return True
+        if (self.state == STATE_BURST_LENGTH and not self.filled and self.frame_gap_x16
+                and self.quarters(self.frame_gap_x16 // 16) >= DESYNC_GAP_X4):
+            # If the missed bit was a 1 the burst runs on past the length
+            # read, and the sender's frame gap tells if it does (on_press())
+            self.burst_more = 1 << (BURST_LEN_BITS - 1 - self.nbits)
+            self.filled = True
+            self.on_symbol(0, self.last_key_time)
+            return True
+        if self.filled or self.state == STATE_BURST_LENGTH or self.mode != MODE_BYTE:
+            # A wrong bit here cannot be followed through the frame, and a
+            # second gap may mean the frame was never in step
+            self.lose_frame()
+            self.hunt(from_time)
+            return not self.hunting
+        self.missed = True
+        self.filled = True
+        self.on_symbol(0, self.last_key_time)
+        return True
+
+    def quarters(self, interval):
+        """interval in quarters of the learned bit period."""
+        return interval * 64 // self.period_x16
+
+    def learn_timing(self, interval, from_time):
+        """Fold the time since the previous press, at tick from_time, into
+        the bit period or the frame gap, depending on where in a frame this
+        press falls."""
+        state = self.state
+        if state == STATE_WAIT_START_0:
+            self.start_late = False
+            if self.period_x16 and self.quarters(interval) < FRAME_GAP_MAX_X4:
+                if self.frame_gap_x16:
+                    # A back-to-back frame whose first start pulse went
+                    # missing (see START_LATE_MIN_X4). After a lost frame
+                    # the late pulse may be the lost frame's instead
+                    late = self.quarters(interval) - self.quarters(self.frame_gap_x16 // 16)
+                    if START_LATE_MIN_X4 <= late < START_LATE_MAX_X4:
+                        self.start_late = from_time != self.lost_from
+                    else:
+                        self.frame_gap_x16 += (interval * 16 - self.frame_gap_x16) >> PERIOD_EWMA_SHIFT
+                else:
+                    self.frame_gap_x16 = interval * 16
+        elif state <= STATE_BURST_LENGTH:
+            # Start symbols up to START_SYMBOL_TIMEOUT_MS always count, so
+            # a bad estimate cannot lock itself in; stray short presses
+            # inside a frame do not
+            if not self.period_x16:
+                self.period_x16 = interval * 16
+            elif ((state == STATE_WAIT_START_1 and interval <= START_SYMBOL_TIMEOUT_MS)
+                  or 2 <= self.quarters(interval) < DESYNC_GAP_X4):
+                self.period_x16 += (interval * 16 - self.period_x16) >> PERIOD_EWMA_SHIFT
+
+    def on_press(self, i, current_time):
+        """Feed one debounced key press, stamped current_time, into the
+        framing state machine."""
+        interval = ticks_diff(current_time, self.last_key_time)
+        # Timeouts are judged on the press's own timestamp, so a press
+        # that sat in a queue is neither wrongly accepted nor rejected
+        self.expire(current_time)
+        self.debug_press_count += 1
+        from_time = self.last_key_time
+        self.last_key_time = current_time
+        self.quiet = False
+
+        self.log.trace(EV_PRESS, i | self.state << 4)
+        tm = self.telemetry
+        if tm is not None:
+            tm.count(CNT_PRESSES)
+            self.hid.edge_time = current_time
+            # In-frame intervals only, and not the keys of one chord or
+            # lane stroke
+            if self.state != STATE_WAIT_START_0 and interval > self.chord_window_ms:
+                tm.observe(HIST_INTERVAL, interval)
+
+        if self.hunting:
+            # Rest of a lost frame until a gap the sender left
+            need = RESYNC_GAP_X4 if from_time == self.hunt_from else DESYNC_GAP_X4
+            if self.quarters(interval) < need:
+                return
+            self.hunting = False
+        if self.resync and not self.lanes:
+            if self.burst_more:
+                more = self.burst_more
+                self.burst_more = 0
+                if self.state == STATE_WAIT_START_0 and self.quarters(interval) < DESYNC_GAP_X4:
+                    # No frame gap after the burst: its guessed length bit
+                    # was a 1, and this press is the next byte's first bit
+                    self.state = STATE_RECEIVING
+                    self.remaining = more - 1
+            self.learn_timing(interval, from_time)
+            if self.state == STATE_WAIT_START_1 and interval > START_SYMBOL_TIMEOUT_MS:
+                # Only kept waiting by a learned bit period (expire())
+                if self.quarters(interval) >= DESYNC_GAP_X4:
+                    # The second start pulse went missing: complete the
+                    # start, this press is the frame's first bit
+                    self.log.error(EV_MISSED, 0)
+                    self.on_symbol(1 - self.start_key, from_time)
+                else:
+                    self.state = STATE_WAIT_START_0
+            elif (self.period_x16 and (self.state == STATE_RECEIVING or self.state == STATE_BURST_LENGTH)
+                    and self.quarters(interval) >= DESYNC_GAP_X4 and not self.fill_missed(from_time)):
+                return
+
+        if self.lanes:
+            # Collect the stroke, expire() decodes it once the window closes
+            if not self.pending_mask:
+                self.pending_time = current_time
+            self.pending_mask |= 1 << i
+            return
+
+        if self.pending_key >= 0:
+            if i != self.pending_key:
+                # Other key inside the window (expire() resolved older ones)
+                self.pending_key = -1
+                self.on_symbol(CHORD, self.pending_time)
+                return
+            self.resolve_pending()
+
+        if self.chord_window_ms and (self.state == STATE_WAIT_START_0
+                                     or self.state >= STATE_TERNARY_LENGTH):
+            # A chord may come next: wait to see if the other key follows
+            self.pending_key = i
+            self.pending_time = current_time
+            return
+        self.on_symbol(i, current_time)
+
+    def resolve_pending(self):
+        i = self.pending_key
+        self.pending_key = -1
+        self.on_symbol(i, self.pending_time)
+
+    def on_symbol(self, i, current_time):
+        """Advance the framing state machine by one symbol: a key index,
+        or CHORD."""
+        if self.state == STATE_WAIT_START_0:
+            if i == CHORD:
+                # Ternary frame start, one stroke instead of two
+                self.shift = 0
+                self.nbits = 0
+                self.state = STATE_TERNARY_LENGTH
+                self.frame_start = current_time
+                self.log.trace(EV_START)
+                return
+            # First part of a start symbol: key0 (byte) or key1 (burst)
+            self.start_key = i
+            self.frame_start = current_time
+            self.state = STATE_WAIT_START_1
+            self.state_enter_time = current_time
+            if self.start_late:
+                # The first part went missing and this is the second, so a
+                # single-byte start cannot turn into a burst start
+                self.start_late = False
+                self.start_key = 1 - i
+                self.log.error(EV_MISSED, 0)
+                self.on_symbol(i, current_time)
+
+        elif self.state == STATE_WAIT_START_1:
+            # Waiting for the other key to complete the start symbol
+            if i != self.start_key:
+                # START SYMBOL COMPLETE!
+                self.shift = 0
+                self.nbits = 0
+                self.remaining = 0
+                self.fec_len = 0
+                self.filled = False
+                if self.start_key == 0:
+                    self.state = STATE_RECEIVING
+                else:
+                    self.state = STATE_BURST_LENGTH
+                self.log.trace(EV_START)
+            else:
+                # Same key again - restart
+                self.state_enter_time = current_time
+                self.frame_start = current_time
+
+        elif self.state == STATE_BURST_LENGTH:
+            self.shift = (self.shift << 1) | KEYMAP[i]
+            self.nbits += 1
+            if self.fec:
+                if self.nbits < FEC_WORD_BITS:
+                    return
+                count = self.fec_word(self.shift)
+                self.shift = 0
+                self.nbits = 0
+                if count < 0 or count >= BURST_MAX:
+                    # Without the length the frame cannot be followed
+                    self.fec_dropped += 1
+                    self.fec_in_step = False
+                    self.state = STATE_WAIT_START_0
+                    if self.period_x16:
+                        self.hunt(self.last_key_time)
+                    return
+                self.fec_len = count + 1
+                self.fec_held = 0
+                self.fec_crc = 0
+                self.fec_bad = False
+                self.log.trace(EV_BURST, count + 1)
+                self.state = STATE_RECEIVING
+                return
+            elif self.nbits < BURST_LEN_BITS:
+                return
+            self.remaining = self.shift
+            self.log.trace(EV_BURST, self.shift + 1)
+            self.shift = 0
+            self.nbits = 0
+            self.state = STATE_RECEIVING
+
+        elif self.state == STATE_RECEIVING:
+            # Receiving data bits
+            bit = KEYMAP[i]
+            self.shift = (self.shift << 1) | bit
+            self.nbits += 1
+            if self.fec:
+                if self.nbits == FEC_WORD_BITS:
+                    exact = not self.fec_len and not self.fec_in_step
+                    self.fec_frame_word(self.fec_word(self.shift, exact), self.shift)
+                elif self.nbits == 2 * FEC_WORD_BITS + 1:
+                    self.repair_slip(self.shift)
+                return
+            if self.mode > MODE_PAD:
+                # Decoded as they arrive, a code can end mid-byte
+                self.mode_bit(bit)
+
+            # Check if we have a complete byte
+            if self.nbits == 8:
+                self.end_byte(self.shift)
+
+        elif self.state == STATE_TERNARY_LENGTH:
+            self.shift = self.shift * 3 + i
+            self.nbits += 1
+            if self.nbits == TERNARY_LEN_TRITS:
+                self.remaining = self.shift
+                self.log.trace(EV_BURST, self.shift + 1)
+                self.shift = 0
+                self.nbits = 0
+                self.state = STATE_TERNARY
+
+        elif self.state == STATE_TERNARY:
+            self.shift = self.shift * 3 + i
+            self.nbits += 1
+            if self.nbits == TRITS_PER_BYTE:
+                value = self.shift
+                if value > 0xFF:
+                    # 256-728 are not bytes: keep the framing, drop the value
+                    self.unknown(value)
+                    value = -1
+                else:
+                    self.feed_byte(value)
+                self.end_byte(value)
+
+    def feed_byte(self, value):
+        """Give a coded mode, if one is active, a whole byte's bits in wire
+        order (frames whose bytes only exist once complete)."""
+        k = 7
+        while k >= 0 and self.mode > MODE_PAD:
+            self.mode_bit((value >> k) & 1)
+            k -= 1
+
+    def fec_word(self, word, exact=False):
+        """Decode a SECDED codeword: the byte, or -1 if it is uncorrectable
+        (or needed a fix and exact is set, or a fix other than the bit that
+        stands in for a missed pulse)."""
+        value = secded_decode(word)
+        fill = self.fec_fill
+        if fill:
+            self.fec_fill = 0
+            if value >= 0 and value & FEC_CORRECTED and secded_encode(value & 0xFF) ^ word != fill:
+                # The gap was not a missed pulse: out of step
+                value = -1
+        if value < 0 or (exact and value & FEC_CORRECTED):
+            self.log.error(EV_FEC_DROP, word)
+            return -1
+        if value & FEC_CORRECTED:
+            value &= 0xFF
+            self.fec_corrected += 1
+            self.log.info(EV_FEC_FIX, value)
+        return value
+
+    def fec_frame_word(self, value, word):
+        """One decoded codeword (-1 if bad) of an FEC frame, received as word."""
+        self.shift = 0
+        self.nbits = 0
+        if not self.fec_len:
+            # Single-byte frame: the codeword is all the protection
+            self.state = STATE_WAIT_START_0
+            if value < 0:
+                self.fec_dropped += 1
+                self.fec_in_step = False
+                return
+            self.fec_in_step = True
+            self.end_frame()
+            self.feed_byte(value)
+            self.deliver(value)
+            return
+        if value < 0:
+            if self.period_x16:
+                # Most likely a slip (an extra pulse, or a gap that was not
+                # a missed one) and every later word is out of step
+                if self.fec_held:
+                    # Take the next bit as well, see repair_slip()
+                    self.shift = self.fec_raw[self.fec_held - 1] << FEC_WORD_BITS | word
+                    self.nbits = 2 * FEC_WORD_BITS
+                    return
+                # Find the next frame by its gap instead of counting words
+                self.lose_frame()
+                self.hunt(self.last_key_time)
+                return
+            # Keep counting words so a flip does not cost the next frame too
+            self.fec_bad = True
+        if self.fec_held < self.fec_len:
+            if value >= 0:
+                self.fec_raw[self.fec_held] = word
+                self.fec_buf[self.fec_held] = value
+                self.fec_crc = crc8_update(self.fec_crc, value)
+            self.fec_held += 1
+            return
+        # Check word: type the burst only if every byte checks out
+        self.state = STATE_WAIT_START_0
+        if self.fec_bad or value != self.fec_crc:
+            self.fec_dropped += 1
+            self.fec_in_step = False
+            self.log.error(EV_FEC_DROP, self.fec_len)
+            return
+        self.fec_in_step = True
+        self.end_frame()
+        buf = self.fec_buf
+        i = 0
+        while i < self.fec_len:
+            self.feed_byte(buf[i])
+            self.deliver(buf[i])
+            i += 1
+
+    def repair_slip(self, window):
+        """A burst codeword was bad: window holds the data codeword before
+        it, it, and the bit after. If deleting one bit makes both exact
+        codewords, an extra pulse threw them out of step: take them and go
+        on in step. Where the deleted bit may as well have been the first
+        of the window, the pulse may have come earlier, in words that
+        decoded to wrong bytes: those are mended the same way, back to the
+        word it was in. The burst check word still has the last word. If
+        no bit fits, the frame is lost."""
+        self.shift = 0
+        self.nbits = 0
+        mask = (1 << FEC_WORD_BITS) - 1
+        bits = 2 * FEC_WORD_BITS + 1
+        # A word before the bad one that needed no fix was most likely in
+        # step, one that did most likely was not
+        p = 0
+        end = bits
+        if secded_decode(window >> (FEC_WORD_BITS + 1)) & FEC_CORRECTED:
+            p = FEC_WORD_BITS + 1
+        else:
+            end = FEC_WORD_BITS + 1
+        while p < end:
+            words = ((window >> (p + 1)) << p) | (window & ((1 << p) - 1))
+            prev = secded_decode(words >> FEC_WORD_BITS)
+            if prev >= 0 and not prev & FEC_CORRECTED:
+                value = secded_decode(words & mask)
+                if value >= 0 and not value & FEC_CORRECTED:
+                    break
+            p += 1
+        else:
+            self.lose_frame()
+            self.hunt(self.last_key_time)
+            return
+        self.fec_corrected += 1
+        self.log.info(EV_FEC_FIX, prev)
+        buf = self.fec_buf
+        raw = self.fec_raw
+        j = self.fec_held - 1
+        buf[j] = prev
+        first = raw[j] >> (FEC_WORD_BITS - 1)  # where the window started
+        raw[j] = words >> FEC_WORD_BITS
+        while j and self.leads(window, p, bits):
+            # Word j - 1, less one bit, then the first bit of word j
+            window = raw[j - 1] << 1 | first
+            bits = FEC_WORD_BITS + 1
+            p = 0
+            if not secded_decode(raw[j - 1]) & FEC_CORRECTED:
+                # Not its own last bit, that would leave it as it was
+                p = 1
+            while p < bits:
+                word = ((window >> (p + 1)) << p) | (window & ((1 << p) - 1))
+                fixed = secded_decode(word)
+                if fixed >= 0 and not fixed & FEC_CORRECTED:
+                    break
+                p += 1
+            else:
+                break
+            j -= 1
+            first = raw[j] >> (FEC_WORD_BITS - 1)
+            buf[j] = fixed
+            raw[j] = word
+            self.log.info(EV_FEC_FIX, fixed)
+        crc = 0
+        j = 0
+        while j < self.fec_held:
+            crc = crc8_update(crc, buf[j])
+            j += 1
+        self.fec_crc = crc
+        self.fec_frame_word(value, words & mask)
+
+    def leads(self, window, p, bits):
+        """Whether bits p up to the top of window are all the same, so
+        deleting bit p leaves what deleting the first bit would."""
+        top = window >> p
+        return top == 0 or top == (1 << (bits - p)) - 1
+
+    def end_byte(self, value):
+        """Last symbol of a frame byte (value -1 if it was invalid)."""
+        self.shift = 0
+        self.nbits = 0
+        if self.missed:
+            # A bit of it was guessed: drop it, and a copy it was an argument of
+            self.missed = False
+            value = -1
+            self.arg_need = 0
+        if self.remaining:
+            # More bytes in this frame, no start symbol between them
+            self.remaining -= 1
+        else:
+            self.state = STATE_WAIT_START_0
+            self.end_frame()
+        if value >= 0:
+            self.deliver(value)
+
+    def end_frame(self):
+        """Count a frame decoded to its last symbol, and time it."""
+        tm = self.telemetry
+        if tm is not None:
+            tm.count(CNT_FRAMES)
+            tm.observe(HIST_FRAME, ticks_diff(self.last_key_time, self.frame_start))
+
+    def deliver(self, value):
+        """A received byte, in whatever mode is active."""
+        if self.mode == MODE_BYTE:
+            self.process_byte(value)
+        elif self.mode == MODE_PAD:
+            self.mode = MODE_BYTE
+
+    def lane_stroke(self):
+        """Decode the keys collected in pending_mask as one lane stroke."""
+        mask = self.pending_mask
+        self.pending_mask = 0
+        if mask == self.lane_start:
+            if self.nbits:
+                self.log.error(EV_DESYNC, self.nbits)
+            if self.telemetry is not None:
+                # Lane frames have no end, count them as they start
+                if self.nbits:
+                    self.telemetry.count(CNT_DESYNCS)
+                self.telemetry.count(CNT_FRAMES)
+            self.shift = 0
+            self.nbits = 0
+            self.state = STATE_LANES
+            self.log.trace(EV_START)
+            return
+        if not mask & 1 or self.state != STATE_LANES:
+            # Data keys without the strobe (a lost strobe or a lane that
+            # fired on its own), or data with no frame: wait for a start
+            self.log.error(EV_DESYNC, self.nbits + self.lanes)
+            if self.telemetry is not None:
+                self.telemetry.count(CNT_DESYNCS)
+            self.shift = 0
+            self.nbits = 0
+            self.state = STATE_WAIT_START_0
+            return
+        k = self.lanes
+        while k:
+            k -= 1
+            bit = (mask >> (k + 1)) & 1
+            self.shift = (self.shift << 1) | bit
+            self.nbits += 1
+            if self.mode > MODE_PAD:
+                self.mode_bit(bit)
+            if self.nbits == 8:
+                value = self.shift
+                self.shift = 0
+                self.nbits = 0
+                self.deliver(value)
+
+    def poll(self):
+        """One pass of the main loop: scan the keys, then timeouts."""
+        current_time = self.clock()
+
+        # Presses first: queued ones may predate current_time
+        pins = self.pins
+        pins.update(current_time)
+        i = pins.next_press()
+        while i >= 0:
+            self.on_press(i, pins.timestamp)
+            i = pins.next_press()
+        self.service(current_time)
+
+    def service(self, current_time):
+        """The rest of a poll() pass once every press is in: timeouts,
+        repeats, and GC and log flushing while idle."""
+        self.expire(current_time)
+
+        if self.rep_left:
+            self.repeat_step(current_time)
+
+        if self.state == STATE_WAIT_START_0:
+            gc_monitor = self.gc_monitor
+            if gc_monitor is not None:
+                gc_monitor.idle(current_time)
+            # Only print trace once nothing is arriving
+            if not self.quiet and ticks_diff(current_time, self.last_key_time) > LOG_FLUSH_IDLE_MS:
+                self.quiet = True
+            if self.quiet and self.deferred:
+                self.deferred.pop(0)()
+            elif self.quiet and self.log.count:
+                self.log.flush(LOG_FLUSH_BATCH)
+            if self.telemetry is not None:
+                self.telemetry.idle()
+        if self.gc_monitor is not None:
+            self.gc_monitor.loop(current_time)
+
+    def run(self):
+        while True:
+            self.poll()
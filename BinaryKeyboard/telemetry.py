@@ -0,0 +1,238 @@
+"""
+Runtime telemetry for the receiver: event counters and fixed-bucket
+latency histograms, dumped on request over the serial console.
+
+The receiver bumps counters and files timings into preallocated arrays;
+nothing is formatted until a record is asked for. Send one character to
+the console (read by the command callable given to Telemetry):
+
+  m -> one line-protocol record per counter set and histogram
+  b -> the same as one compact binary record (see pack())
+  z -> reset everything to zero
+
+Other characters go to the commands given to Telemetry, if any (code.py
+adds the edge trace's).
+
+Line protocol (InfluxDB style, no timestamp; the collector stamps it):
+
+  binkbd,unit=<id> uptime_ms=..i,presses=..i,bytes=..i,frames=..i,...
+  binkbd_hist,unit=<id>,hist=interval_ms le10=..i,...,inf=..i,count=..i,max=..i
+  binkbd_boot,unit=<id> ready_ms=..i,code_ms=..i,free=..i,cold=true
+
+The boot line (once code.py has called boot()) gives when the receiver
+was ready for the first frame: ms since reset (which includes earlier
+runs unless cold, i.e. this is the first run since power-up or reset),
+ms spent in code.py, and free heap then. z does not reset it.
+
+Histogram bucket n counts values <= HIST_EDGES[h][n] (and above the
+previous edge); the last bucket ("inf") takes everything larger.
+"""
+
+import struct
+from array import array
+
+from fec import crc8_update
+
+# -------------------------
+# Counters
+# -------------------------
+CNT_PRESSES = 0         # debounced key presses
+CNT_BYTES = 1           # bytes acted on (typed, modifiers, opcodes)
+CNT_FRAMES = 2          # frames decoded to the end (lane frames: started)
+CNT_START_TIMEOUTS = 3  # START SYMBOL TIMEOUT: key1 never followed key0
+CNT_DESYNCS = 4         # partial frames thrown away
+CNT_UNKNOWN = 5         # bytes with no action
+CNT_CLEARS = 6          # emergency clears
+
+COUNTER_NAMES = ("presses", "bytes", "frames", "start_timeouts", "desyncs",
+                 "unknown", "clears")
+
+# -------------------------
+# Histograms
+# -------------------------
+HIST_INTERVAL = 0  # ms between presses inside a frame (the bit period)
+HIST_FRAME = 1     # ms from the first start-symbol press to the last press
+HIST_LATENCY = 2   # ms from the press that completed a byte to its HID report
+
+HIST_NAMES = ("interval_ms", "frame_ms", "latency_ms")
+# Upper bucket edges in ms. Interval buckets are narrow around the usual
+# 20-100ms bit periods so a presser drifting by a few ms shows up.
+HIST_EDGES = (
+    (10, 15, 20, 25, 30, 35, 40, 45, 50, 60, 70, 80, 100, 150, 200, 500),
+    (250, 500, 1000, 2000, 4000, 8000, 16000),
+    (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+
+# -------------------------
+# Binary record
+# -------------------------
+# Header: magic, version, counters, histograms, uptime ms. Then a u32 per
+# counter, and per histogram its bucket count (u8), a u32 per bucket and
+# the largest value seen (u32). Last byte: CRC-8 (fec.crc8_update) of
+# everything before it. All little-endian.
+RECORD_MAGIC = b"BKT"
+RECORD_VERSION = 1
+HEADER_FORMAT = "<3sBBBL"
+
+
+def record_size():
+    """Bytes in a binary record."""
+    size = struct.calcsize(HEADER_FORMAT) + 4 * len(COUNTER_NAMES)
+    for edges in HIST_EDGES:
+        size += 1 + 4 * (len(edges) + 1) + 4
+    return size + 1
+
+
+class Telemetry:
+    """Counters and histograms, plus the console request handler.
+
+    ticks() -> ms ticks (the receiver's clock); command() -> a pending
+    console character or ""; write(str) prints a line; write_bytes(buf)
+    sends a binary record; commands maps further console characters to
+    callables.
+    """
+
+    def __init__(self, ticks, unit="binkbd", command=None, write=print, write_bytes=None,
+                 commands=None):
+        self.ticks = ticks
+        self.unit = unit
+        self.command = command
+        self.commands = commands
+        self.write = write
+        self.write_bytes = write_bytes
+        self.started = ticks()
+        self.counts = array("L", [0] * len(COUNTER_NAMES))
+        self.hist = tuple(array("L", [0] * (len(edges) + 1)) for edges in HIST_EDGES)
+        self.hist_max = array("L", [0] * len(HIST_EDGES))
+        self.record = bytearray(record_size())
+        self.boot_line = None
+
+    def count(self, counter):
+        self.counts[counter] += 1
+
+    def observe(self, h, value):
+        """File value (ms) into histogram h. Never allocates."""
+        if value < 0:
+            value = 0
+        edges = HIST_EDGES[h]
+        n = len(edges)
+        i = 0
+        while i < n and value > edges[i]:
+            i += 1
+        self.hist[h][i] += 1
+        if value > self.hist_max[h]:
+            self.hist_max[h] = value
+
+    def reset(self):
+        self.started = self.ticks()
+        counts = self.counts
+        for i in range(len(counts)):
+            counts[i] = 0
+        for buckets in self.hist:
+            for i in range(len(buckets)):
+                buckets[i] = 0
+        for i in range(len(self.hist_max)):
+            self.hist_max[i] = 0
+
+    def boot(self, ready_ms, code_ms, free, cold):
+        """Note the startup figures for the binkbd_boot line."""
+        self.boot_line = "binkbd_boot,unit={} ready_ms={}i,code_ms={}i,free={}i,cold={}".format(
+            self.unit, ready_ms, code_ms, free, "true" if cold else "false")
+
+    def uptime_ms(self):
+        # Ticks wrap at 2**29; a dashboard polling more often than every
+        # few days sees the wrap as a reset
+        return (self.ticks() - self.started) & ((1 << 29) - 1)
+
+    def lines(self):
+        """The line-protocol records, as a list of strings."""
+        tags = "unit={}".format(self.unit)
+        fields = ["uptime_ms={}i".format(self.uptime_ms())]
+        for name, value in zip(COUNTER_NAMES, self.counts):
+            fields.append("{}={}i".format(name, value))
+        out = ["binkbd,{} {}".format(tags, ",".join(fields))]
+        for h, name in enumerate(HIST_NAMES):
+            buckets = self.hist[h]
+            fields = ["le{}={}i".format(edge, buckets[i]) for i, edge in enumerate(HIST_EDGES[h])]
+            fields.append("inf={}i".format(buckets[-1]))
+            fields.append("count={}i".format(sum(buckets)))
+            fields.append("max={}i".format(self.hist_max[h]))
+            out.append("binkbd_hist,{},hist={} {}".format(tags, name, ",".join(fields)))
+        if self.boot_line is not None:
+            out.append(self.boot_line)
+        return out
+
+    def pack(self):
+        """Fill and return the preallocated binary record."""
+        buf = self.record
+        struct.pack_into(HEADER_FORMAT, buf, 0, RECORD_MAGIC, RECORD_VERSION,
+                         len(COUNTER_NAMES), len(HIST_EDGES), self.uptime_ms())
+        pos = struct.calcsize(HEADER_FORMAT)
+        for value in self.counts:
+            struct.pack_into("<L", buf, pos, value)
+            pos += 4
+        for h, buckets in enumerate(self.hist):
+            buf[pos] = len(buckets)
+            pos += 1
+            for value in buckets:
+                struct.pack_into("<L", buf, pos, value)
+                pos += 4
+            struct.pack_into("<L", buf, pos, self.hist_max[h])
+            pos += 4
+        crc = 0
+        for i in range(pos):
+            crc = crc8_update(crc, buf[i])
+        buf[pos] = crc
+        return buf
+
+    def dump(self, binary=False):
+        if binary:
+            if self.write_bytes is not None:
+                self.write_bytes(self.pack())
+        else:
+            for line in self.lines():
+                self.write(line)
+
+    def idle(self):
+        """Answer a console request, if one is waiting."""
+        if self.command is None:
+            return
+        c = self.command()
+        if c == "m":
+            self.dump()
+        elif c == "b":
+            self.dump(binary=True)
+        elif c == "z":
+            self.reset()
+        elif self.commands is not None and c in self.commands:
+            self.commands[c]()
+
+
+def unpack(record):
+    """(uptime_ms, counters, [(buckets, max), ...]) from a binary record.
+
+    Raises ValueError for a record that is not one. For host tools.
+    """
+    size = struct.calcsize(HEADER_FORMAT)
+    if len(record) < size + 1:
+        raise ValueError("short record")
+    crc = 0
+    for value in record[:-1]:
+        crc = crc8_update(crc, value)
+    if crc != record[-1]:
+        raise ValueError("bad CRC")
+    magic, version, ncounters, nhist, uptime = struct.unpack_from(HEADER_FORMAT, record, 0)
+    if magic != RECORD_MAGIC or version != RECORD_VERSION:
+        raise ValueError("not a version {} record".format(RECORD_VERSION))
+    pos = size
+    counters = struct.unpack_from("<{}L".format(ncounters), record, pos)
+    pos += 4 * ncounters
+    hists = []
+    for _ in range(nhist):
+        n = record[pos]
+        pos += 1
+        buckets = struct.unpack_from("<{}L".format(n), record, pos)
+        pos += 4 * n
+        hists.append((buckets, struct.unpack_from("<L", record, pos)[0]))
+        pos += 4
+    return uptime, counters, hists
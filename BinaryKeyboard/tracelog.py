@@ -0,0 +1,136 @@
+"""
+Leveled, buffered trace log for the receiver.
+
+The scan loop never formats or prints. Each log call stores a fixed-size
+(tick, event, value) record in a preallocated ring buffer; flush() turns
+records into text and prints them later, when the receiver is idle or on
+demand. When the ring is full the oldest record is overwritten and counted
+as dropped.
+
+The level is fixed when the TraceLog is built (LEVEL_OFF in production if
+you want zero overhead beyond one compare per call).
+"""
+
+from array import array
+
+try:
+    from micropython import const
+except ImportError:
+    def const(x):
+        return x
+
+# -------------------------
+# Levels
+# -------------------------
+LEVEL_OFF = const(0)
+LEVEL_ERROR = const(1)
+LEVEL_INFO = const(2)
+LEVEL_TRACE = const(3)
+
+# -------------------------
+# Events
+# -------------------------
+EV_PRESS = const(0)          # value: key | state << 4
+EV_START = const(1)          # start symbol complete
+EV_START_TIMEOUT = const(2)  # key1 never followed key0
+EV_BYTE = const(3)           # value: decoded byte
+EV_DESYNC = const(4)         # value: bits thrown away on timeout
+EV_CLEAR = const(5)          # emergency clear
+EV_UNKNOWN = const(6)        # value: byte with no action (or ternary value > 0xFF)
+EV_BURST = const(7)          # value: bytes in the burst frame
+EV_MODE = const(8)           # value: new input mode
+EV_COPY = const(9)           # value: bytes replayed from history, 0 = bad distance
+EV_FEC_FIX = const(10)       # value: byte recovered from a codeword with one bad bit
+EV_FEC_DROP = const(11)      # value: uncorrectable codeword, or length of a dropped burst
+EV_MISSED = const(12)        # value: bits of the byte before the missed pulse
+EV_NO_MEMORY = const(13)     # value: byte dropped, or NO_MEMORY_REPORT
+NO_MEMORY_REPORT = const(0x100)  # an HID report that will be sent again
+
+EVENT_NAMES = ("PRESS", "START", "START TIMEOUT", "BYTE", "DESYNC",
+               "EMERGENCY CLEAR", "UNKNOWN", "BURST", "MODE", "COPY",
+               "FEC FIX", "FEC DROP", "MISSED", "NO MEMORY")
+
+TRACE_SIZE = 256  # records kept in the ring
+
+
+def format_record(tick, event, value):
+    """Render one record as a console line."""
+    name = EVENT_NAMES[event] if event < len(EVENT_NAMES) else "EV{}".format(event)
+    if event == EV_PRESS:
+        return "{:>10} {} key={} state={}".format(tick, name, value & 0x0F, value >> 4)
+    if event in (EV_BYTE, EV_UNKNOWN, EV_FEC_FIX):
+        return "{:>10} {} 0x{:02X}".format(tick, name, value)
+    if event in (EV_FEC_DROP, EV_NO_MEMORY):
+        return "{:>10} {} 0x{:04X}".format(tick, name, value)
+    if event in (EV_DESYNC, EV_MISSED):
+        return "{:>10} {} {} bits".format(tick, name, value)
+    if event in (EV_BURST, EV_COPY):
+        return "{:>10} {} {} bytes".format(tick, name, value)
+    if event == EV_MODE:
+        return "{:>10} {} {}".format(tick, name, value)
+    return "{:>10} {}".format(tick, name)
+
+
+class TraceLog:
+    """Ring buffer of (tick, event, value) records with a level filter."""
+
+    def __init__(self, ticks, level=LEVEL_INFO, size=TRACE_SIZE, out=print):
+        self.ticks = ticks
+        self.level = level
+        self.out = out
+        self.size = size
+        self.tick = array("L", [0] * size)
+        self.event = bytearray(size)
+        self.value = array("H", [0] * size)
+        self.head = 0   # next slot to write
+        self.count = 0  # records waiting to be flushed
+        self.dropped = 0
+
+    def record(self, level, event, value=0):
+        """Store a record if level is enabled. Never allocates."""
+        if level > self.level:
+            return
+        head = self.head
+        self.tick[head] = self.ticks()
+        self.event[head] = event
+        self.value[head] = value
+        head += 1
+        if head == self.size:
+            head = 0
+        self.head = head
+        if self.count == self.size:
+            self.dropped += 1
+        else:
+            self.count += 1
+
+    def error(self, event, value=0):
+        self.record(LEVEL_ERROR, event, value)
+
+    def info(self, event, value=0):
+        self.record(LEVEL_INFO, event, value)
+
+    def trace(self, event, value=0):
+        self.record(LEVEL_TRACE, event, value)
+
+    def text(self, level, message):
+        """Print a free-form line straight away (boot, stats; not the hot path)."""
+        if level <= self.level:
+            self.out(message)
+
+    def flush(self, limit=None):
+        """Format and print up to limit pending records, oldest first.
+
+        Returns the number of records printed.
+        """
+        n = self.count if limit is None or limit > self.count else limit
+        if self.dropped:
+            self.out("TRACE: {} records dropped".format(self.dropped))
+            self.dropped = 0
+        i = (self.head - self.count) % self.size
+        for _ in range(n):
+            self.out(format_record(self.tick[i], self.event[i], self.value[i]))
+            i += 1
+            if i == self.size:
+                i = 0
+        self.count -= n
+        return n
@@ -1,4 +1,5 @@
 #include <USBHost_t36.h>
+#include <EEPROM.h>
 // -------------------------
 // USB Host objects
 // -------------------------
@@ -18,6 +19,13 @@ constexpr int SOL0_PIN = 3;
 constexpr int SOL1_PIN = 2;
 constexpr int DRV8833_ENABLE_PIN = 5;
 
+// Lanes: 0 = the two-key protocol. 1/2/4/8 = a strobe solenoid (SOL_PINS[0])
+// plus LANES data solenoids, each stroke carrying LANES bits. Must match
+// LANES and PINS in code.py; SOL_PINS[k] presses the receiver's key k.
+constexpr int LANES = 0;
+constexpr int SOL_PINS[] = {SOL0_PIN, SOL1_PIN, 6, 7, 8, 9, 10, 11, 12};
+constexpr int NUM_SOLS = LANES ? LANES + 1 : 2;
+
 // -------------------------
 // Timing (microseconds) (cant go faster)
 // -------------------------
@@ -32,7 +40,39 @@ constexpr uint32_t PULSE_TICKS = PULSE_US / TICK_US;
 constexpr uint32_t GAP_TICKS   = GAP_US   / TICK_US;
 
 // Frame structure
-constexpr int START_SYMBOL = 2; // Fire both solenoids for start symbol
+constexpr int START_SYMBOL = 2;       // SOL0 then SOL1: one byte follows
+constexpr int BURST_START_SYMBOL = 3; // SOL1 then SOL0: length, then 1-32 bytes
+constexpr int BURST_LEN_BITS = 5;     // burst length field, sent as (count - 1)
+constexpr int BURST_MAX = 1 << BURST_LEN_BITS;
+constexpr int CHORD_SYMBOL = 4;       // SOL0 and SOL1 together: trit 2, or ternary start
+constexpr int GAP_SYMBOL = 5;         // one bit period with no solenoid
+
+// Idle bit period before every frame. The receiver aborts a frame on a gap
+// longer than its learned bit period (a missed pulse) and then skips the
+// rest of it until a gap like this, so it is typing again within a frame.
+// Costs one period per frame.
+constexpr bool FRAME_GAP = true;
+
+// Ternary frames: CHORD_SYMBOL + 3-trit (count - 1) + 6 trits per byte,
+// trits 0/1/2 = SOL0/SOL1/both. Only for receivers with a chord window set
+// (code.py CHORD_WINDOW_MS), and only worth it if the two solenoids strike
+// within a couple of ms of each other.
+constexpr bool TERNARY_FRAMES = false;
+constexpr int TERNARY_LEN_TRITS = 3;
+constexpr int TERNARY_MAX = 27;       // 3^TERNARY_LEN_TRITS
+constexpr int TRITS_PER_BYTE = 6;
+
+// FEC frames: every byte and the burst length go out as a 13-bit SECDED
+// codeword, and a burst ends with the codeword of its CRC-8, so the
+// receiver can fix single bit errors and drop what it cannot fix. Must
+// match FEC in code.py; binary frames only.
+constexpr bool FEC_FRAMES = false;
+constexpr int FEC_WORD_BITS = 13;
+static_assert(!FEC_FRAMES || (!TERNARY_FRAMES && !LANES), "FEC_FRAMES needs binary frames");
+
+// Lane frames: one stroke of every data lane without the strobe, then
+// 8 / LANES strokes per byte, strobe plus the lanes of 1 bits
+constexpr uint16_t STROKE_SYMBOL = 0x8000;  // | mask of SOL_PINS to fire together
 
 // -------------------------
 // Protocol values
@@ -230,14 +270,15 @@ bool isNavigationKey(uint8_t hid, uint8_t &proto) {
 // Ring buffer
 // -------------------------
 constexpr int BUF_SIZE = 1024;
-volatile uint8_t buf[BUF_SIZE];
+volatile uint16_t buf[BUF_SIZE];
 volatile uint16_t head = 0;
 volatile uint16_t tail = 0;
+volatile uint32_t idleTicks = 0;  // solenoidISR() ticks with nothing to fire
 
 inline bool bufEmpty() { return head == tail; }
 inline bool bufFull() { return ((head + 1) % BUF_SIZE) == tail; }
 
-inline void bufPush(uint8_t v) {
+inline void bufPush(uint16_t v) {
   if (bufFull()) {
     // Drop oldest instead of new
     tail = (tail + 1) % BUF_SIZE;
@@ -246,27 +287,319 @@ inline void bufPush(uint8_t v) {
   head = (head + 1) % BUF_SIZE;
 }
 
-inline bool bufPop(uint8_t &v) {
+inline bool bufPop(uint16_t &v) {
   if (bufEmpty()) return false;
   v = buf[tail];
   tail = (tail + 1) % BUF_SIZE;
   return true;
 }
 
+// -------------------------
+// Pending protocol bytes
+// -------------------------
+// Bytes wait here until the solenoids have drained the symbol buffer, so
+// everything typed meanwhile can go out as one burst frame.
+// Only touched from loop() context (USB host callbacks run in usb.Task()).
+constexpr int BYTE_BUF_SIZE = 256;
+uint8_t byteBuf[BYTE_BUF_SIZE];
+uint16_t byteHead = 0;
+uint16_t byteTail = 0;
+
+inline uint16_t byteCount() { return (byteHead - byteTail + BYTE_BUF_SIZE) % BYTE_BUF_SIZE; }
+
+// -------------------------
+// Serial feed
+// -------------------------
+// tools/feed.py streams protocol bytes over USB serial into byteBuf with
+// credit flow control, so a file types at the full solenoid rate without
+// overflowing either queue. Host -> presser (little-endian; crc16 =
+// crc16Update() over the packet before it):
+//   'D' offset(u32) n data[n] crc16   n = 1..FEED_PACKET_MAX bytes at offset
+//   'S' offset(u32) crc16             start (or resume) counting at offset
+//   '?'                               send a status line
+// Presser -> host, lines among the debug output:
+//   @F <accepted> <credit> <framed> <boot>
+//   @N <accepted>   packet rejected (bad CRC, wrong offset, over credit)
+//   @X <framed>     emergency clear: feed stopped until the next 'S'
+// accepted: feed bytes queued so far; framed: those handed to the
+// solenoids; boot: count of power-ups (EEPROM), so the host can tell a
+// reset presser from one still typing. The host never sends past
+// accepted + credit. credit keeps FEED_KEYBOARD_RESERVE slots free for
+// the USB keyboard.
+constexpr bool SERIAL_FEED = true;
+constexpr int FEED_PACKET_MAX = 64;
+constexpr int FEED_KEYBOARD_RESERVE = 32;
+constexpr uint32_t FEED_PACKET_TIMEOUT_MS = 100;  // half a packet this old is dropped
+constexpr int FEED_BOOT_ADDR = 0;                 // EEPROM, u32
+
+bool byteFromFeed[BYTE_BUF_SIZE];  // which queued bytes came from the feed
+uint32_t feedBoot = 0;
+uint32_t feedAccepted = 0;
+uint32_t feedFramed = 0;
+uint32_t feedFrameFirst = 0;  // feedFramed before the frame in flight
+bool feedHalted = false;
+bool feedStatusDue = false;
+
 void bufClear() {
   noInterrupts();
+  bool cut = head != tail;
   head = 0;
   tail = 0;
   interrupts();
+  byteHead = 0;
+  byteTail = 0;
+  // Queued feed bytes are gone, and so is the rest of a frame in flight:
+  // report where the host has to resume and stop taking data
+  if (cut) feedFramed = feedFrameFirst;
+  feedAccepted = feedFramed;
+  feedHalted = true;
+  if (SERIAL_FEED) {
+    Serial.print("@X "); Serial.println(feedFramed);
+  }
+}
+
+// Queue a byte for framePending(); false if it was refused
+bool enqueueByte(uint8_t v, bool fromFeed = false) {
+  if (((byteHead + 1) % BYTE_BUF_SIZE) == byteTail) {
+    // A feed byte dropped here would never be framed, leaving feedFramed
+    // and the host's credit out of step: refuse the new byte instead (a
+    // keystroke; feed packets never go past credit)
+    if (byteFromFeed[byteTail]) return false;
+    // Drop oldest whole byte rather than corrupting a frame
+    byteTail = (byteTail + 1) % BYTE_BUF_SIZE;
+  }
+  byteBuf[byteHead] = v;
+  byteFromFeed[byteHead] = fromFeed;
+  byteHead = (byteHead + 1) % BYTE_BUF_SIZE;
+  return true;
 }
 
-void enqueueByte(uint8_t v) {
-  bufPush(START_SYMBOL);
-  for (int i = 7; i >= 0; i--) {
+// Next queued byte, for framePending()
+inline uint8_t takeByte() {
+  uint8_t v = byteBuf[byteTail];
+  if (byteFromFeed[byteTail]) {
+    feedFramed++;
+    feedStatusDue = true;  // credit grew
+  }
+  byteTail = (byteTail + 1) % BYTE_BUF_SIZE;
+  return v;
+}
+
+inline void pushBits(uint16_t v, int bits) {
+  for (int i = bits - 1; i >= 0; i--) {
     bufPush((v >> i) & 1);
   }
 }
 
+// Codeword for v, as BinaryKeyboard/fec.py: data bits 7..0 at positions
+// 3, 5, 6, 7, 9, 10, 11, 12, Hamming parity at 1, 2, 4, 8, overall parity at 0
+uint16_t secdedEncode(uint8_t v) {
+  static const uint8_t DATA_POS[8] = {3, 5, 6, 7, 9, 10, 11, 12};
+  uint16_t word = 0;
+  for (int i = 0; i < 8; i++) {
+    if ((v >> (7 - i)) & 1) word |= 1 << DATA_POS[i];
+  }
+  uint8_t syndrome = 0;
+  for (int pos = 1; pos < FEC_WORD_BITS; pos++) {
+    if ((word >> pos) & 1) syndrome ^= pos;
+  }
+  for (int k = 0; k < 4; k++) {
+    if ((syndrome >> k) & 1) word |= 1 << (1 << k);
+  }
+  uint8_t parity = 0;
+  for (uint16_t w = word; w; w >>= 1) parity ^= w & 1;
+  return word | parity;
+}
+
+// CRC-8/ATM (x^8 + x^2 + x + 1), as fec.py crc8_update()
+uint8_t crc8Update(uint8_t crc, uint8_t v) {
+  crc ^= v;
+  for (int i = 0; i < 8; i++) {
+    crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+  }
+  return crc;
+}
+
+// CRC-16/CCITT-FALSE (x^16 + x^12 + x^5 + 1, from 0xFFFF) for feed
+// packets, as Python's binascii.crc_hqx(data, 0xFFFF). Catches every 1-3
+// bit error in a packet, which CRC-8 does not at this length.
+uint16_t crc16Update(uint16_t crc, uint8_t v) {
+  crc ^= (uint16_t)v << 8;
+  for (int i = 0; i < 8; i++) {
+    crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+  }
+  return crc;
+}
+
+inline void pushTrits(uint16_t v, int trits) {
+  uint16_t div = 1;
+  for (int i = 1; i < trits; i++) div *= 3;
+  for (; div; div /= 3) {
+    uint8_t t = (v / div) % 3;
+    bufPush(t == 2 ? CHORD_SYMBOL : t);
+  }
+}
+
+// Frame pending bytes once the symbol buffer is empty. The ISR is usually
+// still firing the last symbol at that point, so the only idle gap is
+// FRAME_GAP. A frame after an idle spell gets extra GAP_SYMBOLs up to two
+// idle periods: the receiver reads a frame one period later than a
+// back-to-back one as having lost its first start pulse.
+// One byte: START_SYMBOL + 8 bits (10 pulses).
+// Several:  BURST_START_SYMBOL + 5-bit (count - 1) + 8 bits each,
+//           or with TERNARY_FRAMES CHORD_SYMBOL + 3-trit (count - 1) + 6 trits each.
+// FEC_FRAMES: 13-bit codewords for the bytes and length, plus a CRC-8
+//           codeword ending each burst.
+// LANES:   start stroke + 8 / LANES strokes per byte, up to BURST_MAX bytes.
+// Each preceded by GAP_SYMBOL with FRAME_GAP.
+void framePending() {
+  uint16_t n = byteCount();
+  if (n == 0 || !bufEmpty()) return;
+  feedFrameFirst = feedFramed;
+  uint32_t idle = idleTicks;
+  if (idle > (PULSE_TICKS + GAP_TICKS) / 4) {
+    for (; idle < 2 * (PULSE_TICKS + GAP_TICKS); idle += PULSE_TICKS + GAP_TICKS) {
+      bufPush(GAP_SYMBOL);
+    }
+  }
+  if (FRAME_GAP) bufPush(GAP_SYMBOL);
+
+  if (LANES) {
+    // Capped so a lost stroke only misaligns one frame
+    if (n > BURST_MAX) n = BURST_MAX;
+    constexpr uint16_t laneMask = (1 << LANES) - 1;
+    bufPush(STROKE_SYMBOL | laneMask << 1);
+    for (uint16_t i = 0; i < n; i++) {
+      uint8_t v = takeByte();
+      for (int shift = 8 - LANES; shift >= 0; shift -= LANES) {
+        bufPush(STROKE_SYMBOL | ((v >> shift) & laneMask) << 1 | 1);
+      }
+    }
+    return;
+  }
+
+  if (n == 1) {
+    bufPush(START_SYMBOL);
+    if (FEC_FRAMES) pushBits(secdedEncode(takeByte()), FEC_WORD_BITS);
+    else pushBits(takeByte(), 8);
+    return;
+  }
+
+  if (TERNARY_FRAMES) {
+    if (n > TERNARY_MAX) n = TERNARY_MAX;
+    bufPush(CHORD_SYMBOL);
+    pushTrits(n - 1, TERNARY_LEN_TRITS);
+    for (uint16_t i = 0; i < n; i++) {
+      pushTrits(takeByte(), TRITS_PER_BYTE);
+    }
+    return;
+  }
+
+  if (n > BURST_MAX) n = BURST_MAX;
+  bufPush(BURST_START_SYMBOL);
+  if (FEC_FRAMES) {
+    uint8_t crc = 0;
+    pushBits(secdedEncode(n - 1), FEC_WORD_BITS);
+    for (uint16_t i = 0; i < n; i++) {
+      uint8_t v = takeByte();
+      pushBits(secdedEncode(v), FEC_WORD_BITS);
+      crc = crc8Update(crc, v);
+    }
+    pushBits(secdedEncode(crc), FEC_WORD_BITS);
+    return;
+  }
+  pushBits(n - 1, BURST_LEN_BITS);
+  for (uint16_t i = 0; i < n; i++) {
+    pushBits(takeByte(), 8);
+  }
+}
+
+// -------------------------
+// Serial feed packets
+// -------------------------
+uint8_t feedPacket[1 + 4 + 1 + FEED_PACKET_MAX + 2];
+int feedPos = 0;
+uint32_t feedLastByteMs = 0;
+
+inline uint16_t feedCredit() {
+  int credit = BYTE_BUF_SIZE - 1 - byteCount() - FEED_KEYBOARD_RESERVE;
+  return credit > 0 ? credit : 0;
+}
+
+void feedStatus() {
+  Serial.print("@F "); Serial.print(feedAccepted);
+  Serial.print(" "); Serial.print(feedCredit());
+  Serial.print(" "); Serial.print(feedFramed);
+  Serial.print(" "); Serial.println(feedBoot);
+}
+
+void feedReject() {
+  Serial.print("@N "); Serial.println(feedAccepted);
+}
+
+// Bytes in the packet being read: 'S' is fixed, 'D' known from its length byte
+inline int feedPacketSize() {
+  if (feedPacket[0] == 'S') return 7;
+  if (feedPos < 6) return 6;
+  return 8 + feedPacket[5];
+}
+
+void feedPacketDone() {
+  int size = feedPos;
+  uint16_t crc = 0xFFFF;
+  for (int i = 0; i < size - 2; i++) crc = crc16Update(crc, feedPacket[i]);
+  if (crc != (feedPacket[size - 2] | feedPacket[size - 1] << 8)) {
+    if (!feedHalted) feedReject();
+    return;
+  }
+  uint32_t offset = feedPacket[1] | feedPacket[2] << 8 | (uint32_t)feedPacket[3] << 16 |
+                    (uint32_t)feedPacket[4] << 24;
+  if (feedPacket[0] == 'S') {
+    feedAccepted = feedFramed = feedFrameFirst = offset;
+    feedHalted = false;
+    feedStatusDue = true;
+    return;
+  }
+  if (feedHalted) return;
+  uint8_t n = feedPacket[5];
+  if (offset != feedAccepted || n > feedCredit()) {
+    feedReject();
+    return;
+  }
+  for (int i = 0; i < n; i++) enqueueByte(feedPacket[6 + i], true);
+  feedAccepted += n;
+  feedStatusDue = true;
+}
+
+// Read what the host sent, then answer with a status line if anything
+// changed. From loop(), after framePending().
+void serviceFeed() {
+  if (feedPos && millis() - feedLastByteMs > FEED_PACKET_TIMEOUT_MS) feedPos = 0;
+  while (Serial.available()) {
+    uint8_t c = Serial.read();
+    feedLastByteMs = millis();
+    if (feedPos == 0) {
+      if (c == '?') feedStatusDue = true;
+      if (c == 'D' || c == 'S') feedPacket[feedPos++] = c;
+      continue;  // anything else: a stray byte between packets
+    }
+    feedPacket[feedPos++] = c;
+    if (feedPacket[0] == 'D' && feedPos == 6 && (c == 0 || c > FEED_PACKET_MAX)) {
+      feedPos = 0;
+      if (!feedHalted) feedReject();
+      continue;
+    }
+    if (feedPos == feedPacketSize()) {
+      feedPacketDone();
+      feedPos = 0;
+    }
+  }
+  if (feedStatusDue) {
+    feedStatusDue = false;
+    feedStatus();
+  }
+}
+
 // Helper to send modifier press bytes for currently held modifiers
 void sendModifierPresses(uint8_t mods) {
   if (mods & 0x01) enqueueByte(PROTO_MOD_LCTRL_PRESS);
@@ -306,7 +639,9 @@ enum PulseState {
 
 volatile PulseState pulseState = IDLE;
 volatile uint32_t tickCount = 0;
-volatile int activePin = SOL0_PIN;
+volatile uint16_t activeMask = 0;        // SOL_PINS fired by BIT_PULSE_ON
+volatile int startFirstPin = SOL0_PIN;   // START_SYMBOL: SOL0 then SOL1
+volatile int startSecondPin = SOL1_PIN;  // BURST_START_SYMBOL: swapped
 
 IntervalTimer solTimer;
 
@@ -592,33 +927,42 @@ void pollModifiers() {
 // Solenoid ISR
 // -------------------------
 void solenoidISR() {
-  uint8_t symbol = 0;
+  uint16_t symbol = 0;
   
   switch (pulseState) {
     case IDLE:
       if (!bufEmpty()) {
         digitalWriteFast(DRV8833_ENABLE_PIN, HIGH);
+        idleTicks = 0;
         bufPop(symbol);
         
-        if (symbol == START_SYMBOL) {
+        if (symbol == START_SYMBOL || symbol == BURST_START_SYMBOL) {
           // Start symbol - fire first solenoid
-        tickCount = 0;
+          bool burst = symbol == BURST_START_SYMBOL;
+          startFirstPin = burst ? SOL1_PIN : SOL0_PIN;
+          startSecondPin = burst ? SOL0_PIN : SOL1_PIN;
+          tickCount = 0;
           pulseState = START_PULSE_ON_FIRST;
         } else {
-          // It's a bit (0 or 1)
-          activePin = symbol ? SOL1_PIN : SOL0_PIN;
+          // It's a bit (0 or 1), a chord or a lane stroke
+          if (symbol & STROKE_SYMBOL) {
+            activeMask = symbol & ~STROKE_SYMBOL;
+          } else {
+            activeMask = symbol == CHORD_SYMBOL ? 0x3 : symbol == GAP_SYMBOL ? 0 : 1 << symbol;
+          }
           tickCount = 0;
           pulseState = BIT_PULSE_ON;
         }
       } else {
         digitalWriteFast(DRV8833_ENABLE_PIN, LOW);
+        if (idleTicks < 0xFFFFFFFF) idleTicks++;
       }
       break;
 
     case START_PULSE_ON_FIRST:
-      if (tickCount == 0) digitalWriteFast(SOL0_PIN, HIGH);
+      if (tickCount == 0) digitalWriteFast(startFirstPin, HIGH);
       if (++tickCount >= PULSE_TICKS) {
-        digitalWriteFast(SOL0_PIN, LOW);
+        digitalWriteFast(startFirstPin, LOW);
         tickCount = 0;
         pulseState = START_PULSE_OFF_FIRST;
       }
@@ -633,10 +977,10 @@ void solenoidISR() {
       break;
 
     case START_PULSE_ON_SECOND:
-      // Fire second solenoid (SOL1) for start symbol
-      if (tickCount == 0) {digitalWriteFast(SOL1_PIN, HIGH);}
+      // Fire the other solenoid to complete the start symbol
+      if (tickCount == 0) {digitalWriteFast(startSecondPin, HIGH);}
       if (++tickCount >= PULSE_TICKS) {
-        digitalWriteFast(SOL1_PIN, LOW);
+        digitalWriteFast(startSecondPin, LOW);
         tickCount = 0;
         pulseState = START_PULSE_OFF_SECOND;
       }
@@ -651,11 +995,14 @@ void solenoidISR() {
       break;
 
     case BIT_PULSE_ON:
-      // Fire single solenoid for bit
-      if (tickCount == 0) {digitalWriteFast(activePin, HIGH);}
+      // Fire one solenoid for a bit, several for a chord or stroke
+      if (tickCount == 0) {
+        for (int k = 0; k < NUM_SOLS; k++) {
+          if (activeMask & (1 << k)) digitalWriteFast(SOL_PINS[k], HIGH);
+        }
+      }
       if (++tickCount >= PULSE_TICKS) {
-        digitalWriteFast(SOL0_PIN, LOW);
-        digitalWriteFast(SOL1_PIN, LOW);
+        for (int k = 0; k < NUM_SOLS; k++) digitalWriteFast(SOL_PINS[k], LOW);
         tickCount = 0;
         pulseState = BIT_PULSE_OFF;
       }
@@ -675,8 +1022,9 @@ void solenoidISR() {
 // Setup
 // -------------------------
 void setup() {
-  pinMode(SOL0_PIN, OUTPUT); digitalWrite(SOL0_PIN, LOW);
-  pinMode(SOL1_PIN, OUTPUT); digitalWrite(SOL1_PIN, LOW);
+  for (int k = 0; k < NUM_SOLS; k++) {
+    pinMode(SOL_PINS[k], OUTPUT); digitalWrite(SOL_PINS[k], LOW);
+  }
 
   // Enable the DRV8833 board
   pinMode(DRV8833_ENABLE_PIN, OUTPUT); digitalWrite(DRV8833_ENABLE_PIN, HIGH);
@@ -684,6 +1032,11 @@ void setup() {
   Serial.begin(115200);
   while (!Serial && millis() < 2000) {}
 
+  if (SERIAL_FEED) {
+    EEPROM.get(FEED_BOOT_ADDR, feedBoot);
+    EEPROM.put(FEED_BOOT_ADDR, ++feedBoot);
+  }
+
   keyboard.attachPress(onKeyPress);
   keyboard.attachRelease(onKeyRelease);
 
@@ -701,6 +1054,8 @@ void setup() {
 void loop() {
   usb.Task();
   pollModifiers();
+  framePending();
+  if (SERIAL_FEED) serviceFeed();
   
   // // Continuously monitor modifier state
   // static uint8_t lastDebugMods = 0xFF;
@@ -0,0 +1,9 @@
+"""Run the tests from anywhere: the tools package (which makes the
+receiver modules importable) lives at the repository root."""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
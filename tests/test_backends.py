@@ -0,0 +1,34 @@
+"""The same simulation runs against both input backends: the polled
+Debouncer and the keypad.Keys event queue."""
+
+import pytest
+
+from tools import sim
+
+DATA = sim.text_to_bytes(sim.SAMPLE_TEXT)
+
+SCENARIOS = {
+    "clean": {},
+    "bounce": {"jitter_us": 1500, "bounce_us": 2000, "bounce_count": 3},
+    "busy": {"busy_us": 8000},
+    "burst": {"burst": 32},
+    "resync": {"burst": 32, "resync": True},
+}
+
+
+@pytest.mark.parametrize("scenario", sorted(SCENARIOS))
+@pytest.mark.parametrize("backend", ["debouncer", "keypad"])
+def test_decodes(backend, scenario):
+    r = sim.simulate(DATA, backend=backend, seed=3, **SCENARIOS[scenario])
+    assert r.decoded == r.sent
+
+
+@pytest.mark.parametrize("burst", [1, 32])
+@pytest.mark.parametrize("backend", ["debouncer", "keypad"])
+@pytest.mark.parametrize("drop", [200, 205])
+def test_dropped_pulse_loses_one_byte(backend, burst, drop):
+    r = sim.simulate(DATA, backend=backend, burst=burst, resync=True, drop_pulse=drop,
+                     tail_us=2500000)
+    _, wrong, lost = r.alignment()
+    assert wrong == 0
+    assert lost <= 1
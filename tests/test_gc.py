@@ -0,0 +1,88 @@
+"""GCMonitor leaves automatic collection on, and a MemoryError while
+handling a byte or sending a report is survived with a collection."""
+
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from tools import sim
+from pipeline import Pipeline, QueuedHID
+from receiver import GC_THRESHOLD, GCMonitor, Receiver, ReportHID
+
+
+class FakeGC:
+    def __init__(self):
+        self.collections = 0
+        self.disabled = False
+        self.threshold_bytes = None
+
+    def collect(self):
+        self.collections += 1
+
+    def disable(self):
+        self.disabled = True
+
+    def threshold(self, amount):
+        self.threshold_bytes = amount
+
+
+class FailingKeyboard(sim.SimKeyboard):
+    """Raises MemoryError on the first fail reports."""
+
+    def __init__(self, fail):
+        super().__init__()
+        self.fail = fail
+
+    def send_report(self, report):
+        if self.fail:
+            self.fail -= 1
+            raise MemoryError
+        super().send_report(report)
+
+
+def receiver(keyboard, gc_monitor, queued=False):
+    hid = ReportHID(keyboard, device=keyboard)
+    if queued:
+        hid = QueuedHID(hid)
+    pins = SimpleNamespace(settling=False)
+    return Receiver(sim.SimClock(), pins, hid, gc_monitor=gc_monitor)
+
+
+def test_gc_stays_enabled():
+    gc = FakeGC()
+    GCMonitor(gc, time.monotonic_ns)
+    assert not gc.disabled
+    assert gc.threshold_bytes == GC_THRESHOLD
+
+
+def test_memory_error_drops_the_byte():
+    gc = FakeGC()
+    monitor = GCMonitor(gc, time.monotonic_ns)
+    keyboard = FailingKeyboard(1)
+    rx = receiver(keyboard, monitor)
+    first, second = sim.text_to_bytes("ab")
+    rx.process_byte(first)
+    assert monitor.out_of_memory_count == 1
+    assert gc.collections == 1
+    rx.process_byte(second)
+    assert keyboard.reports == 2
+
+
+def test_memory_error_without_monitor():
+    rx = receiver(FailingKeyboard(1), None)
+    with pytest.raises(MemoryError):
+        rx.process_byte(sim.text_to_bytes("a")[0])
+
+
+def test_memory_error_in_emit_resends():
+    gc = FakeGC()
+    monitor = GCMonitor(gc, time.monotonic_ns)
+    keyboard = FailingKeyboard(1)
+    rx = receiver(keyboard, monitor, queued=True)
+    rx.process_byte(sim.text_to_bytes("a")[0])
+    pipeline = Pipeline(rx)
+    while rx.hid.count:
+        pipeline.emit()
+    assert monitor.out_of_memory_count == 1
+    assert keyboard.reports == 2
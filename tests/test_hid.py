@@ -0,0 +1,49 @@
+"""ReportHID: one report per key down and per key up, through the HID
+device or, without one, Keyboard.press()."""
+
+from receiver import ReportHID
+
+
+class Device:
+    def __init__(self):
+        self.reports = []
+
+    def send_report(self, report):
+        self.reports.append(bytes(report))
+
+
+class Keyboard:
+    """Just the part of adafruit_hid's Keyboard that ReportHID uses."""
+
+    def __init__(self, device):
+        self.report = bytearray(8)
+        self.device = device
+
+    def press(self, *keycodes):
+        assert not keycodes
+        self.device.send_report(self.report)
+
+    def release_all(self):
+        self.report[:] = bytes(8)
+        self.device.send_report(self.report)
+
+
+def reports(use_device):
+    device = Device()
+    keyboard = Keyboard(device)
+    hid = ReportHID(keyboard, device=device if use_device else None)
+    hid.hold(0x02)
+    hid.tap(0x01, 0x04)
+    hid.unhold(0x02)
+    return device.reports
+
+
+def test_report_per_step():
+    expected = [
+        bytes([0x02, 0, 0, 0, 0, 0, 0, 0]),
+        bytes([0x03, 0, 0x04, 0, 0, 0, 0, 0]),
+        bytes([0x02, 0, 0, 0, 0, 0, 0, 0]),
+        bytes(8),
+    ]
+    assert reports(True) == expected
+    assert reports(False) == expected
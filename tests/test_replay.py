@@ -0,0 +1,29 @@
+"""A simulator edge trace replays to what the simulation decoded, with
+the receiver setup taken from the trace header."""
+
+import pytest
+
+from tools import replay, sim
+from edgetrace import FLAG_DEBOUNCER, FLAG_PIPELINE, FLAG_RESYNC, EdgeTrace, parse
+
+DATA = sim.text_to_bytes(sim.SAMPLE_TEXT)[:111]
+
+
+@pytest.mark.parametrize("drop", [-1, 120])
+@pytest.mark.parametrize("pipeline", [False, True])
+@pytest.mark.parametrize("backend", ["debouncer", "keypad"])
+def test_replay_matches_simulation(backend, pipeline, drop):
+    flags = FLAG_RESYNC
+    if backend == "debouncer":
+        flags |= FLAG_DEBOUNCER
+    if pipeline:
+        flags |= FLAG_PIPELINE
+    trace = EdgeTrace(20000, flags=flags, debounce_ms=sim.DEBOUNCE_US // 1000)
+    r = sim.simulate(DATA, backend=backend, drop_pulse=drop, resync=True, pipeline=pipeline,
+                     edge_trace=trace, seed=1)
+    setup, edges = parse(b"".join(bytes(piece) for piece in trace.chunks()))
+    assert replay.describe(setup).endswith("resync pipeline" if pipeline else "resync")
+    rx = replay.replay(setup, edges, replay.Profile())
+    assert rx.decoded == r.decoded
+    if pipeline:
+        assert rx.hid.count == 0
@@ -0,0 +1,36 @@
+"""Ternary (chord) frames against solenoid skew: the second key of a chord
+lands up to +/- skew_us off the first."""
+
+import pytest
+
+from tools import sim
+from receiver import CHORD_WINDOW_MS
+
+DATA = sim.text_to_bytes(sim.SAMPLE_TEXT)
+TERNARY = {"burst": sim.TERNARY_MAX, "ternary": True}
+# Long enough a gap that skew does not reach the next press of a key
+SLOW = dict(TERNARY, gap_us=35000)
+
+
+@pytest.mark.parametrize("skew_us", [0, 1000, 2000])
+@pytest.mark.parametrize("backend", ["debouncer", "keypad"])
+def test_realistic_skew(backend, skew_us):
+    for seed in range(3):
+        r = sim.simulate(DATA, backend=backend, skew_us=skew_us, seed=seed, **TERNARY)
+        assert r.decoded == r.sent
+
+
+@pytest.mark.parametrize("backend", ["debouncer", "keypad"])
+def test_skew_inside_chord_window(backend):
+    r = sim.simulate(DATA, backend=backend, skew_us=CHORD_WINDOW_MS * 1000 - 1000, **SLOW)
+    assert r.decoded == r.sent
+
+
+@pytest.mark.parametrize("backend", ["debouncer", "keypad"])
+def test_skew_past_chord_window(backend):
+    skew_us = CHORD_WINDOW_MS * 1000 + 4000
+    r = sim.simulate(DATA, backend=backend, skew_us=skew_us, **SLOW)
+    assert not r.ok
+    # A wider window takes the same skew
+    r = sim.simulate(DATA, backend=backend, skew_us=skew_us, chord_window_ms=2 * CHORD_WINDOW_MS, **SLOW)
+    assert r.decoded == r.sent
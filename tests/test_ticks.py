@@ -0,0 +1,35 @@
+"""Receiver timing in integer millisecond ticks: long uptimes and the
+adafruit_ticks wraparound, end to end through sim.simulate()."""
+
+import pytest
+
+from tools import sim
+from receiver import TICKS_MAX, TICKS_PERIOD, ticks_diff
+
+DATA = sim.text_to_bytes(sim.SAMPLE_TEXT)
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+@pytest.mark.parametrize("backend", ["debouncer", "keypad"])
+@pytest.mark.parametrize("resync", [False, True])
+@pytest.mark.parametrize("days", [0, 14, 45])
+def test_uptime(days, resync, backend):
+    # 45 days is several tick periods: the counter has wrapped before the
+    # run starts
+    r = sim.simulate(DATA, uptime_ms=days * DAY_MS, resync=resync, backend=backend)
+    assert r.decoded == r.sent
+
+
+@pytest.mark.parametrize("backend", ["debouncer", "keypad"])
+@pytest.mark.parametrize("resync", [False, True])
+def test_wraparound(resync, backend):
+    r = sim.simulate(DATA, wrap=True, resync=resync, backend=backend)
+    assert r.decoded == r.sent
+
+
+def test_ticks_diff_across_wrap():
+    start = TICKS_PERIOD - 5
+    later = (start + 40) & TICKS_MAX
+    assert later < start
+    assert ticks_diff(later, start) == 40
+    assert ticks_diff(start, later) == -40
@@ -0,0 +1,13 @@
+"""Host-side tools for the BinaryAutoTyper receiver.
+
+Run from the repository root, e.g. ``python -m tools.bench``. The receiver
+modules in BinaryKeyboard/ are made importable here so the tools exercise
+exactly the code that ships to the RP2040.
+"""
+
+import os
+import sys
+
+RECEIVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "BinaryKeyboard")
+if RECEIVER_DIR not in sys.path:
+    sys.path.insert(0, RECEIVER_DIR)
@@ -0,0 +1,92 @@
+"""
+Host-side encoder for the receiver's adaptive (order-1 rank) mode.
+
+Mirrors adaptive.ContextModel on the receiver: both start from the initial
+model at the mode switch and learn each byte sent in the mode, in order.
+Running it on text files prints pulses per character for plain 8-bit
+framing, the static Huffman table and the adaptive mode side by side.
+
+    python -m tools.adaptive transcript.txt history.log
+    python -m tools.adaptive --burst 1 notes.txt
+"""
+
+import argparse
+
+from . import RECEIVER_DIR  # noqa: F401  (puts BinaryKeyboard/ on sys.path)
+from . import huffman, sim
+from adaptive import END_RANK, AdaptiveDecoder, ContextModel
+from receiver import PROTO_ADAPTIVE_MODE, PROTO_CLEAR_BUFFER
+
+
+def gamma(n):
+    """Elias gamma code of n >= 1 as a list of bits."""
+    length = n.bit_length()
+    return [0] * (length - 1) + [(n >> i) & 1 for i in range(length - 1, -1, -1)]
+
+
+class AdaptiveCoder:
+    """Encodes byte sequences for adaptive mode, one fresh model per call."""
+
+    def receiver_options(self):
+        """Receiver keyword arguments that enable this mode."""
+        return {"adaptive": AdaptiveDecoder()}
+
+    def encode(self, data):
+        """Wire bytes for data in adaptive mode.
+
+        The mode switch byte (which resets the receiver's model), the rank
+        codes, an end code and zero padding. Returns (wire, end_bits) as
+        huffman.Codebook.encode().
+        """
+        header = [PROTO_ADAPTIVE_MODE]
+        model = ContextModel()
+        bits = []
+        end_bits = [8 * i + 7 for i in range(len(header))]
+        for value in data:
+            rank = model.context_rank(value)
+            if rank >= 0:
+                bits.extend(gamma(rank + 1))
+            else:
+                bits.extend(gamma(model.ctx_len[model.prev] + 1))
+                bits.extend(gamma(model.global_rank(value) + 1))
+            end_bits.append(8 * len(header) + len(bits) - 1)
+            if value == PROTO_CLEAR_BUFFER:
+                model.clear()
+            else:
+                model.learn(value)
+        bits.extend(gamma(model.ctx_len[model.prev] + 1))
+        bits.extend(gamma(END_RANK + 1))
+        bits.extend([0] * (-len(bits) % 8))
+
+        wire = list(header)
+        for pos in range(0, len(bits), 8):
+            value = 0
+            for b in bits[pos:pos + 8]:
+                value = (value << 1) | b
+            wire.append(value)
+        return wire, end_bits
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="transcripts to measure")
+    parser.add_argument("--burst", type=int, default=sim.BURST_MAX, help="largest burst frame in bytes")
+    args = parser.parse_args(argv)
+
+    coders = (("byte", None), ("huffman", huffman.Codebook.load()), ("adaptive", AdaptiveCoder()))
+    print("pulses per character, burst {}".format(args.burst))
+    print("{:<32} {:>7} {:>8} {:>8} {:>8}".format("file", "chars", *(name for name, _ in coders)))
+    for path in args.files:
+        data = huffman.corpus_bytes([path])
+        if not data:
+            continue
+        row = []
+        for _, coder in coders:
+            wire = coder.encode(data)[0] if coder is not None else data
+            row.append(sim.pulses_per_char(wire, len(data), args.burst))
+        print("{:<32} {:>7} {:>8.2f} {:>8.2f} {:>8.2f}".format(path[-32:], len(data), *row))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
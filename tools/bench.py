@@ -0,0 +1,188 @@
+"""
+Receiver decode benchmark.
+
+Sweeps the presser bit period downwards and reports, for each step, whether
+every trial decoded 100% correctly, the per-byte decode latency (last data
+pulse to process_byte), the host CPU time spent in process_byte and the
+number of USB HID reports sent per decoded byte.
+
+    python -m tools.bench --jitter-us 1500 --bounce-us 2000 --bounce-count 3
+    python -m tools.bench --backend both --busy-us 8000
+    python -m tools.bench --burst 32
+    python -m tools.bench --burst 32 --huffman
+    python -m tools.bench --burst 32 --adaptive
+    python -m tools.bench --burst 32 --lz
+    python -m tools.bench --burst 32 --hex --text hashes.txt
+    python -m tools.bench --burst 27 --ternary --skew-us 3000
+    python -m tools.bench --lanes 4 --skew-us 1000
+"""
+
+import argparse
+import random
+
+from . import adaptive, huffman, lz, nibble, sim
+
+
+def run_period(data, period_us, duty, backend, args):
+    """Run args.trials seeded trials at one bit period."""
+    pulse_us = int(period_us * duty)
+    gap_us = period_us - pulse_us
+    results = []
+    for trial in range(args.trials):
+        results.append(sim.simulate(
+            args.wire, pulse_us=pulse_us, gap_us=gap_us, tick_us=args.tick_us,
+            jitter_us=args.jitter_us, bounce_us=args.bounce_us,
+            bounce_count=args.bounce_count, drop_rate=args.drop_rate,
+            scan_us=args.scan_us, debounce_us=args.debounce_us,
+            seed=args.seed + trial, uptime_ms=int(args.uptime_days * 86400000),
+            wrap=args.wrap, backend=backend, busy_us=args.busy_us, burst=args.burst,
+            coder=args.coder, chars=len(data), ternary=args.ternary, skew_us=args.skew_us,
+            chord_window_ms=args.chord_window_ms, lanes=args.lanes, resync=args.resync,
+        ))
+    return pulse_us, gap_us, results
+
+
+def summarize(results):
+    ok = sum(1 for r in results if r.ok)
+    latencies = [us for r in results for us in r.latency_us]
+    cpu = [ns for r in results for ns in r.cpu_ns]
+    correct = sum(r.bytes_correct() for r in results)
+    reports = sum(r.hid_reports for r in results)
+    decoded = sum(len(r.decoded) for r in results)
+    total = sum(len(r.sent) for r in results)
+    return {
+        "ok": ok,
+        "byte_rate": correct / total if total else 1.0,
+        "lat_mean_ms": sum(latencies) / len(latencies) / 1000 if latencies else float("nan"),
+        "lat_max_ms": max(latencies) / 1000 if latencies else float("nan"),
+        "cpu_us": sum(cpu) / len(cpu) / 1000 if cpu else float("nan"),
+        "reports": reports / decoded if decoded else float("nan"),
+        "cps": sum(r.cps for r in results) / len(results) if results else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pulse-us", type=int, default=sim.PULSE_US, help="starting solenoid on time")
+    parser.add_argument("--gap-us", type=int, default=sim.GAP_US, help="starting gap between pulses")
+    parser.add_argument("--min-period-us", type=int, default=10000, help="shortest bit period to try")
+    parser.add_argument("--step-us", type=int, default=2000, help="bit period step")
+    parser.add_argument("--tick-us", type=int, default=sim.TICK_US, help="presser ISR tick")
+    parser.add_argument("--jitter-us", type=int, default=0, help="uniform +/- jitter on every edge")
+    parser.add_argument("--bounce-us", type=int, default=0, help="window after each edge holding the bounces")
+    parser.add_argument("--bounce-count", type=int, default=0, help="bounces per edge")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="probability a pulse never closes the switch")
+    parser.add_argument("--resync", action="store_true", help="receiver learns the bit period (code.py RESYNC)")
+    parser.add_argument("--scan-us", type=int, default=sim.SCAN_US, help="receiver main loop period")
+    parser.add_argument("--debounce-us", type=int, default=sim.DEBOUNCE_US, help="Debouncer interval")
+    parser.add_argument("--backend", choices=sim.BACKENDS + ("both",), default="debouncer",
+                        help="receiver input backend to simulate")
+    parser.add_argument("--busy-us", type=int, default=0, help="main loop stall after every decoded byte")
+    parser.add_argument("--uptime-days", type=float, default=0.0, help="start the receiver clock this far into a session")
+    parser.add_argument("--wrap", action="store_true", help="wrap the ticks_ms counter halfway through each run")
+    parser.add_argument("--burst", type=int, default=1,
+                        help="largest burst frame in bytes (1 = one start symbol per byte)")
+    parser.add_argument("--huffman", action="store_true",
+                        help="send in prefix-code mode using BinaryKeyboard/huffman_table.py")
+    parser.add_argument("--adaptive", action="store_true", help="send in adaptive order-1 rank mode")
+    parser.add_argument("--lz", action="store_true",
+                        help="replace repeats with PROTO_COPY back-references first")
+    parser.add_argument("--hex", action="store_true", help="send runs of hex digits in hex mode")
+    parser.add_argument("--ternary", action="store_true",
+                        help="send frames of two or more bytes as chord-started ternary frames")
+    parser.add_argument("--lanes", type=int, default=0, choices=(0,) + sim.LANE_COUNTS,
+                        help="strobe plus this many data solenoids per stroke (0 = two-key frames)")
+    parser.add_argument("--skew-us", type=int, default=0,
+                        help="+/- offset of each extra solenoid in a chord or lane stroke")
+    parser.add_argument("--chord-window-ms", type=int, default=sim.CHORD_WINDOW_MS,
+                        help="receiver window for keys to count as one chord or stroke")
+    parser.add_argument("--trials", type=int, default=5, help="trials per bit period")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--text", help="file to send instead of the built-in sample")
+    parser.add_argument("--random-bytes", type=int, default=0, help="send N random protocol bytes instead of text")
+    args = parser.parse_args(argv)
+
+    if args.random_bytes:
+        rng = random.Random(args.seed)
+        data = [rng.randrange(0x20, 0x7F) for _ in range(args.random_bytes)]
+    elif args.text:
+        with open(args.text) as f:
+            data = sim.text_to_bytes(f.read())
+    else:
+        data = sim.text_to_bytes(sim.SAMPLE_TEXT)
+
+    args.wire = data
+    if args.lz:
+        args.wire = lz.encode(data, args.burst)
+        print("lz: {} wire bytes for {} chars, {:.2f}x fewer pulses".format(
+            len(args.wire), len(data),
+            sim.pulses_per_char(data, 1, args.burst, args.ternary)
+            / sim.pulses_per_char(args.wire, 1, args.burst, args.ternary)))
+
+    args.coder = None
+    if args.huffman:
+        args.coder = huffman.Codebook.load()
+    elif args.adaptive:
+        args.coder = adaptive.AdaptiveCoder()
+    elif args.hex:
+        args.coder = nibble.HexCoder()
+    if args.coder is not None:
+        wire, _ = args.coder.encode(args.wire)
+        print("{} mode: {} wire bytes for {} chars, {:.2f} pulses/char vs {:.2f} in byte mode".format(
+            "huffman" if args.huffman else "adaptive" if args.adaptive else "hex", len(wire), len(data),
+            sim.pulses_per_char(wire, len(data), args.burst, args.ternary),
+            sim.pulses_per_char(data, len(data), args.burst, args.ternary)))
+    if args.ternary:
+        print("ternary: {:.2f} pulses/char vs {:.2f} in binary frames, chord window {}ms, skew +/-{}us".format(
+            sim.pulses_per_char(args.wire, len(data), args.burst, True),
+            sim.pulses_per_char(args.wire, len(data), args.burst),
+            args.chord_window_ms, args.skew_us))
+    if args.lanes:
+        print("lanes: {} data + strobe, {:.2f} strokes/char vs {:.2f} with two keys, window {}ms, skew +/-{}us".format(
+            args.lanes, sim.pulses_per_char(args.wire, len(data), lanes=args.lanes),
+            sim.pulses_per_char(args.wire, len(data), args.burst),
+            args.chord_window_ms, args.skew_us))
+
+    start = args.pulse_us + args.gap_us
+    duty = args.pulse_us / start
+    print("{} bytes x {} trials, duty {:.2f}, jitter {}us, bounce {}x{}us, drop {:.3f}, scan {}us, busy {}us, burst {}, uptime {}".format(
+        len(data), args.trials, duty, args.jitter_us, args.bounce_count, args.bounce_us,
+        args.drop_rate, args.scan_us, args.busy_us, args.burst,
+        "wrapping" if args.wrap else "{:g}d".format(args.uptime_days)))
+
+    backends = sim.BACKENDS if args.backend == "both" else (args.backend,)
+    status = 0
+    for backend in backends:
+        if not sweep(data, start, duty, backend, args):
+            status = 1
+    return status
+
+
+def sweep(data, start, duty, backend, args):
+    """Print one table for backend; returns the best (period, pulse, gap)."""
+    print()
+    print("backend: {}".format(backend))
+    print("{:>9} {:>8} {:>8} {:>7} {:>8} {:>9} {:>9} {:>8} {:>5} {:>7}".format(
+        "period_us", "pulse", "gap", "ok", "bytes", "lat_ms", "lat_max", "cpu_us", "rpt", "cps"))
+
+    best = None
+    period = start
+    while period >= args.min_period_us:
+        pulse_us, gap_us, results = run_period(data, period, duty, backend, args)
+        s = summarize(results)
+        print("{:>9} {:>8} {:>8} {:>3}/{:<3} {:>7.1%} {:>9.2f} {:>9.2f} {:>8.1f} {:>5.2f} {:>7.2f}".format(
+            period, pulse_us, gap_us, s["ok"], args.trials, s["byte_rate"],
+            s["lat_mean_ms"], s["lat_max_ms"], s["cpu_us"], s["reports"], s["cps"]))
+        if s["ok"] == args.trials:
+            best = (period, pulse_us, gap_us)
+        period -= args.step_us
+
+    if best:
+        print("shortest bit period decoding 100%: {}us (PULSE_US={} GAP_US={})".format(*best))
+    else:
+        print("no bit period decoded 100% of trials")
+    return best
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
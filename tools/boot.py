@@ -0,0 +1,235 @@
+"""
+Boot-to-ready time and free heap of the receiver against a budget, and the
+precompiled file set that keeps them down.
+
+code.py notes when it is ready for the first frame: ms since reset, ms
+spent in code.py itself, and the heap left. They are the binkbd_boot line
+of the console "m" record (telemetry.py). This tool asks the receiver for
+it over its serial console (--port; --reset restarts the board first, as
+ms since reset only counts on a cold start), or finds it in captured
+console output, and exits 1 if ready_ms or code_ms is over budget or
+free is under it.
+
+--build DIR compiles the receiver modules and libraries to .mpy with
+mpy-cross, which must be the CircuitPython build for the firmware's
+major version (FIRMWARE_MAJOR), and writes what goes on CIRCUITPY:
+code.py as source (CircuitPython runs it by name), the rest precompiled,
+so the board neither compiles them at boot nor needs the compiler's
+heap. A .py of a compiled module already in DIR is removed, as
+CircuitPython imports it ahead of the .mpy. macros.txt is only copied if
+DIR has none. DIR can be the mounted CIRCUITPY drive.
+
+    python -m tools.boot --build /media/$USER/CIRCUITPY
+    python -m tools.boot --port /dev/ttyACM0 --reset
+    python -m tools.boot console.log --max-ready-ms 2000
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import time
+
+from . import RECEIVER_DIR
+from .feed import FeedError, Link, open_port
+
+LIB_DIR = os.path.join(RECEIVER_DIR, "RP2040Zero_setup")
+FIRMWARE_MAJOR = 10  # RP2040Zero_setup/circuitPython10x
+
+# Budgets, with headroom; lower them once measured on the board. Ready
+# from reset includes CircuitPython's own start (safe mode wait, USB).
+READY_BUDGET_MS = 2500
+CODE_BUDGET_MS = 1000
+FREE_BUDGET = 64 * 1024
+
+RESET_TIMEOUT_S = 20  # for the port to come back after --reset
+REPORT_TIMEOUT_S = 10  # for the binkbd_boot line
+ASK_EVERY_S = 1.0
+
+
+# -------------------------
+# Precompiled build
+# -------------------------
+def sources():
+    """(module name, source path) of everything compiled to .mpy."""
+    out = []
+    for folder in (RECEIVER_DIR, LIB_DIR):
+        for name in sorted(os.listdir(folder)):
+            if name.endswith(".py") and name != "code.py":
+                out.append((name[:-3], os.path.join(folder, name)))
+    return out
+
+
+def check_mpy_cross(mpy_cross):
+    """The mpy-cross version line; raises OSError if it is missing or
+    ValueError if it is not for FIRMWARE_MAJOR."""
+    version = subprocess.run([mpy_cross, "--version"], capture_output=True, text=True,
+                             check=True).stdout.strip()
+    if "CircuitPython {}.".format(FIRMWARE_MAJOR) not in version:
+        raise ValueError("{} is not CircuitPython {}.x's mpy-cross: {}".format(
+            mpy_cross, FIRMWARE_MAJOR, version))
+    return version
+
+
+def build(out_dir, mpy_cross):
+    os.makedirs(out_dir, exist_ok=True)
+    for name, path in sources():
+        target = os.path.join(out_dir, name + ".mpy")
+        subprocess.run([mpy_cross, "-o", target, "-s", name + ".py", path], check=True)
+        shadow = os.path.join(out_dir, name + ".py")
+        if os.path.exists(shadow):
+            os.remove(shadow)
+        print("{:<24} {:>6} -> {:>6} bytes".format(name, os.path.getsize(path), os.path.getsize(target)))
+    shutil.copy(os.path.join(RECEIVER_DIR, "code.py"), out_dir)
+    if not os.path.exists(os.path.join(out_dir, "macros.txt")):
+        shutil.copy(os.path.join(RECEIVER_DIR, "macros.txt"), out_dir)
+    shutil.copytree(os.path.join(LIB_DIR, "adafruit_hid"), os.path.join(out_dir, "adafruit_hid"),
+                    dirs_exist_ok=True)
+    print("wrote {}; add the asyncio library folder for PIPELINE".format(out_dir))
+
+
+# -------------------------
+# Budget check
+# -------------------------
+def boot_fields(lines):
+    """Fields of the last binkbd_boot line as a dict, or None."""
+    for line in reversed(lines):
+        if line.startswith("binkbd_boot,"):
+            fields = {}
+            for field in line.split(" ", 1)[1].split(","):
+                key, value = field.split("=")
+                fields[key] = value == "true" if key == "cold" else int(value.rstrip("i"))
+            return fields
+    return None
+
+
+def reset_board(path):
+    """Stop code.py, reset the board from the REPL and wait for its port."""
+    fd = open_port(path)
+    try:
+        link = Link(fd)
+        link.write(b"\x03\x03")  # KeyboardInterrupt into code.py
+        time.sleep(1)
+        link.write(b"\r")        # any key for the REPL
+        time.sleep(1)
+        link.write(b"import microcontroller; microcontroller.reset()\r")
+        time.sleep(0.5)
+    finally:
+        os.close(fd)
+    deadline = time.monotonic() + RESET_TIMEOUT_S
+    gone = False
+    while time.monotonic() < deadline:
+        if not os.path.exists(path):
+            gone = True
+        elif gone:
+            return
+        time.sleep(0.1)
+    if not gone:
+        raise FeedError("{} did not reset".format(path))
+    raise FeedError("{} did not come back after the reset".format(path))
+
+
+def ask_port(path):
+    """Lines from the receiver's console until it sends a binkbd_boot line."""
+    deadline = time.monotonic() + REPORT_TIMEOUT_S
+    while True:
+        try:
+            fd = open_port(path)
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+    try:
+        link = Link(fd)
+        lines = []
+        asked = 0
+        while time.monotonic() < deadline:
+            if time.monotonic() - asked >= ASK_EVERY_S:
+                link.write(b"m")  # answered once the keys are idle
+                asked = time.monotonic()
+            lines += link.lines(0.1)
+            if boot_fields(lines) is not None:
+                return lines
+        raise FeedError("no binkbd_boot line from {}; is TELEMETRY on?".format(path))
+    finally:
+        os.close(fd)
+
+
+def check(fields, args):
+    """Print the figures against their budgets; True if all are in."""
+    ok = True
+    parts = []
+    if fields["cold"]:
+        over = fields["ready_ms"] > args.max_ready_ms
+        ok = ok and not over
+        parts.append("ready {}ms after reset (budget {}ms{})".format(
+            fields["ready_ms"], args.max_ready_ms, ", OVER" if over else ""))
+    else:
+        parts.append("ready time after reset not checked, not a cold start (--reset)")
+    over = fields["code_ms"] > args.max_code_ms
+    ok = ok and not over
+    parts.append("{}ms in code.py (budget {}ms{})".format(
+        fields["code_ms"], args.max_code_ms, ", OVER" if over else ""))
+    under = fields["free"] < args.min_free
+    ok = ok and not under
+    parts.append("{} bytes free (budget {}{})".format(
+        fields["free"], args.min_free, ", UNDER" if under else ""))
+    for part in parts:
+        print(part)
+    print("ok" if ok else "over budget")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="*", help="console output with a binkbd_boot line")
+    parser.add_argument("--port", help="the receiver's serial console, e.g. /dev/ttyACM0")
+    parser.add_argument("--reset", action="store_true", help="--port: reset the board first")
+    parser.add_argument("--build", metavar="DIR", help="write the precompiled CIRCUITPY files to DIR")
+    parser.add_argument("--mpy-cross", default="mpy-cross", help="CircuitPython mpy-cross binary")
+    parser.add_argument("--max-ready-ms", type=int, default=READY_BUDGET_MS)
+    parser.add_argument("--max-code-ms", type=int, default=CODE_BUDGET_MS)
+    parser.add_argument("--min-free", type=int, default=FREE_BUDGET)
+    args = parser.parse_args(argv)
+
+    if args.build:
+        try:
+            print(check_mpy_cross(args.mpy_cross))
+            build(args.build, args.mpy_cross)
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            print("build failed: {}".format(e))
+            print("mpy-cross for CircuitPython {}.x: "
+                  "https://adafruit-circuit-python.s3.amazonaws.com/index.html?prefix=bin/mpy-cross/"
+                  .format(FIRMWARE_MAJOR))
+            return 1
+        return 0
+    if not args.port and not args.captures:
+        parser.error("give --port, console captures or --build")
+
+    status = 0
+    found = []
+    if args.port:
+        try:
+            if args.reset:
+                reset_board(args.port)
+            found.append((args.port, ask_port(args.port)))
+        except (OSError, FeedError) as e:
+            print("{}: {}".format(args.port, e))
+            return 1
+    for path in args.captures:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            found.append((path, f.read().splitlines()))
+    for name, lines in found:
+        fields = boot_fields(lines)
+        print("{}:".format(name))
+        if fields is None:
+            print("no binkbd_boot line")
+            status = 1
+        elif not check(fields, args):
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
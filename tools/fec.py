@@ -0,0 +1,82 @@
+"""
+Error-injection benchmark for the receiver's FEC framing.
+
+Sends the same text with plain 8-bit framing and with SECDED codewords
+(BinaryKeyboard/fec.py) while the presser model misfires: pulses that hit
+the other key (flip), spurious extra pulses (extra) and pulses that never
+close the switch (drop). For each case it reports how many wrong bytes
+still got typed, how many were lost, what FEC corrected or dropped, and
+the effective throughput in correctly typed characters per second. The
+receiver learns the bit period (code.py RESYNC), as the Teensy leaves its
+frame gap.
+
+    python -m tools.fec
+    python -m tools.fec --rates 0.001 0.01 --burst 1 --trials 10
+"""
+
+import argparse
+
+from . import sim
+
+ERRORS = ("flip", "extra", "drop")
+
+
+def run(data, kind, rate, fec, args):
+    """Totals over args.trials seeded runs of one case."""
+    totals = {"sent": 0, "correct": 0, "wrong": 0, "lost": 0, "fixed": 0, "dropped": 0, "us": 0}
+    pulse_us = int(args.period_us * sim.PULSE_US / (sim.PULSE_US + sim.GAP_US))
+    for trial in range(args.trials):
+        r = sim.simulate(
+            data, pulse_us=pulse_us, gap_us=args.period_us - pulse_us, burst=args.burst,
+            backend=args.backend, seed=args.seed + trial, fec=fec, resync=True,
+            flip_rate=rate if kind == "flip" else 0.0,
+            extra_rate=rate if kind == "extra" else 0.0,
+            drop_rate=rate if kind == "drop" else 0.0,
+        )
+        correct, wrong, lost = r.alignment()
+        totals["sent"] += len(r.sent)
+        totals["correct"] += correct
+        totals["wrong"] += wrong
+        totals["lost"] += lost
+        totals["fixed"] += r.fec_corrected
+        totals["dropped"] += r.fec_dropped
+        totals["us"] += r.elapsed_us
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rates", type=float, nargs="+", default=[0.001, 0.003, 0.01],
+                        help="per-pulse error probabilities to try")
+    parser.add_argument("--errors", nargs="+", choices=ERRORS, default=list(ERRORS))
+    parser.add_argument("--burst", type=int, default=sim.BURST_MAX, help="largest burst frame in bytes")
+    parser.add_argument("--period-us", type=int, default=sim.PULSE_US + sim.GAP_US, help="bit period")
+    parser.add_argument("--backend", choices=sim.BACKENDS, default="keypad")
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--text", help="file to send instead of the built-in sample")
+    args = parser.parse_args(argv)
+
+    if args.text:
+        with open(args.text) as f:
+            data = sim.text_to_bytes(f.read())
+    else:
+        data = sim.text_to_bytes(sim.SAMPLE_TEXT)
+
+    print("{} bytes x {} trials, burst {}, period {}us, backend {}".format(
+        len(data), args.trials, args.burst, args.period_us, args.backend))
+    print("{:<6} {:>6} {:<5} {:>8} {:>8} {:>6} {:>7} {:>7}".format(
+        "error", "rate", "frame", "wrong", "lost", "fixed", "dropped", "ok_cps"))
+    for kind in args.errors:
+        for rate in args.rates:
+            for fec in (False, True):
+                t = run(data, kind, rate, fec, args)
+                print("{:<6} {:>6.3f} {:<5} {:>8.2%} {:>8.2%} {:>6} {:>7} {:>7.2f}".format(
+                    kind, rate, "fec" if fec else "plain", t["wrong"] / t["sent"],
+                    t["lost"] / t["sent"], t["fixed"], t["dropped"],
+                    t["correct"] * 1e6 / t["us"] if t["us"] else 0.0))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,584 @@
+"""
+Stream a file to the presser over its USB serial port, flow-controlled.
+
+The presser (SERIAL_FEED in keyPresserTeensy4.ino) queues feed bytes in
+the same 256-byte queue as keystrokes and frames them as the solenoids
+free up. It reports how many feed bytes it has accepted and framed and
+how many more it has room for (credit); the feeder never sends past
+accepted + credit, so no byte or symbol is ever dropped and the queue
+never runs dry while the file lasts. Packets carry their offset and a
+CRC-16; the presser rejects a damaged or out-of-order packet with the
+offset it expects, and the feeder resends from there as soon as a status
+line shows the rejections of what was in flight are through, halving the
+packet size on each resend and doubling it back as packets get through.
+
+Text is sent as tools.plan's byte-mode protocol bytes (--keys for
+{Ctrl+c}-style names); --raw sends a file of protocol bytes as it is,
+e.g. one written by tools.plan --bytes. --resume FILE keeps the bytes
+typed so far in FILE and continues from there: from what the presser
+reports if it has not been reset since, otherwise from the last byte
+known typed. An emergency clear (3x ESC) on the presser stops the feed
+at the first byte of the frame it cut short.
+
+--stand-in runs the presser's side in this process on a pty (POSIX),
+with frames taking as long as tools.sim says divided by --speed, and
+checks that every byte was typed, in order, with the queue never empty
+while bytes were owed. --serve just runs the stand-in and prints its
+pty, to feed (and resume) with --port from another shell.
+
+    python -m tools.feed --port /dev/ttyACM0 paste.txt
+    python -m tools.feed --port /dev/ttyACM0 --raw --resume paste.state out.bin
+    python -m tools.feed --stand-in --speed 200 --corrupt-rate 0.01 paste.txt
+    python -m tools.feed --serve --speed 50
+"""
+
+import argparse
+import binascii
+import json
+import os
+import random
+import select
+import struct
+import sys
+import threading
+import time
+import tty
+from collections import deque
+
+from . import plan, sim
+from receiver import BURST_MAX
+
+PACKET_MAX = 64         # FEED_PACKET_MAX
+PACKET_MIN = 8          # packets shrink this far on a noisy line
+BYTE_BUF_SIZE = 256     # BYTE_BUF_SIZE; holds BYTE_BUF_SIZE - 1
+KEYBOARD_RESERVE = 32   # FEED_KEYBOARD_RESERVE
+PACKET_TIMEOUT_S = 0.1  # FEED_PACKET_TIMEOUT_MS
+
+STATUS_POLL_S = 1.0     # ask again after this long without a status line
+STALL_S = 1.0           # resend from accepted after this long with bytes owed and none taken
+# Both come down to this after a rejection: a damaged packet holds up the
+# presser's parser (swallowing what follows, '?' or a resend) no longer
+# than its packet timeout
+RETRY_S = 2 * PACKET_TIMEOUT_S
+CONNECT_TIMEOUT_S = 5.0
+PROGRESS_S = 0.5
+SAVE_S = 2.0
+
+
+class FeedError(Exception):
+    pass
+
+
+class FeedStopped(FeedError):
+    """The presser's emergency clear stopped the feed."""
+
+
+def crc16(data):
+    """CRC-16/CCITT-FALSE, as the presser's crc16Update()."""
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def data_packet(offset, chunk):
+    head = b"D" + struct.pack("<LB", offset, len(chunk)) + bytes(chunk)
+    return head + struct.pack("<H", crc16(head))
+
+
+def start_packet(offset):
+    head = b"S" + struct.pack("<L", offset)
+    return head + struct.pack("<H", crc16(head))
+
+
+def open_port(path):
+    """A raw file descriptor for a serial device or pty."""
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+    tty.setraw(fd)
+    return fd
+
+
+class Link:
+    """Packets out, lines in, over a file descriptor."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.pending = b""
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            select.select([], [self.fd], [])
+            n = os.write(self.fd, view)
+            view = view[n:]
+
+    def lines(self, timeout):
+        """Complete lines received within timeout seconds (maybe none)."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            chunk = os.read(self.fd, 4096)
+            if not chunk:
+                raise FeedError("serial port closed")
+            self.pending += chunk
+        *done, self.pending = self.pending.split(b"\n")
+        return [line.strip(b"\r").decode("ascii", "replace") for line in done]
+
+
+class Status:
+    """The last @F line: accepted, credit, framed, boot."""
+
+    def __init__(self, fields):
+        self.accepted, self.credit, self.framed, self.boot = (int(f) for f in fields)
+
+
+# -------------------------
+# Feeder
+# -------------------------
+class Feeder:
+    """Sends data over link with the presser's credits.
+
+    progress(feeder) is called every PROGRESS_S; save(typed, boot) whenever
+    more bytes have been typed, at most every SAVE_S and once at the end.
+    """
+
+    def __init__(self, link, data, progress=None, save=None, log=None):
+        self.link = link
+        self.data = data
+        self.progress = progress
+        self.save = save
+        self.log = log
+        self.status = None
+        self.next = 0         # next offset to send
+        self.limit = 0        # accepted + credit from the last status
+        self.rewound = -1     # offset of the last resend, until progress passes it
+        self.confirmed = True  # a status has come since that resend was asked for
+        self.packet_size = PACKET_MAX  # halved on each resend, doubled as packets get through
+        self.rejected = False  # a rejection since accepted last grew
+        self.resent = 0       # resends from the presser's offset
+        self.moved = time.monotonic()  # when accepted last grew
+        self.started = time.monotonic()
+        self.start_offset = 0
+
+    def poll(self, timeout):
+        """Read status lines; returns True if one arrived."""
+        got = False
+        for line in self.link.lines(timeout):
+            fields = line.split()
+            if not fields or not fields[0].startswith("@"):
+                if self.log is not None and line:
+                    self.log(line)
+                continue
+            kind = fields[0]
+            if kind == "@F" and len(fields) == 5:
+                if self.status is None or int(fields[1]) != self.status.accepted:
+                    self.moved = time.monotonic()
+                    if self.status is not None and int(fields[1]) > self.status.accepted:
+                        self.packet_size = min(PACKET_MAX, 2 * self.packet_size)
+                        self.rejected = False
+                self.status = Status(fields[1:])
+                self.limit = self.status.accepted + self.status.credit
+                if self.status.accepted > self.rewound:
+                    self.rewound = -1
+                self.confirmed = True
+                got = True
+            elif kind == "@N" and len(fields) == 2:
+                # Every packet after a rejected one is rejected with the same
+                # offset. A resend waits for the answer to a '?', which the
+                # presser sends after those, so the same offset once that
+                # has come means the resend was damaged too.
+                offset = int(fields[1])
+                self.rejected = True
+                if offset < self.next and (offset != self.rewound or self.confirmed):
+                    self.next = offset
+                    self.limit = offset  # credit may have shrunk as well
+                    self.rewound = offset
+                    self.confirmed = False
+                    self.resent += 1
+                    self.packet_size = max(PACKET_MIN, self.packet_size // 2)
+                    self.link.write(b"?")
+            elif kind == "@X" and len(fields) == 2:
+                if self.status is not None:
+                    self.status.framed = int(fields[1])
+                raise FeedStopped("emergency clear on the presser after {} bytes".format(fields[1]))
+        return got
+
+    def ask(self):
+        """Poll for a status line, asking until one comes."""
+        deadline = time.monotonic() + CONNECT_TIMEOUT_S
+        while True:
+            self.link.write(b"?")
+            if self.poll(STATUS_POLL_S / 2):
+                return self.status
+            if time.monotonic() > deadline:
+                raise FeedError("no status from the presser; is SERIAL_FEED on?")
+
+    def connect(self, resume=None):
+        """Start counting at offset 0, or where resume ({"typed", "boot"})
+        left off. Returns the offset feeding starts at."""
+        status = self.ask()
+        # Queued feed bytes of an earlier run go out first
+        while status.accepted != status.framed:
+            self.poll(STATUS_POLL_S)
+            status = self.status
+        offset = 0
+        if resume is not None:
+            offset = resume["typed"]
+            if resume.get("boot") == status.boot and status.framed >= offset:
+                # Same power-up: the presser knows better what it took
+                offset = status.framed
+        self.link.write(start_packet(offset))
+        while not self.poll(STATUS_POLL_S) or self.status.accepted != offset:
+            self.link.write(b"?")
+        self.next = offset
+        self.start_offset = offset
+        self.started = time.monotonic()
+        return offset
+
+    def typed(self):
+        return self.status.framed if self.status else self.start_offset
+
+    def rate(self):
+        """Bytes per second typed in this run, or 0 before the first frame."""
+        done = self.typed() - self.start_offset
+        elapsed = time.monotonic() - self.started
+        return done / elapsed if done > 0 and elapsed > 0 else 0.0
+
+    def run(self):
+        data = self.data
+        last_status = last_progress = last_save = time.monotonic()
+        saved = self.typed()
+        try:
+            while self.typed() < len(data):
+                while self.next < min(self.limit, len(data)):
+                    n = min(self.packet_size, self.limit - self.next, len(data) - self.next)
+                    self.link.write(data_packet(self.next, data[self.next:self.next + n]))
+                    self.next += n
+                now = time.monotonic()
+                if self.poll(0.05):
+                    last_status = now
+                elif now - last_status > (RETRY_S if self.rejected else STATUS_POLL_S):
+                    # A lost status line would otherwise stall the feed
+                    self.link.write(b"?")
+                    last_status = now
+                accepted = self.status.accepted
+                if accepted < self.next and now - self.moved > (RETRY_S if self.rejected else STALL_S):
+                    # Packets lost, or a rejection missed: go back
+                    self.next = accepted
+                    self.rewound = accepted
+                    self.resent += 1
+                    self.moved = now
+                if self.progress is not None and now - last_progress >= PROGRESS_S:
+                    self.progress(self)
+                    last_progress = now
+                if self.save is not None and self.typed() > saved and now - last_save >= SAVE_S:
+                    saved = self.typed()
+                    self.save(saved, self.status.boot)
+                    last_save = now
+        finally:
+            if self.save is not None and self.status is not None:
+                self.save(self.typed(), self.status.boot)
+        if self.progress is not None:
+            self.progress(self)
+
+
+# -------------------------
+# Stand-in presser
+# -------------------------
+class StandIn:
+    """The presser's serial feed on a pty.
+
+    A thread plays SERIAL_FEED: packets are parsed and answered as the
+    firmware does, bytes wait in a BYTE_BUF_SIZE queue, and up to
+    BURST_MAX of them are framed whenever the last frame has gone out,
+    each frame taking as long as sim.schedule() says, divided by speed.
+    corrupt_rate flips a bit in that share of incoming bytes; clear_at
+    does an emergency clear once that many bytes have been framed.
+    """
+
+    def __init__(self, speed=1.0, corrupt_rate=0.0, seed=0, boot=1, clear_at=-1):
+        self.speed = speed
+        self.clear_at = clear_at
+        self.corrupt_rate = corrupt_rate
+        self.rng = random.Random(seed)
+        self.boot = boot
+        self.fd, slave = os.openpty()
+        tty.setraw(slave)
+        self.path = os.ttyname(slave)
+        self.slave = slave  # kept open so the pty survives feeders closing it
+        self.queue = deque()  # (byte, from feed)
+        self.accepted = self.framed = self.frame_first = 0
+        self.halted = False
+        self.packet = bytearray()
+        self.last_byte = 0.0
+        self.frame_end = None  # when the frame in flight has gone out
+        self.queued_at = 0.0   # when the queue last went from empty to not
+        self.typed = bytearray()
+        self.dropped = 0
+        self.rejected = 0
+        self.starved_us = 0.0  # solenoid time idle while feed bytes were owed
+        self.busy_us = 0.0     # solenoid time spent on frames
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+        os.close(self.fd)
+        os.close(self.slave)
+
+    def say(self, line):
+        os.write(self.fd, (line + "\r\n").encode("ascii"))
+
+    def credit(self):
+        return max(0, BYTE_BUF_SIZE - 1 - len(self.queue) - KEYBOARD_RESERVE)
+
+    def status(self):
+        self.say("@F {} {} {} {}".format(self.accepted, self.credit(), self.framed, self.boot))
+
+    def reject(self):
+        self.rejected += 1
+        self.say("@N {}".format(self.accepted))
+
+    def clear(self):
+        """bufClear(): the emergency clear."""
+        if self.frame_end is not None and self.frame_end > time.monotonic():
+            self.framed = self.frame_first
+            del self.typed[self.framed - len(self.typed):]
+        self.queue.clear()
+        self.accepted = self.framed
+        self.halted = True
+        self.frame_end = None
+        self.say("@X {}".format(self.framed))
+
+    def packet_done(self):
+        packet = self.packet
+        if crc16(packet[:-2]) != struct.unpack_from("<H", packet, len(packet) - 2)[0]:
+            if not self.halted:
+                self.reject()
+            return
+        offset = struct.unpack_from("<L", packet, 1)[0]
+        if packet[0] == ord("S"):
+            self.accepted = self.framed = self.frame_first = offset
+            self.halted = False
+            self.status()
+            return
+        if self.halted:
+            return
+        n = packet[5]
+        if offset != self.accepted or n > self.credit():
+            self.reject()
+            return
+        if not self.queue:
+            self.queued_at = time.monotonic()
+        for value in packet[6:6 + n]:
+            if len(self.queue) == BYTE_BUF_SIZE - 1:
+                self.queue.popleft()
+                self.dropped += 1
+            self.queue.append(value)
+        self.accepted += n
+        self.status()
+
+    def receive(self, chunk):
+        now = time.monotonic()
+        if self.packet and now - self.last_byte > PACKET_TIMEOUT_S:
+            self.packet.clear()
+        self.last_byte = now
+        for c in chunk:
+            if self.corrupt_rate and self.rng.random() < self.corrupt_rate:
+                c ^= 1 << self.rng.randrange(8)
+            packet = self.packet
+            if not packet:
+                if c == ord("?"):
+                    self.status()
+                elif c in b"DS":
+                    packet.append(c)
+                continue
+            packet.append(c)
+            if packet[0] == ord("D") and len(packet) == 6 and not 0 < c <= PACKET_MAX:
+                packet.clear()
+                if not self.halted:
+                    self.reject()
+                continue
+            if packet[0] == ord("S"):
+                size = 7
+            else:
+                size = 6 if len(packet) < 6 else 8 + packet[5]
+            if len(packet) == size:
+                self.packet_done()
+                packet.clear()
+
+    def frame(self, now):
+        """framePending(), once the last frame has gone out."""
+        if not self.queue or (self.frame_end is not None and now < self.frame_end):
+            return
+        # Start when the solenoids came free or the bytes came, whichever
+        # was later, not when this thread got round to it
+        start = self.queued_at
+        if self.frame_end is not None:
+            if self.frame_end > start:
+                start = self.frame_end
+            else:
+                self.starved_us += (start - self.frame_end) * 1e6 * self.speed
+        group = [self.queue.popleft() for _ in range(min(len(self.queue), BURST_MAX))]
+        pulses = sim.schedule(group, burst=len(group))[0]
+        frame_us = pulses[-1][2] + sim.GAP_US
+        self.busy_us += frame_us
+        self.frame_first = self.framed
+        self.framed += len(group)
+        self.typed.extend(group)
+        self.frame_end = start + frame_us / 1e6 / self.speed
+        if self.queue:
+            self.queued_at = self.frame_end
+        self.status()
+        if 0 <= self.clear_at <= self.framed:
+            self.clear_at = -1
+            self.clear()
+
+    def serve(self):
+        self.say("USB host ready - 3x ESC for emergency clear")
+        while not self.stop.is_set():
+            now = time.monotonic()
+            wait = 0.05
+            if self.queue and self.frame_end is not None:
+                wait = min(wait, max(0.0, self.frame_end - now))
+            ready, _, _ = select.select([self.fd], [], [], wait)
+            if ready:
+                try:
+                    chunk = os.read(self.fd, 4096)
+                except OSError:
+                    chunk = b""
+                self.receive(chunk)
+            self.frame(time.monotonic())
+
+
+# -------------------------
+# Command line
+# -------------------------
+def load(path, raw, keys):
+    if raw:
+        with open(path, "rb") as f:
+            return f.read()
+    return bytes(plan.optimized(plan.chars(path), keys, plan.byte_bits, caps=False))
+
+
+def resume_state(path, data):
+    """The saved state for data, or None if there is none for it."""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    if state.get("size") != len(data) or state.get("crc32") != binascii.crc32(data):
+        raise FeedError("{} is for a different file".format(path))
+    return state
+
+
+def saver(path, data):
+    def save(typed, boot):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"size": len(data), "crc32": binascii.crc32(data), "typed": typed, "boot": boot}, f)
+        os.replace(tmp, path)
+    return save
+
+
+def show_progress(feeder):
+    typed = feeder.typed()
+    total = len(feeder.data)
+    rate = feeder.rate()
+    eta = plan.fmt_time((total - typed) / rate * 1e6) if rate else "-"
+    sys.stderr.write("\r{:>9}/{} bytes typed ({:3.0f}%)  {:6.2f} B/s  ETA {:<10} resent {}".format(
+        typed, total, 100.0 * typed / total if total else 100, rate, eta, feeder.resent))
+    sys.stderr.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", nargs="?", help="text (or with --raw protocol bytes) to type")
+    parser.add_argument("--port", help="the presser's serial device, e.g. /dev/ttyACM0")
+    parser.add_argument("--raw", action="store_true", help="file holds protocol bytes")
+    parser.add_argument("--keys", action="store_true", help="read {Ctrl+c}-style key names")
+    parser.add_argument("--resume", metavar="STATE", help="keep progress here and continue from it")
+    parser.add_argument("--stand-in", action="store_true", help="feed a stand-in presser on a pty")
+    parser.add_argument("--serve", action="store_true", help="only run the stand-in, until Ctrl-C")
+    parser.add_argument("--speed", type=float, default=100.0, help="stand-in time speed-up")
+    parser.add_argument("--corrupt-rate", type=float, default=0.0,
+                        help="stand-in: share of received bytes with a bit flipped")
+    parser.add_argument("--clear-at", type=int, default=-1,
+                        help="stand-in: emergency clear once this many bytes are framed")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="echo the presser's debug output")
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        stand_in = StandIn(args.speed, args.corrupt_rate, args.seed, int(time.time()), args.clear_at).start()
+        print("stand-in presser on {} ({}x speed); Ctrl-C to stop".format(stand_in.path, args.speed))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        stand_in.close()
+        print("typed {} bytes, {} dropped, {} packets rejected".format(
+            len(stand_in.typed), stand_in.dropped, stand_in.rejected))
+        return 0
+    if not args.file or bool(args.port) == args.stand_in:
+        parser.error("give a file and one of --port or --stand-in")
+
+    data = load(args.file, args.raw, args.keys)
+    try:
+        state = resume_state(args.resume, data)
+    except FeedError as e:
+        parser.error(str(e))
+    stand_in = None
+    if args.stand_in:
+        stand_in = StandIn(args.speed, args.corrupt_rate, args.seed, clear_at=args.clear_at).start()
+        port = stand_in.path
+    else:
+        port = args.port
+    link = Link(open_port(port))
+    log = (lambda line: sys.stderr.write("\n  presser: " + line + "\n")) if args.verbose else None
+    feeder = Feeder(link, data, show_progress,
+                    saver(args.resume, data) if args.resume else None, log)
+    status = 0
+    offset = 0
+    try:
+        offset = feeder.connect(state)
+        print("{} bytes to {}, from byte {}".format(len(data), port, offset))
+        feeder.run()
+        sys.stderr.write("\n")
+        print("done in {}, {} packets resent".format(
+            plan.fmt_time((time.monotonic() - feeder.started) * 1e6), feeder.resent))
+    except FeedStopped as e:
+        sys.stderr.write("\n")
+        print("stopped: {}; run again with --resume to continue".format(e))
+        status = 1
+    except FeedError as e:
+        sys.stderr.write("\n")
+        print(e)
+        status = 1
+    except KeyboardInterrupt:
+        sys.stderr.write("\n")
+        print("interrupted at byte {}".format(feeder.typed()))
+        status = 1
+    finally:
+        os.close(link.fd)
+
+    if stand_in is not None:
+        stand_in.close()
+        # The stand-in's whole solenoid time against sim.schedule() for the
+        # same bytes in full-size bursts: equal when the queue never ran dry
+        full = sim.schedule(list(data[offset:]), burst=BURST_MAX)[0]
+        full_us = full[-1][2] + sim.GAP_US if full else 0
+        ok = bytes(stand_in.typed) == data[offset:]
+        print("stand-in: typed {} ({} bytes), {} dropped, {} packets rejected".format(
+            "ok" if ok else "WRONG", len(stand_in.typed), stand_in.dropped, stand_in.rejected))
+        print("  solenoid time {} busy + {} starved, full rate {}".format(
+            plan.fmt_time(stand_in.busy_us), plan.fmt_time(stand_in.starved_us), plan.fmt_time(full_us)))
+        if not ok or stand_in.dropped:
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
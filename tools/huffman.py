@@ -0,0 +1,173 @@
+"""
+Build the receiver's Huffman code table from a sample corpus.
+
+Counts protocol bytes in the corpus files (text is mapped the same way the
+simulator maps it), builds a canonical Huffman code over them plus the
+SYM_END and SYM_RAW control symbols, and writes BinaryKeyboard/huffman_table.py
+for the receiver to load at boot.
+
+    python -m tools.huffman README.md PROTOCOL_DESIGN.md BinaryKeyboard/*.py tools/*.py
+    python -m tools.huffman --check notes.txt   # bits/char of the current table
+"""
+
+import argparse
+import heapq
+import os
+from collections import Counter
+
+from . import RECEIVER_DIR
+from .sim import text_to_bytes
+from huffman import SYM_END, SYM_RAW, PrefixDecoder, build_tree
+from receiver import PROTO_HUFFMAN_MODE
+
+TABLE_PATH = os.path.join(RECEIVER_DIR, "huffman_table.py")
+
+
+def code_lengths(freqs):
+    """Huffman code length for every symbol in freqs ({symbol: count})."""
+    if len(freqs) == 1:
+        return {sym: 1 for sym in freqs}
+    heap = [(count, sym, [sym]) for sym, count in freqs.items()]
+    heapq.heapify(heap)
+    lengths = dict.fromkeys(freqs, 0)
+    while len(heap) > 1:
+        c1, k1, s1 = heapq.heappop(heap)
+        c2, k2, s2 = heapq.heappop(heap)
+        for sym in s1 + s2:
+            lengths[sym] += 1
+        # Smallest symbol as tie-break keeps the output deterministic
+        heapq.heappush(heap, (c1 + c2, min(k1, k2), s1 + s2))
+    return lengths
+
+
+class Codebook:
+    """A canonical code: the device table plus host-side encoding."""
+
+    def __init__(self, length_counts, symbols):
+        self.length_counts = tuple(length_counts)
+        self.symbols = tuple(symbols)
+        self.tree = build_tree(self.length_counts, self.symbols)
+        self.codes = {}
+        code = 0
+        k = 0
+        for length in range(1, len(self.length_counts)):
+            for _ in range(self.length_counts[length]):
+                self.codes[self.symbols[k]] = (code, length)
+                k += 1
+                code += 1
+            code <<= 1
+
+    @classmethod
+    def from_counts(cls, counts):
+        """Codebook for a Counter of protocol bytes."""
+        freqs = dict(counts)
+        freqs[SYM_END] = 1
+        # Escape for anything the corpus never used
+        freqs[SYM_RAW] = max(1, sum(counts.values()) // 1000)
+        lengths = code_lengths(freqs)
+        order = sorted(lengths, key=lambda sym: (lengths[sym], sym))
+        length_counts = [0] * (max(lengths.values()) + 1)
+        for sym in order:
+            length_counts[lengths[sym]] += 1
+        return cls(length_counts, order)
+
+    @classmethod
+    def load(cls):
+        """Codebook for the table in BinaryKeyboard/huffman_table.py."""
+        import huffman_table
+        return cls(huffman_table.LENGTH_COUNTS, huffman_table.SYMBOLS)
+
+    def receiver_options(self):
+        """Receiver keyword arguments that enable this mode."""
+        return {"prefix": PrefixDecoder(self.tree)}
+
+    def symbol_bits(self, value):
+        if value in self.codes:
+            return self.codes[value][1]
+        return self.codes[SYM_RAW][1] + 8
+
+    def encode(self, data):
+        """Wire bytes for data in prefix-code mode.
+
+        Returns (wire, end_bits): the mode switch byte followed by the
+        packed codes, SYM_END and zero padding, and for every decoded byte
+        (the switch byte first) the index of the wire bit that completes it.
+        """
+        bits = []
+        end_bits = [7]
+
+        def put(code, length):
+            for i in range(length - 1, -1, -1):
+                bits.append((code >> i) & 1)
+
+        for value in data:
+            if value in self.codes:
+                put(*self.codes[value])
+            else:
+                put(*self.codes[SYM_RAW])
+                put(value, 8)
+            end_bits.append(8 + len(bits) - 1)
+        put(*self.codes[SYM_END])
+        bits.extend([0] * (-len(bits) % 8))
+
+        wire = [PROTO_HUFFMAN_MODE]
+        for pos in range(0, len(bits), 8):
+            value = 0
+            for b in bits[pos:pos + 8]:
+                value = (value << 1) | b
+            wire.append(value)
+        return wire, end_bits
+
+
+def write_table(book, path, sources, bits_per_char):
+    with open(path, "w") as f:
+        f.write('"""\n')
+        f.write("Canonical Huffman code for the receiver's prefix-code mode.\n\n")
+        f.write("Generated by `python -m tools.huffman` from:\n")
+        for name in sources:
+            f.write("    {}\n".format(name))
+        f.write("{:.2f} bits per character on that corpus. Do not edit by hand.\n".format(bits_per_char))
+        f.write('"""\n\n')
+        f.write("# Number of codes of each length, index = length in bits\n")
+        f.write("LENGTH_COUNTS = {}\n\n".format(book.length_counts))
+        f.write("# Symbols in canonical order (256 = end of mode, 257 = raw byte)\n")
+        f.write("SYMBOLS = (\n")
+        for pos in range(0, len(book.symbols), 12):
+            f.write("    {},\n".format(", ".join(str(s) for s in book.symbols[pos:pos + 12])))
+        f.write(")\n")
+
+
+def corpus_bytes(paths):
+    data = []
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            data.extend(text_to_bytes(f.read()))
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", nargs="+", help="text files to count")
+    parser.add_argument("--out", default=TABLE_PATH, help="table module to write")
+    parser.add_argument("--check", action="store_true",
+                        help="report bits/char of the current table instead of writing one")
+    args = parser.parse_args(argv)
+
+    data = corpus_bytes(args.corpus)
+    if not data:
+        parser.error("corpus is empty")
+    book = Codebook.load() if args.check else Codebook.from_counts(Counter(data))
+    wire, _ = book.encode(data)
+    bits_per_char = sum(book.symbol_bits(v) for v in data) / len(data)
+    print("{} chars, {} symbols, longest code {} bits".format(
+        len(data), len(book.symbols), len(book.length_counts) - 1))
+    print("{:.2f} bits/char ({} wire bytes vs {} in byte mode)".format(
+        bits_per_char, len(wire), len(data)))
+    if not args.check:
+        write_table(book, args.out, args.corpus, bits_per_char)
+        print("wrote {}".format(args.out))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,139 @@
+"""
+Host-side back-reference encoder for the receiver's PROTO_COPY and
+PROTO_REPEAT opcodes.
+
+Keeps the same typed history the receiver keeps (every key, modifier and
+function key byte, emptied on PROTO_CLEAR_BUFFER) and greedily replaces
+repeated text with PROTO_COPY frames and runs of one key with PROTO_REPEAT,
+but only where the frame costs fewer pulses than typing the bytes.
+Running it on text files reports the compression ratio and checks that
+the receiver types exactly the same keys either way.
+
+    python -m tools.lz session.txt shell_history.txt
+    python -m tools.lz --burst 1 notes.txt
+"""
+
+import argparse
+
+from . import RECEIVER_DIR  # noqa: F401  (puts BinaryKeyboard/ on sys.path)
+from . import huffman, sim
+from receiver import (ACTION, ACT_FUNC, ACT_KEY, COPY_MIN, HISTORY_SIZE, MODE_PAD,
+                      PROTO_CLEAR_BUFFER, PROTO_COPY, PROTO_REPEAT, Receiver, ReportHID)
+
+COPY_MAX = COPY_MIN + 255
+REPEAT_MAX = 256
+
+
+def typed(value):
+    """True if the receiver records value in its history."""
+    return ACT_KEY <= ACTION[value] <= ACT_FUNC
+
+
+def frame_pulses(count, burst):
+    """Pulses for count consecutive bytes sent with the given burst size."""
+    return len(sim.schedule([0] * count, burst=burst)[0])
+
+
+def longest_match(history, data, pos):
+    """(distance, length) of the longest usable match for data[pos:]."""
+    best = (0, 0)
+    limit = min(COPY_MAX, len(data) - pos)
+    for distance in range(1, min(HISTORY_SIZE, len(history)) + 1):
+        start = len(history) - distance
+        length = 0
+        while length < limit and typed(data[pos + length]):
+            # Past the end of history the copy reads what it just wrote
+            k = start + length
+            src = history[k] if k < len(history) else data[pos + k - len(history)]
+            if src != data[pos + length]:
+                break
+            length += 1
+        if length > best[1]:
+            best = (distance, length)
+    return best
+
+
+def encode(data, burst=sim.BURST_MAX):
+    """Wire bytes for data with greedy back-references and repeats."""
+    wire = []
+    history = []
+    copy_cost = frame_pulses(3, burst)
+    repeat_cost = frame_pulses(2, burst)
+    pos = 0
+    while pos < len(data):
+        distance, length = longest_match(history, data, pos)
+        run = 0
+        if history:
+            while (run < REPEAT_MAX and pos + run < len(data)
+                   and data[pos + run] == history[-1]):
+                run += 1
+        # Whichever frame saves the most pulses, if any does
+        copy_gain = frame_pulses(length, burst) - copy_cost if length >= COPY_MIN else 0
+        repeat_gain = frame_pulses(run, burst) - repeat_cost if run else 0
+        if repeat_gain > 0 and repeat_gain >= copy_gain:
+            wire.extend((PROTO_REPEAT, run - 1))
+            history.extend(data[pos:pos + run])
+            pos += run
+            continue
+        if copy_gain > 0:
+            wire.extend((PROTO_COPY, distance - 1, length - COPY_MIN))
+            history.extend(data[pos:pos + length])
+            pos += length
+            continue
+        value = data[pos]
+        wire.append(value)
+        if value == PROTO_CLEAR_BUFFER:
+            history = []
+        elif typed(value):
+            history.append(value)
+        pos += 1
+    return wire
+
+
+def keystrokes(data):
+    """HID reports the receiver sends for a byte stream, fed directly.
+
+    Bytes received in a bit-level mode (hex) go through mode_bit() the way
+    the framing code feeds them.
+    """
+    keyboard = sim.SimKeyboard()
+    reports = []
+    keyboard.send_report = lambda report: reports.append(bytes(report))
+    rx = Receiver(lambda: 0, None, ReportHID(keyboard, device=keyboard))
+    for value in data:
+        k = 7
+        while k >= 0 and rx.mode > MODE_PAD:
+            rx.mode_bit((value >> k) & 1)
+            k -= 1
+        rx.deliver(value)
+    rx.finish_repeat()
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="sessions to compress")
+    parser.add_argument("--burst", type=int, default=sim.BURST_MAX, help="largest burst frame in bytes")
+    args = parser.parse_args(argv)
+
+    print("burst {}".format(args.burst))
+    print("{:<32} {:>7} {:>7} {:>9} {:>9} {:>6} {:>6}".format(
+        "file", "chars", "wire", "pulses", "lz_pulses", "ratio", "typed"))
+    status = 0
+    for path in args.files:
+        data = huffman.corpus_bytes([path])
+        if not data:
+            continue
+        wire = encode(data, args.burst)
+        plain = len(sim.schedule(data, burst=args.burst)[0])
+        packed = len(sim.schedule(wire, burst=args.burst)[0])
+        same = keystrokes(wire) == keystrokes(data)
+        if not same:
+            status = 1
+        print("{:<32} {:>7} {:>7} {:>9} {:>9} {:>5.2f}x {:>6}".format(
+            path[-32:], len(data), len(wire), plain, packed, plain / packed, "ok" if same else "DIFF"))
+    return status
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,50 @@
+"""
+Check a macro dictionary file and show what each macro saves.
+
+Parses the file with the same loader the receiver runs at boot, so a file
+that passes here will load on the device. For every macro it prints the
+expansion size and the solenoid pulses it costs sent as one opcode
+versus typed out byte by byte.
+
+    python -m tools.macros                 # BinaryKeyboard/macros.txt
+    python -m tools.macros my_macros.txt --burst 32
+"""
+
+import argparse
+import os
+
+from . import RECEIVER_DIR
+from . import sim
+from macros import load_macros
+from receiver import MACRO_FIRST, MACRO_LAST
+
+MACRO_PATH = os.path.join(RECEIVER_DIR, "macros.txt")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default=MACRO_PATH, help="dictionary file")
+    parser.add_argument("--burst", type=int, default=1, help="largest burst frame when typed out")
+    args = parser.parse_args(argv)
+
+    try:
+        macros = load_macros(args.path)
+    except ValueError as e:
+        print("error: {}".format(e))
+        return 1
+
+    print("{} bytes in the blob, {} offsets".format(len(macros.blob), len(macros.offsets)))
+    print("{:>6} {:>6} {:>7} {:>7} {:>7}".format("opcode", "bytes", "typed", "macro", "gain"))
+    macro_pulses = len(sim.schedule([MACRO_FIRST])[0])
+    for value in range(MACRO_FIRST, MACRO_LAST + 1):
+        body = macros.expansion(value)
+        if not body:
+            continue
+        typed = len(sim.schedule(list(body), burst=args.burst)[0])
+        print("  0x{:02X} {:>6} {:>7} {:>7} {:>6.1f}x".format(
+            value, len(body), typed, macro_pulses, typed / macro_pulses))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
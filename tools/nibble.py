@@ -0,0 +1,121 @@
+"""
+Host-side encoder for the receiver's hex mode (PROTO_HEX_MODE).
+
+Finds runs of hex digits in the text (all lowercase, or all uppercase,
+plus decimal digits) and sends every run long enough to pay for its two
+header bytes as 4-bit digits instead of 8-bit bytes. Running it on text
+files reports the saving and checks that the receiver types exactly the
+same keys either way.
+
+    python -m tools.nibble keys.txt build.log
+    python -m tools.nibble --burst 1 hashes.txt
+"""
+
+import argparse
+
+from . import RECEIVER_DIR  # noqa: F401  (puts BinaryKeyboard/ on sys.path)
+from . import huffman, lz, sim
+from receiver import HEX_DIGITS, HEX_DIGITS_UPPER, PROTO_HEX_MODE, PROTO_HEX_UPPER_MODE
+
+# Shortest run worth it: 2 header bytes + ceil(n / 2) must beat n bytes
+HEX_MIN_RUN = 6
+HEX_MAX_RUN = 256
+
+
+def run_length(data, pos, digits):
+    n = 0
+    while pos + n < len(data) and n < HEX_MAX_RUN and data[pos + n] in digits:
+        n += 1
+    return n
+
+
+def pack(data):
+    """(wire, end_bits, decoded) for data with hex runs packed.
+
+    decoded lists the bytes process_byte() sees (opcodes, counts and the
+    digits themselves) and end_bits the wire bit completing each of them.
+    """
+    wire = []
+    end_bits = []
+    decoded = []
+
+    def put(value):
+        wire.append(value)
+        end_bits.append(8 * len(wire) - 1)
+        decoded.append(value)
+
+    pos = 0
+    while pos < len(data):
+        lower = run_length(data, pos, HEX_DIGITS)
+        upper = run_length(data, pos, HEX_DIGITS_UPPER)
+        if max(lower, upper) < HEX_MIN_RUN:
+            put(data[pos])
+            pos += 1
+            continue
+        if lower >= upper:
+            opcode, digits, n = PROTO_HEX_MODE, HEX_DIGITS, lower
+        else:
+            opcode, digits, n = PROTO_HEX_UPPER_MODE, HEX_DIGITS_UPPER, upper
+        put(opcode)
+        put(n - 1)
+        run = data[pos:pos + n]
+        base = 8 * len(wire)
+        end_bits.extend(base + 4 * i + 3 for i in range(n))
+        decoded.extend(run)
+        nibbles = [digits.index(v) for v in run]
+        if n & 1:
+            nibbles.append(0)
+        for i in range(0, len(nibbles), 2):
+            wire.append(nibbles[i] << 4 | nibbles[i + 1])
+        pos += n
+    return wire, end_bits, decoded
+
+
+def encode(data):
+    """Wire bytes for data with hex runs packed two digits per byte."""
+    return pack(data)[0]
+
+
+class HexCoder:
+    """pack() behind the coder interface tools.sim.simulate() takes."""
+
+    def receiver_options(self):
+        return {}
+
+    def encode(self, data):
+        """(wire, end_bits) as huffman.Codebook.encode()."""
+        wire, end_bits, _ = pack(data)
+        return wire, end_bits
+
+    def expected(self, data):
+        """Bytes the receiver passes to process_byte() for data."""
+        return pack(data)[2]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="text to encode")
+    parser.add_argument("--burst", type=int, default=sim.BURST_MAX, help="largest burst frame in bytes")
+    args = parser.parse_args(argv)
+
+    print("burst {}".format(args.burst))
+    print("{:<32} {:>7} {:>7} {:>9} {:>9} {:>6} {:>6}".format(
+        "file", "chars", "wire", "pulses", "packed", "ratio", "typed"))
+    status = 0
+    for path in args.files:
+        data = huffman.corpus_bytes([path])
+        if not data:
+            continue
+        wire = encode(data)
+        plain = len(sim.schedule(data, burst=args.burst)[0])
+        packed = len(sim.schedule(wire, burst=args.burst)[0])
+        same = lz.keystrokes(wire) == lz.keystrokes(data)
+        if not same:
+            status = 1
+        print("{:<32} {:>7} {:>7} {:>9} {:>9} {:>5.2f}x {:>6}".format(
+            path[-32:], len(data), len(wire), plain, packed, plain / packed, "ok" if same else "DIFF"))
+    return status
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
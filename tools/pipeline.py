@@ -0,0 +1,74 @@
+"""
+Scan latency with long outputs: inline HID writes vs the asyncio pipeline.
+
+Sends the text and a case-swapped copy of it, alternately, compressed by
+tools.lz, so every repeat of the text is one PROTO_COPY frame typing it
+all while the frames after it are arriving. Every HID report takes
+--report-us of main loop time. Receiver.poll() types a whole copy before
+scanning the keys again; pipeline.Pipeline sends one HID report between
+scans. For each it reports the gap between pin scans (mean and
+max), whether the text still decoded, the HID reports sent, and the
+pipeline's queue counters: presses lost, HID queue high water, decode
+steps deferred for HID room, operations written inline.
+
+    python -m tools.pipeline
+    python -m tools.pipeline --report-us 1000 8000 --backend keypad
+"""
+
+import argparse
+
+from . import lz, sim
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--report-us", type=int, nargs="+", default=[1000, 4000],
+                        help="main loop time per HID report")
+    parser.add_argument("--backend", nargs="+", choices=sim.BACKENDS, default=list(sim.BACKENDS))
+    parser.add_argument("--copies", type=int, default=3, help="times the text is sent, each way")
+    parser.add_argument("--burst", type=int, default=sim.BURST_MAX, help="largest burst frame in bytes")
+    parser.add_argument("--trials", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--text", help="file to send instead of the built-in sample")
+    args = parser.parse_args(argv)
+
+    if args.text:
+        with open(args.text) as f:
+            text = f.read()
+    else:
+        text = sim.SAMPLE_TEXT
+    data = (sim.text_to_bytes(text) + sim.text_to_bytes(text.swapcase())) * args.copies
+    wire = lz.encode(data, args.burst)
+
+    print("{} chars as {} wire bytes, burst {}, {} trials".format(
+        len(data), len(wire), args.burst, args.trials))
+    print("{:<9} {:>6} {:<8} {:>8} {:>8} {:>4} {:>7} {:>5} {:>5} {:>8} {:>7}".format(
+        "backend", "rpt_us", "output", "scan_ms", "max_ms", "ok", "reports",
+        "lost", "hid_hw", "deferred", "inline"))
+    for backend in args.backend:
+        for report_us in args.report_us:
+            for pipeline in (False, True):
+                gaps = []
+                ok = reports = lost = high = deferred = inline = 0
+                for trial in range(args.trials):
+                    r = sim.simulate(wire, burst=args.burst, backend=backend, seed=args.seed + trial,
+                                     chars=len(data), report_us=report_us, pipeline=pipeline)
+                    gaps.extend(r.scan_gap_us)
+                    ok += r.ok
+                    reports += r.hid_reports
+                    p = r.pipeline
+                    if p is not None:
+                        lost += p.edges.overflows
+                        high = max(high, p.hid.high_water)
+                        deferred += p.deferred
+                        inline += p.hid.blocked
+                print("{:<9} {:>6} {:<8} {:>8.2f} {:>8.1f} {:>4} {:>7} {:>5} {:>5} {:>8} {:>7}".format(
+                    backend, report_us, "pipeline" if pipeline else "inline",
+                    sum(gaps) / len(gaps) / 1000, max(gaps) / 1000,
+                    "{}/{}".format(ok, args.trials), reports // args.trials,
+                    lost, high, deferred, inline))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
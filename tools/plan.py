@@ -0,0 +1,625 @@
+"""
+Streaming encoder and transmission planner: text file -> protocol bytes ->
+presser pulse schedule, with exact pulse counts and time estimates.
+
+Every stage is a generator, so a paste of any size is planned in constant
+memory:
+
+  chars()            text, read in chunks
+  events()           protocol bytes as PROTOCOL_DESIGN.md defines them
+                     (printable ASCII, Enter, Tab; with keys=True also
+                     {Ctrl+c}-style key names, sent the way the Teensy's
+                     onKeyPress sends them)
+  merge_modifiers()  drops a modifier release straight followed by a press
+                     of the same modifier, e.g. between {Alt+a}{Alt+b}
+  caps_runs()        sends runs of capitals as PROTO_CAPS_LOCK, lowercase
+                     bytes, PROTO_CAPS_LOCK where that costs fewer bits
+  wire()             the bytes on the link: as they are, packed in
+                     prefix-code mode (huffman_table.py), or as adaptive
+                     rank codes (adaptive.py)
+  frames(), pulses() grouped into frames the way framePending() groups
+                     queued bytes, and the solenoid schedule
+
+Caps lock only pays off where lowercase letters cost fewer bits than
+capitals, i.e. in prefix-code mode; in byte mode every byte is 8 bits and
+the planner never toggles it (nor in adaptive mode, where the cost
+depends on the context). --mode auto plans every mode and keeps the one
+with the fewest pulses, so adaptive mode, which needs text to learn
+from, is only picked where it wins. Caps lock state is assumed off at the start
+and is left off at the end.
+
+--check proves a plan: the HID output the receiver produces from the wire
+bytes (Receiver fed byte by byte, host caps lock state modelled) must
+match the plain, unoptimised byte stream's, and the streamed wire bytes
+and pulses must match what tools.huffman and tools.sim build from the
+whole stream. --simulate also runs the pulses through the simulated
+receiver (slow for long files).
+
+    python -m tools.plan paste.txt
+    python -m tools.plan --mode auto --burst 32 --schedule pulses.txt paste.txt
+    python -m tools.plan --keys --check script.txt
+"""
+
+import argparse
+import itertools
+
+from . import RECEIVER_DIR  # noqa: F401  (puts BinaryKeyboard/ on sys.path)
+from . import sim
+from .adaptive import AdaptiveCoder, gamma
+from .huffman import Codebook
+from adafruit_hid.keycode import Keycode
+from adaptive import END_RANK, AdaptiveDecoder, ContextModel
+from fec import FEC_WORD_BITS, crc8_update, secded_encode
+from huffman import SYM_END, SYM_RAW, PrefixDecoder
+from receiver import (BURST_LEN_BITS, BURST_MAX, MODE_PAD, NAV_MAP, PROTO_ADAPTIVE_MODE,
+                      PROTO_CAPS_LOCK, PROTO_CLEAR_BUFFER, PROTO_HUFFMAN_MODE, Receiver,
+                      ReportHID)
+
+CHUNK_CHARS = 65536  # read size
+RUN_MAX = 256        # bytes of a capitals run weighed at once
+
+MODES = ("byte", "huffman", "adaptive", "auto")
+CODED_MODES = ("byte", "huffman", "adaptive")
+
+# Modifier bytes: press 0x80 + n, release 0x88 + n, n in this order
+MODIFIERS = ("lctrl", "lshift", "lalt", "lgui", "rctrl", "rshift", "ralt", "rgui")
+MOD_PRESS = 0x80
+MOD_RELEASE = 0x88
+MOD_ALIASES = {"ctrl": "lctrl", "control": "lctrl", "shift": "lshift", "alt": "lalt",
+               "option": "lalt", "gui": "lgui", "win": "lgui", "cmd": "lgui", "super": "lgui",
+               "altgr": "ralt"}
+
+KEY_NAMES = {
+    "right": 0x90, "left": 0x91, "down": 0x92, "up": 0x93, "backspace": 0x94,
+    "enter": 0x95, "return": 0x95, "tab": 0x96, "esc": 0x97, "escape": 0x97,
+    "delete": 0x98, "del": 0x98, "insert": 0x99, "ins": 0x99, "home": 0x9A,
+    "end": 0x9B, "pgup": 0x9C, "pageup": 0x9C, "pgdn": 0x9D, "pagedown": 0x9D,
+    "capslock": PROTO_CAPS_LOCK, "space": 0x20,
+}
+KEY_NAMES.update(("f{}".format(n + 1), 0xA0 + n) for n in range(12))
+
+# Bytes caps lock does not change: printable non-letters and navigation keys
+CAPS_NEUTRAL = frozenset(
+    [v for v in range(0x20, 0x7F) if not chr(v).isalpha()] + list(NAV_MAP))
+
+
+# -------------------------
+# Text -> protocol bytes
+# -------------------------
+def chars(path):
+    """Characters of a text file, CHUNK_CHARS at a time."""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        while True:
+            chunk = f.read(CHUNK_CHARS)
+            if not chunk:
+                return
+            yield from chunk
+
+
+def char_byte(ch):
+    """Protocol byte for a character, or -1 (as sim.text_to_bytes maps it)."""
+    if ch == "\n":
+        return 0x95
+    if ch == "\t":
+        return 0x96
+    if 0x20 <= ord(ch) <= 0x7E:
+        return ord(ch)
+    return -1
+
+
+def key_bytes(spec):
+    """Protocol bytes for one {Mod+Mod+key} spec, or None if it is not one.
+
+    Modifiers are pressed, the key typed and the modifiers released in
+    reverse, as onKeyPress does; Ctrl+letter alone is the control byte.
+    """
+    parts = spec.split("+")
+    mods = []
+    for part in parts[:-1]:
+        name = MOD_ALIASES.get(part.lower(), part.lower())
+        if name not in MODIFIERS:
+            return None
+        mods.append(MODIFIERS.index(name))
+    last = parts[-1]
+    name = MOD_ALIASES.get(last.lower(), last.lower())
+    if name in MODIFIERS:
+        # A bare modifier tap, e.g. {Win}
+        mods.append(MODIFIERS.index(name))
+        return ([MOD_PRESS + m for m in mods]
+                + [MOD_RELEASE + m for m in reversed(mods)])
+    if len(last) == 1:
+        key = char_byte(last)
+    else:
+        key = KEY_NAMES.get(last.lower(), -1)
+    if key < 0:
+        return None
+    if mods == [0] and last.isalpha() and len(last) == 1:
+        return [ord(last.lower()) - ord("a") + 1]
+    return [MOD_PRESS + m for m in mods] + [key] + [MOD_RELEASE + m for m in reversed(mods)]
+
+
+class Stats:
+    """Counts kept while a plan streams past."""
+
+    def __init__(self):
+        self.chars = 0
+        self.skipped = 0  # characters with no protocol byte
+        self.events = 0
+        self.merged = 0   # modifier bytes dropped by merge_modifiers()
+        self.caps_runs = 0
+        self.bytes = 0    # protocol bytes after the optimizations
+
+
+def events(text, keys=False, stats=None):
+    """Protocol bytes for a character stream.
+
+    With keys, {name} and {Mod+name} type keys (KEY_NAMES, MODIFIERS, one
+    printable character) and {{ is a literal brace; anything else in
+    braces is typed as text.
+    """
+    stats = stats if stats is not None else Stats()
+    spec = None
+    for ch in text:
+        stats.chars += 1
+        if keys:
+            if spec is not None:
+                if ch == "{" and not spec:
+                    spec = None
+                    stats.events += 1
+                    yield ord("{")
+                    continue
+                if ch != "}" and ch != "\n" and len(spec) < 32:
+                    spec += ch
+                    continue
+                values = key_bytes(spec) if ch == "}" else None
+                if values is None:
+                    # Not a key: type it as it was written
+                    values = [char_byte(c) for c in "{" + spec + ch]
+                spec = None
+                for v in values:
+                    if v >= 0:
+                        stats.events += 1
+                        yield v
+                continue
+            if ch == "{":
+                spec = ""
+                continue
+        v = char_byte(ch)
+        if v < 0:
+            stats.skipped += 1
+            continue
+        stats.events += 1
+        yield v
+    if spec is not None:
+        for c in "{" + spec:
+            stats.events += 1
+            yield char_byte(c)
+
+
+# -------------------------
+# Optimizations
+# -------------------------
+def merge_modifiers(values, stats=None):
+    """Drop a modifier release that a run of modifier bytes presses again.
+
+    Only within a run of modifier bytes, so every key keeps exactly the
+    modifiers it had, and only for a modifier held from before the run: a
+    press followed by its release (a tap, e.g. {Win}) is kept.
+    """
+    stats = stats if stats is not None else Stats()
+    run = []
+    for v in values:
+        if MOD_PRESS <= v < MOD_RELEASE + 8:
+            if v < MOD_RELEASE and v + 8 in run and v not in run:
+                # Held all along: neither byte is needed
+                run.remove(v + 8)
+                stats.merged += 2
+            else:
+                run.append(v)
+            continue
+        if run:
+            yield from run
+            run = []
+        yield v
+    yield from run
+
+
+def caps_runs(values, bits, stats=None):
+    """Send runs of capitals with caps lock on where that is cheaper.
+
+    A run starts at a capital and takes capitals and CAPS_NEUTRAL bytes;
+    it ends at anything else. bits(value) is the cost of one byte. Runs
+    longer than RUN_MAX are weighed RUN_MAX bytes at a time, keeping caps
+    lock on from one piece to the next while it keeps paying.
+    """
+    stats = stats if stats is not None else Stats()
+    toggle = bits(PROTO_CAPS_LOCK)
+    run = []
+    caps = False
+
+    def flush(final):
+        nonlocal caps
+        plain = sum(bits(v) for v in run)
+        lowered = sum(bits(v | 0x20) if 0x41 <= v <= 0x5A else bits(v) for v in run)
+        # Turning it on costs a toggle now, and one at the end of the run
+        if lowered + (0 if caps else 2 * toggle) < plain:
+            if not caps:
+                stats.caps_runs += 1
+                caps = True
+                yield PROTO_CAPS_LOCK
+            for v in run:
+                yield v | 0x20 if 0x41 <= v <= 0x5A else v
+        else:
+            if caps:
+                caps = False
+                yield PROTO_CAPS_LOCK
+            yield from run
+        if final and caps:
+            caps = False
+            yield PROTO_CAPS_LOCK
+        run.clear()
+
+    for v in values:
+        if 0x41 <= v <= 0x5A or (run and v in CAPS_NEUTRAL):
+            run.append(v)
+            if len(run) == RUN_MAX:
+                yield from flush(False)
+            continue
+        if run or caps:
+            yield from flush(True)
+        yield v
+    if run or caps:
+        yield from flush(True)
+
+
+def optimized(text, keys, bits, merge=True, caps=True, stats=None):
+    """events() through whichever optimizations are on."""
+    values = events(text, keys, stats)
+    if merge:
+        values = merge_modifiers(values, stats)
+    if caps:
+        values = caps_runs(values, bits, stats)
+    if stats is not None:
+        values = counted(values, stats)
+    return values
+
+
+def counted(values, stats):
+    for v in values:
+        stats.bytes += 1
+        yield v
+
+
+# -------------------------
+# Bytes -> wire -> pulses
+# -------------------------
+def byte_bits(value):
+    return 8
+
+
+def huffman_wire(values, book):
+    """Prefix-code mode bytes for values: the same bytes as book.encode()."""
+    yield PROTO_HUFFMAN_MODE
+    codes = book.codes
+    raw = codes[SYM_RAW]
+    acc = 0
+    n = 0
+    for v in values:
+        if v in codes:
+            code, length = codes[v]
+        else:
+            code, length = (raw[0] << 8) | v, raw[1] + 8
+        acc = (acc << length) | code
+        n += length
+        while n >= 8:
+            n -= 8
+            yield (acc >> n) & 0xFF
+        acc &= (1 << n) - 1
+    code, length = codes[SYM_END]
+    acc = (acc << length) | code
+    n += length
+    while n >= 8:
+        n -= 8
+        yield (acc >> n) & 0xFF
+    if n:
+        yield (acc << (8 - n)) & 0xFF
+
+
+def adaptive_wire(values):
+    """Adaptive mode bytes for values: the same bytes as
+    tools.adaptive.AdaptiveCoder.encode()."""
+    yield PROTO_ADAPTIVE_MODE
+    model = ContextModel()
+    acc = 0
+    n = 0
+    for v in values:
+        rank = model.context_rank(v)
+        if rank >= 0:
+            codes = (rank + 1,)
+        else:
+            codes = (model.ctx_len[model.prev] + 1, model.global_rank(v) + 1)
+        for code in codes:
+            for b in gamma(code):
+                acc = (acc << 1) | b
+                n += 1
+        if v == PROTO_CLEAR_BUFFER:
+            model.clear()
+        else:
+            model.learn(v)
+        while n >= 8:
+            n -= 8
+            yield (acc >> n) & 0xFF
+        acc &= (1 << n) - 1
+    for code in (model.ctx_len[model.prev] + 1, END_RANK + 1):
+        for b in gamma(code):
+            acc = (acc << 1) | b
+            n += 1
+    while n >= 8:
+        n -= 8
+        yield (acc >> n) & 0xFF
+    if n:
+        yield (acc << (8 - n)) & 0xFF
+
+
+def wire(values, mode, book=None):
+    if mode == "huffman":
+        return huffman_wire(values, book)
+    if mode == "adaptive":
+        return adaptive_wire(values)
+    return values
+
+
+def frames(wire_bytes, burst):
+    """Frames of up to burst bytes (at most BURST_MAX), as lists."""
+    burst = max(1, min(burst, BURST_MAX))
+    it = iter(wire_bytes)
+    while True:
+        group = list(itertools.islice(it, burst))
+        if not group:
+            return
+        yield group
+
+
+def frame_pulses(n, fec=False):
+    """Solenoid pulses for a frame of n bytes."""
+    word = FEC_WORD_BITS if fec else 8
+    pulses = 2 + n * word
+    if n > 1:
+        pulses += FEC_WORD_BITS if fec else BURST_LEN_BITS
+        if fec:
+            pulses += FEC_WORD_BITS  # CRC-8 check word
+    return pulses
+
+
+def pulses(frame_iter, pulse_us=sim.PULSE_US, gap_us=sim.GAP_US, tick_us=sim.TICK_US,
+           fec=False, frame_gap=True):
+    """(key, on_us, off_us) for every pulse, as sim.schedule() times them."""
+    t = 0
+    period = tick_us + pulse_us + gap_us
+    for group in frame_iter:
+        if frame_gap:
+            t += period
+        first = 0 if len(group) == 1 else 1
+        words = []
+        if fec:
+            if len(group) > 1:
+                words.append(secded_encode(len(group) - 1))
+            crc = 0
+            for v in group:
+                words.append(secded_encode(v))
+                crc = crc8_update(crc, v)
+            if len(group) > 1:
+                words.append(secded_encode(crc))
+            width = FEC_WORD_BITS
+        else:
+            if len(group) > 1:
+                words.append(len(group) - 1)
+            words.extend(group)
+            width = 8
+        symbols = [first, 1 - first]
+        for k, word in enumerate(words):
+            n = BURST_LEN_BITS if (not fec and k == 0 and len(group) > 1) else width
+            symbols.extend((word >> i) & 1 for i in range(n - 1, -1, -1))
+        for k, key in enumerate(symbols):
+            # The start symbol's two pulses share one ISR tick
+            if k != 1:
+                t += tick_us
+            yield key, t, t + pulse_us
+            t += pulse_us + gap_us
+
+
+class Totals:
+    """Frames and pulses of a plan, and what they take on the wire."""
+
+    def __init__(self):
+        self.wire = 0
+        self.frames = 0
+        self.pulses = 0
+
+    def count(self, frame_iter, fec=False):
+        for group in frame_iter:
+            self.wire += len(group)
+            self.frames += 1
+            self.pulses += frame_pulses(len(group), fec)
+            yield group
+
+    def time_us(self, pulse_us, gap_us, tick_us, frame_gap=True):
+        """From the first frame to the end of the last pulse's gap."""
+        periods = self.pulses + (self.frames if frame_gap else 0)
+        return periods * (tick_us + pulse_us + gap_us) - self.frames * tick_us
+
+
+def plan(path, mode, args, book, stats=None, totals=None, optimize=True):
+    """Frames for a file, counted into totals."""
+    bits = book.symbol_bits if mode == "huffman" else byte_bits
+    values = optimized(chars(path), args.keys, bits, merge=optimize and not args.no_merge,
+                       caps=optimize and not args.no_caps, stats=stats)
+    totals = totals if totals is not None else Totals()
+    return totals.count(frames(wire(values, mode, book), args.burst), args.fec)
+
+
+def run_totals(path, mode, args, book, optimize=True):
+    stats = Stats()
+    totals = Totals()
+    for _ in plan(path, mode, args, book, stats, totals, optimize):
+        pass
+    return stats, totals
+
+
+# -------------------------
+# Checks
+# -------------------------
+LETTER_KEYS = range(Keycode.A, Keycode.Z + 1)
+SHIFT_BITS = 0x22
+
+
+def host_events(wire_bytes, book=None, adaptive=False):
+    """What the host sees from the receiver typing wire_bytes: one
+    (modifiers, key) per key down, letters as characters with the host's
+    caps lock applied, caps lock taps themselves left out."""
+    reports = []
+    keyboard = sim.SimKeyboard()
+    keyboard.send_report = lambda report: reports.append((report[0], report[2]))
+    keyboard.release_all = lambda: reports.append((0, 0))
+    prefix = PrefixDecoder(book.tree) if book is not None else None
+    rx = Receiver(lambda: 0, None, ReportHID(keyboard, device=keyboard), prefix=prefix,
+                  adaptive=AdaptiveDecoder() if adaptive else None)
+    caps = False
+    down = 0
+    for value in wire_bytes:
+        k = 7
+        while k >= 0 and rx.mode > MODE_PAD:
+            rx.mode_bit((value >> k) & 1)
+            k -= 1
+        rx.deliver(value)
+        for mods, key in reports:
+            if key and key != down:
+                if key == Keycode.CAPS_LOCK:
+                    caps = not caps
+                elif key in LETTER_KEYS:
+                    upper = bool(mods & SHIFT_BITS) != caps
+                    ch = chr((ord("A") if upper else ord("a")) + key - Keycode.A)
+                    yield mods & ~SHIFT_BITS, ch
+                else:
+                    yield mods, key
+            down = key
+        reports.clear()
+
+
+def check(path, mode, args, book):
+    """Problems found with the plan for path, as a list of strings."""
+    problems = []
+    reference = wire(optimized(chars(path), args.keys, byte_bits, False, False), "byte")
+    planned = wire(optimized(chars(path), args.keys,
+                             book.symbol_bits if mode == "huffman" else byte_bits,
+                             not args.no_merge, not args.no_caps), mode, book)
+    typed = host_events(planned, book if mode == "huffman" else None, mode == "adaptive")
+    for n, (a, b) in enumerate(itertools.zip_longest(host_events(reference), typed)):
+        if a != b:
+            problems.append("host input differs at key {}: {} vs {}".format(n, a, b))
+            break
+
+    # Whole-stream cross-checks against the existing encoders
+    values = list(optimized(chars(path), args.keys,
+                            book.symbol_bits if mode == "huffman" else byte_bits,
+                            not args.no_merge, not args.no_caps))
+    streamed = list(wire(iter(values), mode, book))
+    if mode == "huffman":
+        expected = book.encode(values)[0]
+    elif mode == "adaptive":
+        expected = AdaptiveCoder().encode(values)[0]
+    else:
+        expected = values
+    if streamed != expected:
+        problems.append("streamed wire bytes differ from the whole-stream encoder")
+    timing = (args.pulse_us, args.gap_us, args.tick_us)
+    mine = list(pulses(frames(streamed, args.burst), *timing, fec=args.fec,
+                       frame_gap=not args.no_frame_gap))
+    theirs = sim.schedule(streamed, *timing, burst=args.burst, fec=args.fec,
+                          frame_gap=not args.no_frame_gap)[0]
+    if mine != theirs:
+        problems.append("pulse schedule differs from tools.sim.schedule()")
+    if args.simulate:
+        coder = {"huffman": book, "adaptive": AdaptiveCoder()}.get(mode)
+        r = sim.simulate(values, pulse_us=args.pulse_us, gap_us=args.gap_us, tick_us=args.tick_us,
+                         burst=args.burst, fec=args.fec, frame_gap=not args.no_frame_gap,
+                         coder=coder, backend="keypad")
+        if not r.ok:
+            problems.append("simulated receiver decoded {} of {} bytes correctly".format(
+                r.bytes_correct(), len(r.sent)))
+    return problems
+
+
+# -------------------------
+# Command line
+# -------------------------
+def fmt_time(us):
+    s = us / 1e6
+    if s < 120:
+        return "{:.1f}s".format(s)
+    return "{:d}:{:02d}:{:02d}".format(int(s // 3600), int(s % 3600 // 60), int(s % 60))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="text to plan")
+    parser.add_argument("--mode", choices=MODES, default="byte",
+                        help="byte frames, prefix-code or adaptive mode, or whichever takes fewest pulses")
+    parser.add_argument("--burst", type=int, default=sim.BURST_MAX, help="largest burst frame in bytes")
+    parser.add_argument("--fec", action="store_true", help="SECDED codewords (Teensy FEC_FRAMES)")
+    parser.add_argument("--no-frame-gap", action="store_true", help="sender without FRAME_GAP")
+    parser.add_argument("--pulse-us", type=int, default=sim.PULSE_US, help="solenoid on time")
+    parser.add_argument("--gap-us", type=int, default=sim.GAP_US, help="gap between pulses")
+    parser.add_argument("--tick-us", type=int, default=sim.TICK_US, help="presser ISR tick")
+    parser.add_argument("--keys", action="store_true", help="read {Ctrl+c}-style key names")
+    parser.add_argument("--no-merge", action="store_true", help="keep redundant modifier pairs")
+    parser.add_argument("--no-caps", action="store_true", help="never use caps lock for capitals")
+    parser.add_argument("--bytes", help="write the wire bytes (of the last file) here, binary")
+    parser.add_argument("--schedule", help="write the pulses (of the last file) here: key on_us off_us")
+    parser.add_argument("--check", action="store_true", help="verify the plan against the receiver")
+    parser.add_argument("--simulate", action="store_true", help="with --check, also simulate the pulses")
+    args = parser.parse_args(argv)
+
+    book = Codebook.load()
+    timing = (args.pulse_us, args.gap_us, args.tick_us)
+    frame_gap = not args.no_frame_gap
+    print("burst {}{}, pulse {}us gap {}us tick {}us, frame gap {}".format(
+        args.burst, " fec" if args.fec else "", *timing, "on" if frame_gap else "off"))
+    print("{:<24} {:<7} {:>8} {:>8} {:>8} {:>7} {:>9} {:>10} {:>8} {:>6} {:>5}".format(
+        "file", "mode", "chars", "bytes", "wire", "frames", "pulses", "time", "plain", "merged", "caps"))
+    status = 0
+    for path in args.files:
+        mode = args.mode
+        if mode == "auto":
+            costs = {m: run_totals(path, m, args, book)[1].pulses for m in CODED_MODES}
+            mode = min(costs, key=costs.get)
+        stats, totals = run_totals(path, mode, args, book)
+        _, plain = run_totals(path, "byte", args, book, optimize=False)
+        print("{:<24} {:<7} {:>8} {:>8} {:>8} {:>7} {:>9} {:>10} {:>8} {:>6} {:>5}".format(
+            path[-24:], mode, stats.chars, stats.bytes, totals.wire, totals.frames,
+            totals.pulses, fmt_time(totals.time_us(*timing, frame_gap=frame_gap)),
+            fmt_time(plain.time_us(*timing, frame_gap=frame_gap)), stats.merged, stats.caps_runs))
+        if stats.skipped:
+            print("    {} characters have no protocol byte and were skipped".format(stats.skipped))
+        if args.bytes:
+            with open(args.bytes, "wb") as f:
+                for group in plan(path, mode, args, book):
+                    f.write(bytes(group))
+        if args.schedule:
+            with open(args.schedule, "w") as f:
+                for key, on, off in pulses(plan(path, mode, args, book), *timing,
+                                           fec=args.fec, frame_gap=frame_gap):
+                    f.write("{} {} {}\n".format(key, on, off))
+        if args.check:
+            problems = check(path, mode, args, book)
+            for p in problems:
+                print("    CHECK: " + p)
+            if problems:
+                status = 1
+            else:
+                print("    check ok")
+    return status
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,353 @@
+"""
+Tick-accurate model of the Teensy presser's scheduler, for end-to-end runs.
+
+TeensyModel replays keyPresserTeensy4.ino one TICK_US ISR tick at a time:
+enqueueByte() into the 256-byte pending queue (dropping the oldest byte
+when full), framePending() from loop() whenever the symbol ring is empty
+(padding a frame after an idle spell to two idle periods), bufPush() into the 1024-entry symbol ring (dropping the oldest symbol
+when full) and solenoidISR()'s IDLE / pulse / gap states, including the
+idle tick between symbols and PULSE_TICKS - 1 ticks of on time. Bytes
+arrive from the host keyboard at given times. Its schedule() stands in
+for sim.schedule(), so sim.simulate(presser=model) runs the receiver
+against it, and the model keeps what the firmware would have seen: bytes
+and symbols dropped, and the depth of both queues over time.
+
+legacy=True models the firmware before the pending byte queue: every
+byte pushed its START_SYMBOL and 8 bits into the symbol ring straight
+away, so a paste of more than 1023 / 9 = 113 characters overwrote the
+oldest symbols and corrupted frames. spacing_us models an alternative
+ISR that starts a pulse on the other solenoid spacing_us after the last
+one started, even while that one is still on; a solenoid still needs
+GAP_US off before it fires again.
+
+The tool reports, for a paste of growing length, where each firmware
+starts losing or corrupting bytes, then compares schedules end to end:
+correct, wrong and lost bytes, throughput, keystroke-to-decode latency
+and the deepest the pending queue got.
+
+    python -m tools.presser
+    python -m tools.presser --rate-cps 8 --schedules 25000/15000 20000/10000/12000
+    python -m tools.presser --paste 100 113 114 --depth-csv depth.csv
+"""
+
+import argparse
+import difflib
+from collections import deque
+
+from . import sim
+from fec import FEC_WORD_BITS, crc8_update, secded_encode
+from receiver import BURST_LEN_BITS, BURST_MAX
+
+BUF_SIZE = 1024       # symbol ring; holds BUF_SIZE - 1
+BYTE_BUF_SIZE = 256   # pending bytes; holds BYTE_BUF_SIZE - 1
+
+# Symbols (keyPresserTeensy4.ino)
+START_SYMBOL = 2
+BURST_START_SYMBOL = 3
+GAP_SYMBOL = 5
+
+
+class TeensyModel:
+    """The presser firmware's queues and ISR, for bytes arriving at
+    arrival_us[n] (default: all at once, a paste)."""
+
+    def __init__(self, arrival_us=None, legacy=False, spacing_us=0,
+                 buf_size=BUF_SIZE, byte_buf_size=BYTE_BUF_SIZE):
+        self.arrival_us = arrival_us
+        self.legacy = legacy
+        self.spacing_us = spacing_us
+        self.buf_size = buf_size
+        self.byte_buf_size = byte_buf_size
+        self.reset()
+
+    def reset(self):
+        self.dropped_bytes = []    # indices dropped from the pending queue
+        self.dropped_symbols = 0   # symbols overwritten in the ring
+        self.first_corrupt = -1    # first byte that lost a symbol
+        self.depth = []            # (t_us, pending bytes, ring symbols)
+        self.max_pending = 0
+        self.max_symbols = 0
+
+    # -------------------------
+    # loop() context
+    # -------------------------
+    def buf_push(self, symbol, done=()):
+        """bufPush(): done lists the bytes this symbol completes."""
+        ring = self.ring
+        if len(ring) == self.buf_size - 1:
+            lost = ring.popleft()
+            self.dropped_symbols += 1
+            if self.first_corrupt < 0:
+                self.first_corrupt = lost[2]
+        ring.append((symbol, tuple(done), self.owner))
+
+    def push_bits(self, value, bits, done=()):
+        for i in range(bits - 1, -1, -1):
+            self.buf_push((value >> i) & 1, done if i == 0 else ())
+
+    def enqueue(self, index):
+        """enqueueByte()."""
+        if self.legacy:
+            # The old firmware framed every byte on the spot
+            self.owner = index
+            self.buf_push(START_SYMBOL)
+            self.push_bits(self.data[index], 8, (index,))
+            return
+        if len(self.pending) == self.byte_buf_size - 1:
+            self.dropped_bytes.append(self.pending.popleft())
+        self.pending.append(index)
+
+    def frame_pending(self, idle_ticks=0):
+        """framePending(): frame what is queued once the ring is empty,
+        idle_ticks after the ISR ran out of symbols."""
+        pending = self.pending
+        if not pending or self.ring:
+            return
+        data = self.data
+        period = self.period_ticks
+        if idle_ticks > period // 4:
+            # At least two idle periods after an idle spell
+            self.owner = pending[0]
+            while idle_ticks < 2 * period:
+                self.buf_push(GAP_SYMBOL)
+                idle_ticks += period
+        if self.frame_gap:
+            self.owner = pending[0]
+            self.buf_push(GAP_SYMBOL)
+        n = min(len(pending), self.burst)
+        group = [pending.popleft() for _ in range(n)]
+        self.owner = group[0]
+        if n == 1:
+            self.buf_push(START_SYMBOL)
+            if self.fec:
+                self.push_bits(secded_encode(data[group[0]]), FEC_WORD_BITS, group)
+            else:
+                self.push_bits(data[group[0]], 8, group)
+            return
+        self.buf_push(BURST_START_SYMBOL)
+        if self.fec:
+            crc = 0
+            self.push_bits(secded_encode(n - 1), FEC_WORD_BITS)
+            for index in group:
+                self.owner = index
+                self.push_bits(secded_encode(data[index]), FEC_WORD_BITS)
+                crc = crc8_update(crc, data[index])
+            # The receiver types a burst once its check word is in
+            self.push_bits(secded_encode(crc), FEC_WORD_BITS, group)
+            return
+        self.push_bits(n - 1, BURST_LEN_BITS)
+        for index in group:
+            self.owner = index
+            self.push_bits(data[index], 8, (index,))
+
+    def sample(self, t_us):
+        pending = len(self.pending)
+        symbols = len(self.ring)
+        self.depth.append((t_us, pending, symbols))
+        if pending > self.max_pending:
+            self.max_pending = pending
+        if symbols > self.max_symbols:
+            self.max_symbols = symbols
+
+    # -------------------------
+    # ISR
+    # -------------------------
+    def schedule(self, data, pulse_us=sim.PULSE_US, gap_us=sim.GAP_US, tick_us=sim.TICK_US,
+                 burst=BURST_MAX, ternary=False, lanes=0, fec=False, frame_gap=True):
+        """(pulses, last_bit_on, bit_on) as sim.schedule() returns them, for
+        the bytes that made it through; last_bit_on follows data order."""
+        if ternary or lanes:
+            raise ValueError("the presser model sends binary frames only")
+        self.reset()
+        self.data = data
+        self.burst = max(1, min(burst, BURST_MAX))
+        self.fec = fec
+        self.frame_gap = frame_gap and not self.legacy
+        self.ring = deque()
+        self.pending = deque()
+        self.owner = -1
+        pulse_ticks = pulse_us // tick_us
+        gap_ticks = gap_us // tick_us
+        self.period_ticks = pulse_ticks + gap_ticks
+        spacing_ticks = self.spacing_us // tick_us
+        arrivals = self.arrival_us or [0] * len(data)
+
+        pulses = []
+        done_on = {}
+        bit_on = []
+        tick = 0          # next tick the ISR is IDLE
+        free = [0, 0]     # spacing_us: first tick each solenoid may fire again
+        last_start = -(1 << 30)
+        k = 0             # next arrival
+        idle_from = None  # first IDLE tick with nothing to fire
+        while True:
+            # Keystrokes handled by loop() before this tick
+            while k < len(data) and arrivals[k] < tick * tick_us:
+                self.enqueue(k)
+                k += 1
+                idle = 0 if idle_from is None else max(0, arrivals[k - 1] // tick_us - idle_from)
+                self.frame_pending(idle)
+                self.sample(arrivals[k - 1])
+            if not self.ring:
+                if k == len(data):
+                    break
+                # IDLE until loop() frames the next keystroke
+                if idle_from is None:
+                    idle_from = tick
+                tick = max(tick, arrivals[k] // tick_us + 1)
+                continue
+            idle_from = None
+            symbol, done, _ = self.ring.popleft()
+            # The ring may now be empty: loop() frames more right away
+            self.frame_pending()
+            self.sample(tick * tick_us)
+            if symbol in (START_SYMBOL, BURST_START_SYMBOL):
+                first = 0 if symbol == START_SYMBOL else 1
+                keys = (first, 1 - first)
+            elif symbol == GAP_SYMBOL:
+                keys = ()
+            else:
+                keys = (symbol,)
+            if not spacing_ticks:
+                # IDLE pops at tick, the pin goes high on the next one and
+                # low PULSE_TICKS - 1 ticks later, then GAP_TICKS off
+                on = tick + 1
+                for n, key in enumerate(keys):
+                    pulses.append((key, on * tick_us, (on + pulse_ticks - 1) * tick_us))
+                    if n == 0 and len(keys) > 1:
+                        on += pulse_ticks + gap_ticks
+                end = on + pulse_ticks - 1 + gap_ticks
+                tick = end
+            else:
+                on = max(tick + 1, last_start + spacing_ticks)
+                if not keys:
+                    # An idle period as long as the firmware's
+                    on = max(on, last_start + pulse_ticks + gap_ticks + 1)
+                    last_start = on
+                for key in keys:
+                    on = max(on, free[key], last_start + spacing_ticks)
+                    off = on + pulse_ticks - 1
+                    pulses.append((key, on * tick_us, off * tick_us))
+                    free[key] = off + gap_ticks + 1
+                    last_start = on
+                tick = on
+            if keys and symbol not in (START_SYMBOL, BURST_START_SYMBOL):
+                bit_on.append(pulses[-1][1])
+            for index in done:
+                done_on[index] = pulses[-1][1]
+        last_bit_on = [done_on[i] for i in sorted(done_on)]
+        return pulses, last_bit_on, bit_on
+
+
+# -------------------------
+# Measurements
+# -------------------------
+def latencies_us(result, arrival_us):
+    """Keystroke-to-decode time of every decoded byte that lines up with
+    a sent one."""
+    matcher = difflib.SequenceMatcher(None, result.sent, result.decoded, autojunk=False)
+    out = []
+    for block in matcher.get_matching_blocks():
+        for n in range(block.size):
+            out.append(result.decode_us[block.b + n] - arrival_us[block.a + n])
+    return out
+
+
+def arrivals(count, rate_cps):
+    """Keystroke times: all at once for a paste (rate 0), else evenly spaced."""
+    if not rate_cps:
+        return [0] * count
+    return [int(n * 1e6 / rate_cps) for n in range(count)]
+
+
+def parse_schedule(text):
+    """"pulse_us/gap_us[/spacing_us]" -> (pulse_us, gap_us, spacing_us)."""
+    parts = [int(p) for p in text.split("/")]
+    if len(parts) not in (2, 3):
+        raise argparse.ArgumentTypeError("want pulse_us/gap_us[/spacing_us]")
+    return (parts + [0])[:3]
+
+
+def fmt_ms(values):
+    if not values:
+        return "{:>7} {:>7} {:>7}".format("-", "-", "-")
+    values = sorted(values)
+    return "{:>7.0f} {:>7.0f} {:>7.0f}".format(
+        sum(values) / len(values) / 1000, values[len(values) * 95 // 100] / 1000, values[-1] / 1000)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paste", type=int, nargs="+", default=[100, 113, 114, 200, 255, 256, 400],
+                        help="paste lengths to try on each firmware")
+    parser.add_argument("--schedules", type=parse_schedule, nargs="+",
+                        default=[parse_schedule(s) for s in
+                                 ("25000/15000", "25000/10000", "20000/10000",
+                                  "25000/15000/20000", "25000/15000/15000")],
+                        help="pulse_us/gap_us[/spacing_us] to compare end to end")
+    parser.add_argument("--rate-cps", type=float, default=0.0,
+                        help="keystrokes per second from the host keyboard (0 = a paste)")
+    parser.add_argument("--tick-us", type=int, default=sim.TICK_US, help="presser ISR tick")
+    parser.add_argument("--backend", choices=sim.BACKENDS, default="keypad")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--text", help="file to send instead of the built-in sample")
+    parser.add_argument("--depth-csv", help="write t_us,pending,symbols for the first schedule here")
+    args = parser.parse_args(argv)
+
+    if args.text:
+        with open(args.text) as f:
+            text = f.read()
+    else:
+        text = sim.SAMPLE_TEXT
+    data = sim.text_to_bytes(text)
+
+    print("paste of n characters at once, {}us pulse {}us gap".format(sim.PULSE_US, sim.GAP_US))
+    print("{:<8} {:>5} {:>8} {:>9} {:>7} {:>6} {:>6} {:>8}".format(
+        "firmware", "n", "dropped", "symbols", "first", "wrong", "lost", "max_q"))
+    for legacy in (True, False):
+        for n in args.paste:
+            paste = (data * (n // len(data) + 1))[:n]
+            model = TeensyModel(arrivals(n, 0), legacy=legacy)
+            r = sim.simulate(paste, tick_us=args.tick_us, backend=args.backend, seed=args.seed,
+                             burst=BURST_MAX, presser=model)
+            _, wrong, lost = r.alignment()
+            first = model.first_corrupt
+            if model.dropped_bytes:
+                first = model.dropped_bytes[0] if first < 0 else min(first, model.dropped_bytes[0])
+            print("{:<8} {:>5} {:>8} {:>9} {:>7} {:>6} {:>6} {:>8}".format(
+                "legacy" if legacy else "current", n, len(model.dropped_bytes), model.dropped_symbols,
+                first if first >= 0 else "-", wrong, lost,
+                model.max_symbols if legacy else model.max_pending))
+
+    print()
+    print("{} characters, {}, {} backend".format(
+        len(data), "{} keystrokes/s".format(args.rate_cps) if args.rate_cps else "pasted at once",
+        args.backend))
+    print("latency: keystroke to decode, ms mean / p95 / max")
+    print("{:>7} {:>7} {:>7} {:>6} {:>4} {:>6} {:>6} {:>6} {:>7} {:>7} {:>7} {:>6}".format(
+        "pulse", "gap", "spacing", "resync", "ok", "wrong", "lost", "cps", "lat", "p95", "max", "max_q"))
+    first = True
+    for pulse_us, gap_us, spacing_us in args.schedules:
+        # Overlapped pulses space same-key bits unevenly, which the learned
+        # bit period reads as missed pulses: try those without it as well
+        for resync in (True, False) if spacing_us else (True,):
+            when = arrivals(len(data), args.rate_cps)
+            model = TeensyModel(when, spacing_us=spacing_us)
+            r = sim.simulate(data, pulse_us=pulse_us, gap_us=gap_us, tick_us=args.tick_us,
+                             backend=args.backend, seed=args.seed, burst=BURST_MAX, resync=resync,
+                             presser=model)
+            _, wrong, lost = r.alignment()
+            print("{:>7} {:>7} {:>7} {:>6} {:>4} {:>6} {:>6} {:>6.2f} {} {:>6}".format(
+                pulse_us, gap_us, spacing_us or "-", "on" if resync else "off", "yes" if r.ok else "no",
+                wrong, lost, r.cps, fmt_ms(latencies_us(r, when)), model.max_pending))
+            if first and args.depth_csv:
+                with open(args.depth_csv, "w") as f:
+                    f.write("t_us,pending,symbols\n")
+                    for t, pending, symbols in model.depth:
+                        f.write("{},{},{}\n".format(t, pending, symbols))
+            first = False
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,514 @@
+"""
+Replay an edge trace (edgetrace.py) through the receiver, profile it and
+find the edge where decoding went wrong.
+
+Takes a trace saved on the receiver with "f" (edges.bin) or captured from
+the console after "t" (the EDGES BEGIN ... EDGES END block, anywhere in a
+log file). The debounced presses are fed to a Receiver set up the way the
+trace's header says code.py set it up, on a millisecond clock polled
+every SCAN_MS (stepped as pipeline.Pipeline when the header has
+FLAG_PIPELINE), and for each trace it reports:
+
+  stages    host CPU time in debounce (the adafruit_debouncer model run
+            over the raw edges; debouncer traces only), framing (on_press
+            and the rest of poll(), or the capture and decode tasks),
+            process_byte and HID output
+  debounce  delay from the first raw edge to the debounced press, and raw
+            edges per debounced one
+  decode    bytes and frames lost, and against the expected bytes the
+            first place the output differs, with the edge that completed
+            the first wrong byte (or lost the frame) and the edges and
+            receiver state around it
+
+The expected bytes are --expect (text, as tools.plan turns it into
+protocol bytes), --expect-bytes (protocol bytes), or TRACE.expect next to
+the trace. --bless writes TRACE.expect from what the replay decodes, so a
+captured trace becomes a regression case: --check fails if any trace no
+longer decodes to its .expect. The ring keeps only the last edges, so
+expected bytes from before the trace starts are not counted as missing.
+
+The keypad scan interval is not in the header and not replayed: keypad
+events carry the scanner's own timestamps, and what the interval changes
+about them is the debounce, which the header does record.
+
+--make writes a trace from the simulator instead, with the sent bytes as
+its .expect, e.g. with --drop-pulse for a trace that mis-types; --resync
+and --pipeline for the receiver code.py builds with RESYNC or PIPELINE
+on.
+
+    python -m tools.replay edges.bin --expect sent.txt
+    python -m tools.replay console.log --bless
+    python -m tools.replay --check traces/*.bin
+    python -m tools.replay --make /tmp/drop.bin --backend debouncer --drop-pulse 300
+"""
+
+import argparse
+import difflib
+import os
+import time
+
+from . import RECEIVER_DIR
+from . import plan, sim
+from adaptive import AdaptiveDecoder
+from edgetrace import (EDGE_KEY_MASK, EDGE_PRESSED, EDGE_RAW, FLAG_ADAPTIVE, FLAG_DEBOUNCER,
+                       FLAG_FEC, FLAG_HUFFMAN, FLAG_MACROS, FLAG_PIPELINE, FLAG_RESYNC,
+                       TRACE_EDGES, EdgeTrace, from_text, parse)
+from huffman import PrefixDecoder, build_tree
+from macros import load_macros
+from pipeline import Pipeline, QueuedHID
+import receiver
+from receiver import TICKS_MAX, Receiver, ReportHID, ticks_diff
+
+SCAN_MS = 1          # replay poll period
+TAIL_MS = 3000       # polled after the last edge, so timeouts fire
+CONTEXT_EDGES = 12   # trace records shown before the divergence
+
+STAGES = ("debounce", "framing", "process_byte", "hid")
+STATE_NAMES = {v: k[6:] for k, v in vars(receiver).items() if k.startswith("STATE_")}
+
+
+# -------------------------
+# Loading
+# -------------------------
+def load(path):
+    """(setup, edges) from a binary trace or a console capture."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(b"BKE"):
+        data = from_text(data.decode("ascii", "replace").splitlines())
+    return parse(data)
+
+
+def unwrap(edges):
+    """Edge times in ms from the first edge, undoing tick wraparound."""
+    out = []
+    t = 0
+    prev = edges[0][0] if edges else 0
+    for tick, _ in edges:
+        t += ticks_diff(tick, prev)
+        prev = tick
+        out.append(t)
+    return out
+
+
+# -------------------------
+# Replay
+# -------------------------
+class ReplayClock:
+    """ticks_ms for a replay: ms from the first edge, on the trace's ticks."""
+
+    def __init__(self, base):
+        self.base = base
+        self.ms = 0
+
+    def __call__(self):
+        return (self.base + self.ms) & TICKS_MAX
+
+
+class ReplayPins:
+    """Hands the trace's debounced presses to the receiver at their times.
+
+    presses are (ms, key, trace index).
+    """
+
+    settling = False  # the trace's presses are already debounced
+
+    def __init__(self, clock, presses):
+        self.clock = clock
+        self.presses = presses
+        self.pos = 0
+        self.timestamp = 0
+
+    def update(self, now):
+        pass
+
+    def next_press(self):
+        if self.pos == len(self.presses):
+            return -1
+        ms, key, index = self.presses[self.pos]
+        if ms > self.clock.ms:
+            return -1
+        self.pos += 1
+        self.timestamp = (self.clock.base + ms) & TICKS_MAX
+        return key
+
+
+class ReplayReceiver(Receiver):
+    """Receiver that notes, for every byte and lost frame, the trace
+    record of the press behind it (the last press it was handed), and its
+    state at every press.
+
+    Presses reach on_press() in trace order, straight from the pins or
+    through the pipeline's EdgeQueue, so the count of them so far finds
+    the record.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.decoded = []
+        self.decode_edge = []
+        self.lost_edges = []
+        self.press_state = {}  # trace index -> (state, bits) before the press
+        self.pressed = 0
+        self.index = -1
+
+    def on_press(self, i, current_time):
+        self.index = self.pins.presses[self.pressed][2]
+        self.pressed += 1
+        self.press_state[self.index] = (self.state, self.nbits)
+        super().on_press(i, current_time)
+
+    def lose_frame(self):
+        self.lost_edges.append(self.index)
+        super().lose_frame()
+
+    def process_byte(self, value):
+        self.decoded.append(value)
+        self.decode_edge.append(self.index)
+        super().process_byte(value)
+
+
+class Profile:
+    """Host time per stage, each stage's own time only (not the stages
+    it calls into), from wrapped methods."""
+
+    def __init__(self):
+        self.ns = dict.fromkeys(STAGES, 0)
+        self.calls = dict.fromkeys(STAGES, 0)
+        self.stack = []
+        self.mark = 0
+
+    def enter(self, stage):
+        now = time.perf_counter_ns()
+        if self.stack:
+            self.ns[self.stack[-1]] += now - self.mark
+        self.stack.append(stage)
+        self.calls[stage] += 1
+        self.mark = now
+
+    def leave(self):
+        now = time.perf_counter_ns()
+        self.ns[self.stack.pop()] += now - self.mark
+        self.mark = now
+
+    def wrap(self, obj, name, stage):
+        inner = getattr(obj, name)
+
+        def timed(*args):
+            self.enter(stage)
+            try:
+                return inner(*args)
+            finally:
+                self.leave()
+
+        setattr(obj, name, timed)
+
+
+def build_receiver(setup, clock, pins):
+    flags = setup["flags"]
+    prefix = adaptive = macros = None
+    if flags & FLAG_HUFFMAN:
+        import huffman_table
+        prefix = PrefixDecoder(build_tree(huffman_table.LENGTH_COUNTS, huffman_table.SYMBOLS))
+    if flags & FLAG_ADAPTIVE:
+        adaptive = AdaptiveDecoder()
+    if flags & FLAG_MACROS:
+        macros = load_macros(os.path.join(RECEIVER_DIR, "macros.txt"))
+    keyboard = sim.SimKeyboard()
+    hid = ReportHID(keyboard, device=keyboard)
+    if flags & FLAG_PIPELINE:
+        hid = QueuedHID(hid)
+    return ReplayReceiver(clock, pins, hid, prefix=prefix, adaptive=adaptive, macros=macros,
+                          chord_window_ms=setup["chord_window_ms"], lanes=setup["lanes"],
+                          fec=bool(flags & FLAG_FEC), resync=bool(flags & FLAG_RESYNC))
+
+
+def replay(setup, edges, profile):
+    """Run the debounced presses through a receiver; returns it."""
+    times = unwrap(edges)
+    presses = [(t, edge & EDGE_KEY_MASK, n) for n, (t, (_, edge)) in enumerate(zip(times, edges))
+               if edge & EDGE_PRESSED and not edge & EDGE_RAW]
+    clock = ReplayClock(edges[0][0] if edges else 0)
+    pins = ReplayPins(clock, presses)
+    rx = build_receiver(setup, clock, pins)
+    pipeline = setup["flags"] & FLAG_PIPELINE
+    if pipeline:
+        tasks = Pipeline(rx)
+        profile.wrap(tasks, "capture", "framing")
+        profile.wrap(tasks, "decode", "framing")
+        profile.wrap(tasks, "emit", "hid")
+        step = tasks.step
+    else:
+        profile.wrap(rx, "poll", "framing")
+        step = rx.poll
+    profile.wrap(rx, "process_byte", "process_byte")
+    for name in ("tap", "hold", "unhold", "release_all"):
+        profile.wrap(rx.hid, name, "hid")
+    end = (times[-1] if times else 0) + TAIL_MS
+    while clock.ms <= end or (pipeline and rx.hid.count):
+        step()
+        clock.ms += SCAN_MS
+    return rx
+
+
+def debounce_stage(setup, edges, profile):
+    """Run the raw edges through the Debouncer model, timing it.
+
+    Returns (model presses, [delay ms per recorded press], raw edges per
+    recorded debounced edge), or None for a trace without raw edges.
+    """
+    times = unwrap(edges)
+    keys = setup["keys"]
+    raw = [[] for _ in range(keys)]
+    debounced = [[] for _ in range(keys)]
+    for t, (_, edge) in zip(times, edges):
+        key = edge & EDGE_KEY_MASK
+        if key >= keys:
+            continue
+        (raw if edge & EDGE_RAW else debounced)[key].append((t, bool(edge & EDGE_PRESSED)))
+    if not any(raw):
+        return None
+
+    waves = []
+    for spans in raw:
+        wave = sim.Waveform()
+        # Toggle times; a key first seen released was down when the ring began
+        if spans and not spans[0][1]:
+            wave.toggles.append(spans[0][0] * 1000 - 1)
+        wave.toggles.extend(t * 1000 for t, _ in spans)
+        waves.append(wave)
+    clock = sim.SimClock()
+    models = [sim.SimDebouncer(clock, wave, setup["debounce_ms"] * 1000) for wave in waves]
+    model_presses = 0
+    end_us = (times[-1] + 2 * setup["debounce_ms"] + 1) * 1000
+    while clock.us <= end_us:
+        start = time.perf_counter_ns()
+        for m in models:
+            m.update()
+        profile.ns["debounce"] += time.perf_counter_ns() - start
+        profile.calls["debounce"] += len(models)
+        model_presses += sum(1 for m in models if m.fell)
+        clock.us += sim.SCAN_US
+
+    delays = []
+    for spans, presses in zip(raw, debounced):
+        k = 0
+        since = None  # first raw edge after the last debounced one
+        for t, pressed in presses:
+            while k < len(spans) and spans[k][0] <= t:
+                if since is None:
+                    since = spans[k][0]
+                k += 1
+            if pressed and since is not None:
+                delays.append(t - since)
+            since = None
+    n_raw = sum(len(s) for s in raw)
+    n_debounced = sum(len(p) for p in debounced)
+    return model_presses, delays, n_raw / n_debounced if n_debounced else 0.0
+
+
+# -------------------------
+# Divergence
+# -------------------------
+def divergence(expected, decoded):
+    """(tag, expected index, decoded index) of the first difference once
+    the output has lined up with expected, or None. Differences before
+    that are the ring starting mid-transmission."""
+    matcher = difflib.SequenceMatcher(None, expected, decoded, autojunk=False)
+    lined_up = False
+    for tag, a0, _, b0, _ in matcher.get_opcodes():
+        if tag == "equal":
+            lined_up = True
+        elif lined_up:
+            return tag, a0, b0
+    if not lined_up and (expected or decoded):
+        return "replace", 0, 0
+    return None
+
+
+def show_byte(value):
+    ch = chr(value) if 0x20 <= value < 0x7F else "."
+    return "0x{:02X} '{}'".format(value, ch)
+
+
+def show_edges(edges, rx, times, focus, out):
+    lo = max(0, focus - CONTEXT_EDGES)
+    hi = min(len(edges), focus + 3)
+    last_press = None
+    for n in range(lo):
+        _, edge = edges[n]
+        if edge & EDGE_PRESSED and not edge & EDGE_RAW:
+            last_press = times[n]
+    for n in range(lo, hi):
+        _, edge = edges[n]
+        raw = edge & EDGE_RAW
+        pressed = edge & EDGE_PRESSED
+        text = "{:>2} #{:<6} {:>9}ms  key {} {:<4} {:<3}".format(
+            ">>" if n == focus else "", n, times[n], edge & EDGE_KEY_MASK,
+            "down" if pressed else "up", "raw" if raw else "")
+        if pressed and not raw:
+            if last_press is not None:
+                text += " +{:<5}".format("{}ms".format(times[n] - last_press))
+            else:
+                text += "       "
+            last_press = times[n]
+            if n in rx.press_state:
+                state, bits = rx.press_state[n]
+                text += " {} bits {}".format(STATE_NAMES.get(state, state), bits)
+            if n in rx.lost_edges:
+                text += "  frame lost"
+        out("      " + text)
+
+
+def report_divergence(found, expected, rx, edges, times, out):
+    tag, a, b = found
+    decoded = rx.decoded
+    if tag == "delete":
+        # Expected bytes never decoded: the frame they were in was lost
+        focus = rx.decode_edge[b] if b < len(decoded) else len(edges) - 1
+        prev = rx.decode_edge[b - 1] if b else -1
+        lost = [n for n in rx.lost_edges if prev < n <= focus]
+        if lost:
+            focus = lost[0]
+        out("  diverged at expected byte {} {}: missing".format(a, show_byte(expected[a])))
+        out("    frame lost at edge #{}".format(focus) if lost else
+            "    next byte decoded at edge #{}".format(focus))
+    else:
+        focus = rx.decode_edge[b]
+        want = show_byte(expected[a]) if a < len(expected) else "nothing"
+        out("  diverged at expected byte {} {}: decoded {} instead".format(a, want, show_byte(decoded[b])))
+        out("    completed by edge #{} (tick {})".format(focus, edges[focus][0]))
+    show_edges(edges, rx, times, focus, out)
+
+
+# -------------------------
+# Command line
+# -------------------------
+def describe(setup):
+    flags = setup["flags"]
+    names = [name for flag, name in ((FLAG_HUFFMAN, "huffman"), (FLAG_ADAPTIVE, "adaptive"),
+                                     (FLAG_MACROS, "macros"), (FLAG_FEC, "fec"),
+                                     (FLAG_RESYNC, "resync"), (FLAG_PIPELINE, "pipeline"))
+             if flags & flag]
+    return "{}, {} keys{}, chord window {}ms, debounce {}ms{}".format(
+        "debouncer" if flags & FLAG_DEBOUNCER else "keypad", setup["keys"],
+        ", {} lanes".format(setup["lanes"]) if setup["lanes"] else "", setup["chord_window_ms"],
+        setup["debounce_ms"], ", " + " ".join(names) if names else "")
+
+
+def make(args):
+    """Write a simulator trace and its .expect."""
+    if args.text:
+        with open(args.text) as f:
+            data = sim.text_to_bytes(f.read())
+    else:
+        data = sim.text_to_bytes(sim.SAMPLE_TEXT)
+    flags = FLAG_DEBOUNCER if args.backend == "debouncer" else 0
+    if args.resync:
+        flags |= FLAG_RESYNC
+    if args.pipeline:
+        flags |= FLAG_PIPELINE
+    trace = EdgeTrace(args.trace_edges, flags=flags, debounce_ms=sim.DEBOUNCE_US // 1000)
+    r = sim.simulate(data, backend=args.backend, burst=args.burst, seed=args.seed,
+                     jitter_us=args.jitter_us, bounce_us=args.bounce_us,
+                     bounce_count=args.bounce_count, drop_pulse=args.drop_pulse, resync=args.resync,
+                     pipeline=args.pipeline, edge_trace=trace)
+    trace.save(args.make)
+    with open(args.make + ".expect", "wb") as f:
+        f.write(bytes(r.sent))
+    _, wrong, lost = r.alignment()
+    print("{}: {} edges ({} dropped), {} bytes sent, {} wrong, {} lost in the simulation".format(
+        args.make, trace.count, trace.dropped, len(r.sent), wrong, lost))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("traces", nargs="*", help="edges.bin files or console captures")
+    parser.add_argument("--expect", help="text that should have been typed")
+    parser.add_argument("--expect-bytes", help="protocol bytes that should have been decoded")
+    parser.add_argument("--bless", action="store_true", help="write TRACE.expect from this replay")
+    parser.add_argument("--check", action="store_true", help="exit 1 if any trace diverges")
+    parser.add_argument("--make", metavar="TRACE", help="write a trace from the simulator instead")
+    parser.add_argument("--text", help="--make: file to send instead of the built-in sample")
+    parser.add_argument("--backend", choices=sim.BACKENDS, default="debouncer")
+    parser.add_argument("--burst", type=int, default=1)
+    parser.add_argument("--drop-pulse", type=int, default=-1, help="--make: pulse that never lands")
+    parser.add_argument("--jitter-us", type=int, default=0)
+    parser.add_argument("--bounce-us", type=int, default=0)
+    parser.add_argument("--bounce-count", type=int, default=0)
+    parser.add_argument("--resync", action="store_true", help="--make: receiver with RESYNC on")
+    parser.add_argument("--pipeline", action="store_true", help="--make: receiver with PIPELINE on")
+    parser.add_argument("--trace-edges", type=int, default=TRACE_EDGES, help="--make: ring size")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.make:
+        return make(args)
+    if not args.traces:
+        parser.error("give traces to replay, or --make")
+
+    expected_all = None
+    if args.expect:
+        expected_all = list(plan.events(plan.chars(args.expect)))
+    elif args.expect_bytes:
+        with open(args.expect_bytes, "rb") as f:
+            expected_all = list(f.read())
+
+    status = 0
+    for path in args.traces:
+        try:
+            setup, edges = load(path)
+        except (OSError, ValueError) as e:
+            print("{}: {}".format(path, e))
+            status = 1
+            continue
+        print("{}: {} edges{}, {}".format(
+            path, len(edges), " ({} older dropped)".format(setup["dropped"]) if setup["dropped"] else "",
+            describe(setup)))
+        profile = Profile()
+        bounce = debounce_stage(setup, edges, profile)
+        rx = replay(setup, edges, profile)
+        times = unwrap(edges)
+        presses = sum(1 for _, e in edges if e & EDGE_PRESSED and not e & EDGE_RAW)
+        print("  {:.1f}s, {} presses, {} bytes decoded, {} frames lost".format(
+            times[-1] / 1000 if times else 0, presses, len(rx.decoded), len(rx.lost_edges)))
+
+        total = sum(profile.ns.values()) or 1
+        print("  {:<13} {:>9} {:>7} {:>9} {:>6}".format("stage", "host_ms", "calls", "us/press", "share"))
+        for stage in STAGES:
+            if stage == "debounce" and bounce is None:
+                continue
+            print("  {:<13} {:>9.2f} {:>7} {:>9.2f} {:>5.0f}%".format(
+                stage, profile.ns[stage] / 1e6, profile.calls[stage],
+                profile.ns[stage] / 1000 / presses if presses else 0, 100 * profile.ns[stage] / total))
+        if bounce is not None:
+            model_presses, delays, per_edge = bounce
+            if delays:
+                print("  debounce delay {:.1f}ms mean, {}ms max; {:.1f} raw edges per debounced edge;"
+                      " model gives {} of {} presses".format(sum(delays) / len(delays), max(delays),
+                                                             per_edge, model_presses, presses))
+
+        expected = expected_all
+        expect_path = path + ".expect"
+        if args.bless:
+            with open(expect_path, "wb") as f:
+                f.write(bytes(rx.decoded))
+            print("  wrote {}".format(expect_path))
+            continue
+        if expected is None and os.path.exists(expect_path):
+            with open(expect_path, "rb") as f:
+                expected = list(f.read())
+        if expected is None:
+            continue
+        found = divergence(expected, rx.decoded)
+        if found is None:
+            print("  matches the expected bytes")
+        else:
+            report_divergence(found, expected, rx, edges, times, print)
+            status = 1
+    return status if args.check or status else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,106 @@
+"""
+Desync recovery benchmark for the receiver's learned-timing frame abort.
+
+Drops one solenoid pulse at a random point of a transmission and measures
+how long the receiver takes to give up on the broken frame (detect) and
+until it types correctly again for the rest of the run (resync), plus the
+wrong and lost bytes in between. Compares the fixed CLEAR_TIMEOUT_MS
+receiver with the learned bit period, with and without the sender's idle
+period before every frame (Teensy FRAME_GAP).
+
+    python -m tools.resync
+    python -m tools.resync --burst 1 --trials 50
+"""
+
+import argparse
+import difflib
+import random
+
+from . import sim
+
+# (name, receiver resync, sender frame gap)
+SETUPS = (
+    ("timeout", False, False),
+    ("learned", True, False),
+    ("learned+gap", True, True),
+)
+
+
+def recovery(r):
+    """(detect_us, resync_us) after r.drop_us; None where it never happened."""
+    detect = next((t - r.drop_us for t in r.lost_us if t >= r.drop_us), None)
+    # Start of the aligned run that lasts to the end of the transmission
+    matcher = difflib.SequenceMatcher(None, r.sent, r.decoded, autojunk=False)
+    blocks = [b for b in matcher.get_matching_blocks() if b.size]
+    resync = None
+    if blocks and blocks[-1].a + blocks[-1].size == len(r.sent):
+        k = blocks[-1].b
+        # Bytes decoded before the drop were never out of step
+        while k < blocks[-1].b + blocks[-1].size and r.decode_us[k] < r.drop_us:
+            k += 1
+        if k < blocks[-1].b + blocks[-1].size:
+            resync = r.decode_us[k] - r.drop_us
+    return detect, resync
+
+
+def fmt_ms(values):
+    """mean/max in ms of the values that are not None, and how many are."""
+    seen = [v for v in values if v is not None]
+    if not seen:
+        return "{:>17}".format("never")
+    never = len(values) - len(seen)
+    return "{:>7.0f} {:>5.0f}{:>5}".format(
+        sum(seen) / len(seen) / 1000, max(seen) / 1000, "+{}".format(never) if never else "")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--burst", type=int, nargs="+", default=[1, sim.BURST_MAX],
+                        help="largest burst frame sizes to try")
+    parser.add_argument("--period-us", type=int, default=sim.PULSE_US + sim.GAP_US, help="bit period")
+    parser.add_argument("--backend", choices=sim.BACKENDS, default="keypad")
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--text", help="file to send instead of the built-in sample")
+    args = parser.parse_args(argv)
+
+    if args.text:
+        with open(args.text) as f:
+            data = sim.text_to_bytes(f.read())
+    else:
+        data = sim.text_to_bytes(sim.SAMPLE_TEXT)
+    pulse_us = int(args.period_us * sim.PULSE_US / (sim.PULSE_US + sim.GAP_US))
+
+    print("{} bytes, one dropped pulse x {} trials, period {}us, backend {}".format(
+        len(data), args.trials, args.period_us, args.backend))
+    print("times in ms: mean max (+runs where it never happened)")
+    print("{:<5} {:<12} {:>17} {:>17} {:>6} {:>6} {:>6}".format(
+        "burst", "receiver", "detect", "resync", "wrong", "lost", "cps"))
+    for burst in args.burst:
+        pulses = len(sim.schedule(data, burst=burst)[0])
+        for name, resync, frame_gap in SETUPS:
+            rng = random.Random(args.seed)
+            detects, resyncs = [], []
+            wrong = lost = 0
+            cps = 0.0
+            for trial in range(args.trials):
+                # Leave room after the drop to see the receiver recover
+                r = sim.simulate(
+                    data, pulse_us=pulse_us, gap_us=args.period_us - pulse_us, burst=burst,
+                    backend=args.backend, seed=args.seed + trial, tail_us=2500000,
+                    frame_gap=frame_gap, resync=resync, drop_pulse=rng.randrange(pulses * 2 // 3),
+                )
+                detect, resync_us = recovery(r)
+                detects.append(detect)
+                resyncs.append(resync_us)
+                _, w, l = r.alignment()
+                wrong += w
+                lost += l
+                cps += r.cps
+            print("{:<5} {:<12} {} {} {:>6} {:>6} {:>6.2f}".format(
+                burst, name, fmt_ms(detects), fmt_ms(resyncs), wrong, lost, cps / args.trials))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,613 @@
+"""
+Pulse-train simulator for the receiver core.
+
+Builds the contact waveform the presser's solenoids produce on the two key
+switches (start symbol, then 8 data bits MSB first, or a burst, ternary or
+lane frame, as framePending() on the Teensy queues them), optionally adds jitter, contact bounce and dropped
+pulses, and runs receiver.Receiver against it on a simulated clock.
+"""
+
+import bisect
+import difflib
+import random
+import time
+from collections import deque
+
+from . import RECEIVER_DIR  # noqa: F401  (puts BinaryKeyboard/ on sys.path)
+from fec import FEC_WORD_BITS, crc8_update, secded_encode
+from pipeline import Pipeline, QueuedHID
+from receiver import (BURST_LEN_BITS, BURST_MAX, CHORD_WINDOW_MS, DebouncedPins,
+                      KeypadPins, LANE_COUNTS, Receiver, ReportHID, TERNARY_LEN_TRITS, TERNARY_MAX,
+                      TICKS_MAX, TICKS_PERIOD, TRITS_PER_BYTE, ticks_diff)
+from telemetry import Telemetry
+
+# Presser defaults (keyPresserTeensy4.ino)
+PULSE_US = 25000
+GAP_US = 15000
+TICK_US = 25
+
+# Receiver defaults
+DEBOUNCE_US = 10000  # adafruit_debouncer default interval
+SCAN_US = 500        # main loop period on the RP2040
+KEYPAD_SCAN_US = 1000      # code.py KEYPAD_SCAN_INTERVAL
+KEYPAD_DEBOUNCE_SCANS = 10
+KEYPAD_MAX_EVENTS = 64     # keypad.Keys default queue size
+
+BACKENDS = ("debouncer", "keypad")
+
+SAMPLE_TEXT = (
+    "The quick brown fox jumps over the lazy dog.\n"
+    "ls -la ~/projects && git status\n"
+    "def f(x): return {'a': [1, 2, 3]}\n"
+)
+
+
+def text_to_bytes(text):
+    """Map text onto protocol bytes (printable ASCII, Enter, Tab)."""
+    out = []
+    for ch in text:
+        if ch == "\n":
+            out.append(0x95)
+        elif ch == "\t":
+            out.append(0x96)
+        elif 0x20 <= ord(ch) <= 0x7E:
+            out.append(ord(ch))
+    return out
+
+
+# -------------------------
+# Presser schedule
+# -------------------------
+def pulses_per_char(wire, chars, burst=1, ternary=False, lanes=0, fec=False):
+    """Solenoid pulses per character for wire bytes carrying chars characters."""
+    pulses = schedule(wire, burst=burst, ternary=ternary, lanes=lanes, fec=fec)[0]
+    return len(pulses) / chars if chars else 0.0
+
+
+def schedule(data, pulse_us=PULSE_US, gap_us=GAP_US, tick_us=TICK_US, burst=1,
+             ternary=False, lanes=0, fec=False, frame_gap=True):
+    """Nominal solenoid pulses for a byte sequence.
+
+    Returns (pulses, last_bit_on, bit_on) where pulses is a list of
+    (key, on_us, off_us), last_bit_on[n] is the on time of byte n's final
+    data pulse and bit_on lists the on time of every data pulse. Every
+    symbol costs one idle ISR tick before its pulse, as in solenoidISR().
+
+    burst > 1 groups up to that many bytes (at most BURST_MAX) into one burst
+    frame the way framePending() does when bytes are already queued; a group
+    of one byte still goes out as a plain single-byte frame.
+
+    ternary=True sends groups of two or more bytes (at most TERNARY_MAX) as
+    ternary frames instead, and every data pulse of a byte counts as
+    completing it. A pulse that fires several solenoids at once has a
+    tuple of keys, e.g. (0, 1) for a chord.
+
+    lanes=N sends every group (at most BURST_MAX bytes) as a lane frame: a
+    start stroke, then 8 / N strobe strokes per byte for N data lanes.
+
+    fec=True sends every byte of a binary frame, and the burst length, as
+    a SECDED codeword (fec.py) and ends a burst with its CRC-8 codeword;
+    a burst's bytes complete on the last pulse of the check word.
+
+    frame_gap=True leaves one idle symbol period before every frame, as
+    the Teensy's FRAME_GAP does.
+    """
+    if lanes:
+        return lane_schedule(data, pulse_us, gap_us, tick_us, lanes, frame_gap)
+    burst = max(1, min(burst, TERNARY_MAX if ternary else BURST_MAX))
+    pulses = []
+    last_bit_on = []
+    bit_on = []
+    t = 0
+
+    def bits(value, n):
+        nonlocal t
+        for i in range(n - 1, -1, -1):
+            t += tick_us
+            pulses.append(((value >> i) & 1, t, t + pulse_us))
+            on = t
+            t += pulse_us + gap_us
+        return on
+
+    def trits(value, n):
+        nonlocal t
+        for i in range(n - 1, -1, -1):
+            t += tick_us
+            trit = (value // 3 ** i) % 3
+            pulses.append(((0, 1) if trit == 2 else trit, t, t + pulse_us))
+            on = t
+            t += pulse_us + gap_us
+        return on
+
+    for pos in range(0, len(data), burst):
+        group = data[pos:pos + burst]
+        if frame_gap:
+            t += tick_us + pulse_us + gap_us
+        if ternary and len(group) > 1:
+            # Chord start, length, TRITS_PER_BYTE trits per byte
+            trits(2, 1)
+            trits(len(group) - 1, TERNARY_LEN_TRITS)
+            for value in group:
+                on = trits(value, TRITS_PER_BYTE)
+                last_bit_on.append(on)
+                # Coded modes see a ternary byte's bits all at once
+                bit_on.extend([on] * 8)
+            continue
+        # Start symbol: SOL0, gap, SOL1, gap (burst: SOL1 first)
+        first = 0 if len(group) == 1 else 1
+        t += tick_us
+        pulses.append((first, t, t + pulse_us))
+        t += pulse_us + gap_us
+        pulses.append((1 - first, t, t + pulse_us))
+        t += pulse_us + gap_us
+        if fec:
+            if len(group) == 1:
+                on = bits(secded_encode(group[0]), FEC_WORD_BITS)
+                last_bit_on.append(on)
+                bit_on.extend([on] * 8)
+                continue
+            bits(secded_encode(len(group) - 1), FEC_WORD_BITS)
+            crc = 0
+            for value in group:
+                bits(secded_encode(value), FEC_WORD_BITS)
+                crc = crc8_update(crc, value)
+            # A burst is typed once its check word arrives
+            on = bits(secded_encode(crc), FEC_WORD_BITS)
+            last_bit_on.extend([on] * len(group))
+            bit_on.extend([on] * 8 * len(group))
+            continue
+        if len(group) > 1:
+            bits(len(group) - 1, BURST_LEN_BITS)
+        for value in group:
+            last_bit_on.append(bits(value, 8))
+            bit_on.extend(on for _, on, _ in pulses[-8:])
+    return pulses, last_bit_on, bit_on
+
+
+def lane_schedule(data, pulse_us, gap_us, tick_us, lanes, frame_gap=True):
+    """schedule() for a receiver with a strobe (key 0) and lanes data keys."""
+    pulses = []
+    last_bit_on = []
+    bit_on = []
+    t = 0
+
+    def stroke(keys):
+        nonlocal t
+        t += tick_us
+        pulses.append((keys, t, t + pulse_us))
+        on = t
+        t += pulse_us + gap_us
+        return on
+
+    for pos in range(0, len(data), BURST_MAX):
+        if frame_gap:
+            t += tick_us + pulse_us + gap_us
+        # Start: every data lane, no strobe
+        stroke(tuple(range(1, lanes + 1)))
+        for value in data[pos:pos + BURST_MAX]:
+            for i in range(8 - lanes, -1, -lanes):
+                group = value >> i
+                on = stroke((0,) + tuple(k + 1 for k in range(lanes) if group >> k & 1))
+                bit_on.extend([on] * lanes)
+            last_bit_on.append(on)
+    return pulses, last_bit_on, bit_on
+
+
+def inject_errors(pulses, flip_rate=0.0, extra_rate=0.0, rng=None):
+    """Solenoid misfires on a two-key schedule.
+
+    With probability flip_rate a pulse lands on the other key; with
+    probability extra_rate a spurious pulse on a random key follows it,
+    one symbol period later, and delays everything after it by that much.
+    (Pulses that never close a switch are build_waveforms()'s drop_rate.)
+    """
+    rng = rng or random.Random(0)
+    out = []
+    delay = 0
+    for n, (key, on, off) in enumerate(pulses):
+        if flip_rate and key in (0, 1) and rng.random() < flip_rate:
+            key = 1 - key
+        out.append((key, on + delay, off + delay))
+        if extra_rate and n + 1 < len(pulses) and rng.random() < extra_rate:
+            period = pulses[n + 1][1] - on
+            out.append((rng.randrange(2), on + delay + period, off + delay + period))
+            delay += period
+    return out
+
+
+class Waveform:
+    """Contact state of one key switch as a sorted list of toggle times."""
+
+    def __init__(self):
+        self.toggles = []
+
+    def pressed(self, t_us):
+        # An odd number of toggles at or before t means the contact is closed
+        return bisect.bisect_right(self.toggles, t_us) & 1 == 1
+
+
+def build_waveforms(pulses, num_keys=2, jitter_us=0, bounce_us=0, bounce_count=0,
+                    drop_rate=0.0, rng=None, skew_us=0):
+    """Turn nominal pulses into per-key contact waveforms with impairments.
+
+    A pulse with a tuple of keys closes all of them; every key after the
+    first is shifted by up to +/- skew_us (solenoids that do not strike in
+    step) and every edge is jittered on its own.
+    """
+    rng = rng or random.Random(0)
+    closures = [[] for _ in range(num_keys)]
+
+    def close(key, on, off):
+        if drop_rate and rng.random() < drop_rate:
+            return
+        if jitter_us:
+            on += rng.randint(-jitter_us, jitter_us)
+            off += rng.randint(-jitter_us, jitter_us)
+        if off <= on:
+            off = on + 1
+        closures[key].append((on, off))
+
+    for key, on, off in pulses:
+        if isinstance(key, tuple):
+            for n, k in enumerate(key):
+                skew = rng.randint(-skew_us, skew_us) if skew_us and n else 0
+                close(k, on + skew, off + skew)
+        else:
+            close(key, on, off)
+
+    waves = []
+    for spans in closures:
+        wave = Waveform()
+        edges = []
+        slot = bounce_us // (bounce_count + 1) if bounce_count else 0
+        width = max(1, slot // 2)
+        for on, off in sorted(spans):
+            for edge in (on, off):
+                edges.append(edge)
+                # Each bounce is a short open/close pair just after the edge
+                for b in range(bounce_count):
+                    at = edge + (b + 1) * slot
+                    edges.append(at)
+                    edges.append(at + width)
+        edges.sort()
+        wave.toggles = edges
+        waves.append(wave)
+    return waves
+
+
+# -------------------------
+# Simulated backends
+# -------------------------
+class SimClock:
+    """Simulated ticks_ms clock, advanced explicitly by the simulator.
+
+    us counts from the start of the simulation; calling the clock returns
+    millisecond ticks offset by uptime_ms and wrapped like adafruit_ticks,
+    so runs can start days into a session or straddle the wraparound.
+    """
+
+    def __init__(self, uptime_ms=0):
+        self.us = 0
+        self.uptime_ms = uptime_ms
+
+    def __call__(self):
+        return self.ticks_at(self.us)
+
+    def ticks_at(self, us):
+        return (self.uptime_ms + us // 1000) & TICKS_MAX
+
+
+class SimDebouncer:
+    """Model of adafruit_debouncer.Debouncer driven by the simulated clock.
+
+    Same algorithm, millisecond ticks and wraparound handling as the
+    on-device library.
+    """
+
+    def __init__(self, clock, wave, interval_us=DEBOUNCE_US):
+        self.clock = clock
+        self.wave = wave
+        self.interval_ms = interval_us // 1000
+        self.value = True  # pull-up: released reads high
+        self.unstable = True
+        self.changed = False
+        self.last_bounce_ms = 0
+
+    def update(self):
+        now_ms = self.clock()
+        self.changed = False
+        current = not self.wave.pressed(self.clock.us)
+        if current != self.unstable:
+            self.last_bounce_ms = now_ms
+            self.unstable = current
+        elif ticks_diff(now_ms, self.last_bounce_ms) >= self.interval_ms:
+            if current != self.value:
+                self.last_bounce_ms = now_ms
+                self.value = current
+                self.changed = True
+
+    @property
+    def fell(self):
+        return self.changed and not self.value
+
+    @property
+    def rose(self):
+        return self.changed and self.value
+
+
+class SimPin:
+    """Undebounced level of a waveform, like a pulled-up DigitalInOut."""
+
+    def __init__(self, clock, wave):
+        self.clock = clock
+        self.wave = wave
+
+    @property
+    def value(self):
+        return not self.wave.pressed(self.clock.us)
+
+
+class SimKeypadEvent:
+    """Mutable event filled in by SimKeypad.get_into(), like keypad.Event."""
+
+    def __init__(self):
+        self.key_number = 0
+        self.pressed = False
+        self.timestamp = 0
+
+
+class SimKeypad:
+    """Model of keypad.Keys: background scanner plus bounded event queue.
+
+    Scans every interval_us regardless of what the main loop is doing. A key
+    changes state after `threshold` consecutive scans disagree with it, and
+    the event carries the ticks of that scan. When the queue is full new
+    events are lost and overflowed is set, as on the device.
+    """
+
+    def __init__(self, clock, waves, interval_us=KEYPAD_SCAN_US,
+                 threshold=KEYPAD_DEBOUNCE_SCANS, max_events=KEYPAD_MAX_EVENTS, phase_us=0):
+        self.clock = clock
+        self.waves = waves
+        self.key_count = len(waves)
+        self.events = self
+        self.interval_us = interval_us
+        self.threshold = threshold
+        self.max_events = max_events
+        self.next_scan_us = phase_us
+        self.pressed = [False] * len(waves)
+        self.runs = [0] * len(waves)
+        self.queue = deque()
+        self.overflowed = False
+
+    def _scan_until(self, us):
+        while self.next_scan_us <= us:
+            t = self.next_scan_us
+            for k, wave in enumerate(self.waves):
+                if wave.pressed(t) == self.pressed[k]:
+                    self.runs[k] = 0
+                    continue
+                self.runs[k] += 1
+                if self.runs[k] >= self.threshold:
+                    self.pressed[k] = not self.pressed[k]
+                    self.runs[k] = 0
+                    if len(self.queue) < self.max_events:
+                        self.queue.append((k, self.pressed[k], self.clock.ticks_at(t)))
+                    else:
+                        self.overflowed = True
+            self.next_scan_us += self.interval_us
+
+    def get_into(self, event):
+        self._scan_until(self.clock.us)
+        if not self.queue:
+            return False
+        event.key_number, event.pressed, event.timestamp = self.queue.popleft()
+        return True
+
+
+class SimKeyboard:
+    """Stand-in for an adafruit_hid Keyboard and its HID device, counting
+    reports sent.
+
+    Exposes the same report buffer ReportHID writes through, and the
+    device's send_report(); pass it to ReportHID as both.
+    With a clock, every report takes report_us of main loop time, as
+    send_report() waits for the host to poll the endpoint.
+    """
+
+    def __init__(self, clock=None, report_us=0):
+        self.report = bytearray(8)
+        self.reports = 0
+        self.clock = clock
+        self.report_us = report_us
+
+    def send_report(self, report):
+        self.reports += 1
+        if self.clock is not None:
+            self.clock.us += self.report_us
+
+    def release_all(self):
+        for i in range(8):
+            self.report[i] = 0
+        self.send_report(self.report)
+
+
+class SimReceiver(Receiver):
+    """Receiver that records every decoded byte with its decode time."""
+
+    def __init__(self, *args, busy_us=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.busy_us = busy_us
+        self.decoded = []
+        self.decode_us = []
+        self.cpu_ns = []
+        self.lost_us = []
+
+    def lose_frame(self):
+        self.lost_us.append(self.clock.us)
+        super().lose_frame()
+
+    def fill_missed(self, from_time):
+        self.lost_us.append(self.clock.us)
+        return super().fill_missed(from_time)
+
+    def process_byte(self, value):
+        self.decoded.append(value)
+        self.decode_us.append(self.clock.us)
+        start = time.perf_counter_ns()
+        super().process_byte(value)
+        self.cpu_ns.append(time.perf_counter_ns() - start)
+        # Time the device loop spends in HID writes etc. and not scanning
+        self.clock.us += self.busy_us
+
+
+# -------------------------
+# Simulation run
+# -------------------------
+class Result:
+    """Outcome of one simulated transmission."""
+
+    def __init__(self, sent, receiver, last_bit_on, elapsed_us, chars=None):
+        self.sent = sent
+        self.decoded = receiver.decoded
+        self.ok = receiver.decoded == sent
+        self.elapsed_us = elapsed_us
+        # Characters per second over the whole transmission
+        chars = len(sent) if chars is None else chars
+        self.cps = chars * 1e6 / elapsed_us if elapsed_us else 0.0
+        hid = receiver.hid
+        self.hid_reports = getattr(hid, "sink", hid).keyboard.reports
+        self.cpu_ns = receiver.cpu_ns
+        self.fec_corrected = receiver.fec_corrected
+        self.fec_dropped = receiver.fec_dropped
+        self.decode_us = receiver.decode_us
+        self.lost_us = receiver.lost_us  # when the receiver gave up on a frame or filled a pulse in
+        self.drop_us = None  # on time of simulate()'s drop_pulse
+        self.scan_gap_us = []  # between consecutive pin scans
+        self.pipeline = None
+        self.telemetry = None
+        # Decode latency only makes sense for bytes that lined up
+        self.latency_us = []
+        if self.ok:
+            self.latency_us = [d - on for d, on in zip(receiver.decode_us, last_bit_on)]
+
+    def bytes_correct(self):
+        return sum(1 for a, b in zip(self.sent, self.decoded) if a == b)
+
+    def alignment(self):
+        """(correct, wrong, lost): decoded bytes that line up with sent ones,
+        decoded bytes that were never sent, sent bytes never decoded."""
+        matcher = difflib.SequenceMatcher(None, self.sent, self.decoded, autojunk=False)
+        correct = sum(block.size for block in matcher.get_matching_blocks())
+        return correct, len(self.decoded) - correct, len(self.sent) - correct
+
+
+def simulate(data, pulse_us=PULSE_US, gap_us=GAP_US, tick_us=TICK_US,
+             jitter_us=0, bounce_us=0, bounce_count=0, drop_rate=0.0,
+             scan_us=SCAN_US, debounce_us=DEBOUNCE_US, seed=0, tail_us=100000,
+             uptime_ms=0, wrap=False, backend="debouncer", busy_us=0, burst=1,
+             coder=None, chars=None, ternary=False, skew_us=0, chord_window_ms=CHORD_WINDOW_MS,
+             lanes=0, fec=False, flip_rate=0.0, extra_rate=0.0, frame_gap=True, resync=False,
+             drop_pulse=-1, report_us=0, pipeline=False, telemetry=False, presser=None,
+             edge_trace=None):
+    """Send data through the presser model into a SimReceiver.
+
+    backend is "debouncer" (polled Debouncer model) or "keypad" (keypad.Keys
+    model). busy_us stalls the main loop after every decoded byte. burst
+    sets the largest burst frame the presser sends (1 = single-byte frames).
+    coder is a coded-mode encoder (tools.huffman.Codebook or
+    tools.adaptive.AdaptiveCoder): data is sent in that mode and the
+    receiver must decode the coder's header bytes followed by data, or
+    coder.expected(data) if the coder has it (tools.nibble.HexCoder). chars
+    is how many characters data stands for (default len(data)), for cps when
+    data is already compressed, e.g. by tools.lz.
+    ternary=True sends ternary frames (see schedule()) to a receiver with
+    chords enabled at chord_window_ms; skew_us offsets the two solenoids of
+    each chord. lanes=N sends lane frames to a receiver with a strobe and N
+    data keys instead, collecting strokes over the same window.
+    fec=True sends SECDED codewords to a receiver with fec on; flip_rate
+    and extra_rate inject misfires (see inject_errors()). drop_pulse is
+    the index of one pulse that never closes its switch.
+    frame_gap=False sends frames back to back with no idle period;
+    resync=True turns on the receiver's learned timing (missed pulses
+    filled in, lost frames dropped and skipped).
+    report_us is the main loop time every HID report takes. pipeline=True
+    runs the receiver as pipeline.Pipeline, one step of each task per scan.
+    telemetry=True gives the receiver and its ReportHID a Telemetry, left
+    in result.telemetry. presser is a model with schedule() to use in
+    place of schedule() (tools.presser.TeensyModel). edge_trace is an
+    edgetrace.EdgeTrace for the pin source to record into.
+    uptime_ms starts the receiver clock that far into a session; wrap=True
+    instead starts it so the tick counter wraps halfway through the run.
+    """
+    rng = random.Random(seed)
+    sent = list(data)
+    wire = sent
+    options = {}
+    if coder is not None:
+        wire, end_bits = coder.encode(data)
+        if hasattr(coder, "expected"):
+            sent = coder.expected(data)
+        else:
+            sent = wire[:len(end_bits) - len(data)] + sent
+        options = coder.receiver_options()
+    if ternary or lanes:
+        options["chord_window_ms"] = chord_window_ms
+    if lanes:
+        options["lanes"] = lanes
+    if fec:
+        options["fec"] = True
+    if resync:
+        options["resync"] = True
+    num_keys = lanes + 1 if lanes else 2
+    plan = schedule if presser is None else presser.schedule
+    pulses, last_bit_on, bit_on = plan(wire, pulse_us, gap_us, tick_us, burst, ternary, lanes, fec, frame_gap)
+    if flip_rate or extra_rate:
+        pulses = inject_errors(pulses, flip_rate, extra_rate, rng)
+    drop_us = None
+    if drop_pulse >= 0:
+        drop_us = pulses[drop_pulse][1]
+        pulses = pulses[:drop_pulse] + pulses[drop_pulse + 1:]
+    if coder is not None:
+        # Codes are decoded on the bit that completes them, not per byte
+        last_bit_on = [bit_on[b] for b in end_bits]
+    waves = build_waveforms(pulses, num_keys, jitter_us, bounce_us, bounce_count, drop_rate, rng, skew_us)
+
+    end_us = (pulses[-1][2] if pulses else 0) + tail_us
+    if wrap:
+        uptime_ms = TICKS_PERIOD - end_us // 2000
+    clock = SimClock(uptime_ms)
+    if backend == "keypad":
+        scanner = SimKeypad(clock, waves, threshold=max(1, debounce_us // KEYPAD_SCAN_US),
+                            phase_us=rng.randrange(KEYPAD_SCAN_US))
+        pins = KeypadPins(scanner, SimKeypadEvent(), edge_trace)
+    else:
+        pins = DebouncedPins([SimDebouncer(clock, wave, debounce_us) for wave in waves],
+                             edge_trace, [SimPin(clock, wave) for wave in waves])
+    tm = None
+    if telemetry:
+        tm = Telemetry(clock)
+        options["telemetry"] = tm
+    keyboard = SimKeyboard(clock, report_us)
+    hid = ReportHID(keyboard, tm, device=keyboard)
+    if pipeline:
+        hid = QueuedHID(hid)
+    rx = SimReceiver(clock, pins, hid, busy_us=busy_us, **options)
+    step = Pipeline(rx).step if pipeline else rx.poll
+
+    # Start the scan at a random phase so results do not hinge on alignment
+    clock.us = rng.randrange(scan_us)
+    scans = []
+    while clock.us < end_us or (pipeline and hid.count):
+        scans.append(clock.us)
+        step()
+        clock.us += scan_us
+    scans.append(clock.us)
+    result = Result(sent, rx, last_bit_on, end_us - tail_us,
+                    chars=len(data) if chars is None else chars)
+    result.drop_us = drop_us
+    result.scan_gap_us = [b - a for a, b in zip(scans, scans[1:])]
+    if pipeline:
+        result.pipeline = step.__self__
+    result.telemetry = tm
+    return result
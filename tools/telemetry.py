@@ -0,0 +1,83 @@
+"""
+What the receiver's telemetry shows as a presser drifts out of timing.
+
+Sends the same text at a range of bit periods (the presser's PULSE_US and
+GAP_US scaled together) with telemetry on, and summarises each run from
+its binary record, decoded with telemetry.unpack() the way a collector
+would: frames, desyncs, start-symbol timeouts and unknown bytes, and the
+median and 95th percentile of the press interval, frame time and edge-to-
+report latency histograms (as bucket upper edges in ms). --lines prints
+each run's line-protocol records as well.
+
+    python -m tools.telemetry
+    python -m tools.telemetry --periods-us 40000 20000 --drop-rate 0.003 --lines
+"""
+
+import argparse
+
+from . import sim
+from telemetry import (CNT_DESYNCS, CNT_FRAMES, CNT_START_TIMEOUTS, CNT_UNKNOWN,
+                       HIST_EDGES, HIST_FRAME, HIST_INTERVAL, HIST_LATENCY, unpack)
+
+
+def percentile(buckets, edges, q):
+    """Upper edge of the bucket holding the q quantile, as text."""
+    total = sum(buckets)
+    if not total:
+        return "-"
+    seen = 0
+    for i, n in enumerate(buckets):
+        seen += n
+        if seen >= q * total:
+            return str(edges[i]) if i < len(edges) else ">{}".format(edges[-1])
+    return "-"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--periods-us", type=int, nargs="+", default=[40000, 30000, 24000, 20000],
+                        help="bit periods to send at")
+    parser.add_argument("--backend", choices=sim.BACKENDS, default="keypad")
+    parser.add_argument("--burst", type=int, default=1, help="largest burst frame in bytes")
+    parser.add_argument("--report-us", type=int, default=1000, help="main loop time per HID report")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="pulses that never close the switch")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--lines", action="store_true", help="print the line-protocol records")
+    parser.add_argument("--text", help="file to send instead of the built-in sample")
+    args = parser.parse_args(argv)
+
+    if args.text:
+        with open(args.text) as f:
+            data = sim.text_to_bytes(f.read())
+    else:
+        data = sim.text_to_bytes(sim.SAMPLE_TEXT)
+
+    print("{} bytes, burst {}, backend {}, {}us per HID report, drop rate {}".format(
+        len(data), args.burst, args.backend, args.report_us, args.drop_rate))
+    print("percentiles are bucket upper edges in ms")
+    print("{:>9} {:>4} {:>6} {:>7} {:>5} {:>7} {:>13} {:>11} {:>12}".format(
+        "period_us", "ok", "frames", "desyncs", "start", "unknown",
+        "interval50/95", "frame50/95", "latency50/95"))
+    for period_us in args.periods_us:
+        pulse_us = period_us * sim.PULSE_US // (sim.PULSE_US + sim.GAP_US)
+        r = sim.simulate(data, pulse_us=pulse_us, gap_us=period_us - pulse_us, burst=args.burst,
+                         backend=args.backend, seed=args.seed, drop_rate=args.drop_rate,
+                         report_us=args.report_us, telemetry=True)
+        _, counters, hists = unpack(bytes(r.telemetry.pack()))
+
+        def spread(h):
+            return "{}/{}".format(percentile(hists[h][0], HIST_EDGES[h], 0.5),
+                                  percentile(hists[h][0], HIST_EDGES[h], 0.95))
+
+        print("{:>9} {:>4} {:>6} {:>7} {:>5} {:>7} {:>13} {:>11} {:>12}".format(
+            period_us, "yes" if r.ok else "no", counters[CNT_FRAMES], counters[CNT_DESYNCS],
+            counters[CNT_START_TIMEOUTS], counters[CNT_UNKNOWN],
+            spread(HIST_INTERVAL), spread(HIST_FRAME), spread(HIST_LATENCY)))
+        if args.lines:
+            for line in r.telemetry.lines():
+                print("    " + line)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())